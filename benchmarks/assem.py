@@ -0,0 +1,139 @@
+"""
+Throughput of the integer assembler against the original string-based asm,
+checking both agree, and of assembling whole programs from text.
+
+    python benchmarks/assem.py
+"""
+import random
+import timeit
+
+from pyriscv.assem import ASM_INSTR_FORMATS, asm, assemble
+from pyriscv.rv32i import Regs
+from pyriscv.utils import bitfield_slice, bits_to_int, int_to_bits
+
+
+
+
+def legacy_asm(instr: str, rd: Regs | None = None, rs1: Regs | None = None,
+        rs2: Regs | None = None, imm: int | None = None) -> int:
+    """asm prior to integer encoding, using binary strings"""
+    typ, opcode_bits = ASM_INSTR_FORMATS[instr]
+    funct7, funct3, opcode = opcode_bits.split("_")
+
+    if rd is not None:
+        rd = int_to_bits(rd, 5)
+    if rs1 is not None:
+        rs1 = int_to_bits(rs1, 5)
+    if rs2 is not None:
+        rs2 = int_to_bits(rs2, 5)
+
+    match typ:
+        case "R":
+            bits = funct7 + rs2 + rs1 + funct3 + rd + opcode
+        case "I":
+            if instr in ("slli", "srli", "srai"):
+                funct7 = 0x20 if instr == "srai" else 0x00
+                imm_i = int_to_bits(funct7, 7) + int_to_bits(imm, 5)
+            else:
+                imm_i = int_to_bits(imm, 12)
+            bits = imm_i + rs1 + funct3 + rd + opcode
+        case "U":
+            imm_u = int_to_bits(imm, 20)
+            bits = imm_u + rd + opcode
+        case "S":
+            imm_s = int_to_bits(imm, 12)
+            bits = (
+                bitfield_slice(imm_s, 11, 5)
+                + rs2
+                + rs1
+                + funct3
+                + bitfield_slice(imm_s, 4, 0)
+                + opcode
+            )
+        case "J":
+            imm_j = int_to_bits(imm, 21)
+            bits = (
+                bitfield_slice(imm_j, 20, 20)
+                + bitfield_slice(imm_j, 10, 1)
+                + bitfield_slice(imm_j, 11, 11)
+                + bitfield_slice(imm_j, 19, 12)
+                + rd
+                + opcode
+            )
+        case "B":
+            imm_b = int_to_bits(imm, 13)
+            bits = (
+                bitfield_slice(imm_b, 12, 12)
+                + bitfield_slice(imm_b, 10, 5)
+                + rs2
+                + rs1
+                + funct3
+                + bitfield_slice(imm_b, 4, 1)
+                + bitfield_slice(imm_b, 11, 11)
+                + opcode
+            )
+
+    return bits_to_int(bits)
+
+
+def random_instrs(count: int, seed: int = 0) -> list[tuple[str, dict]]:
+    rng = random.Random(seed)
+    instrs = []
+    for _ in range(count):
+        name = rng.choice(list(ASM_INSTR_FORMATS))
+        typ = ASM_INSTR_FORMATS[name][0]
+        regs = {"rd": Regs(rng.randrange(32)), "rs1": Regs(rng.randrange(32)), "rs2": Regs(rng.randrange(32))}
+        match typ:
+            case "R":
+                imm = None
+            case "I" if name in ("slli", "srli", "srai"):
+                imm = rng.randrange(32)
+            case "I" | "S":
+                imm = rng.randrange(-2048, 2048)
+            case "B":
+                imm = rng.randrange(-2048, 2048) * 2
+            case "U":
+                imm = rng.randrange(1 << 20)
+            case "J":
+                imm = rng.randrange(-(1 << 19), 1 << 19) * 2
+        instrs.append((name, {**regs, "imm": imm}))
+    return instrs
+
+
+def random_source(count: int, seed: int = 0) -> str:
+    """Straight-line ALU code with loops, calls and constants, as generated test programs use"""
+    rng = random.Random(seed)
+    lines = ["_start:"]
+    for block in range(count // 8):
+        lines += [
+            f"block{block}:",
+            f"    li a0, {rng.randrange(-(1 << 31), 1 << 31)}",
+            f"    addi a1, a0, {rng.randrange(-2048, 2048)}",
+            f"    xor a2, a1, a0",
+            f"    sw a2, {4 * rng.randrange(16)}(sp)",
+            f"    bnez a2, block{rng.randrange(count // 8)}",
+            f"    call block{rng.randrange(count // 8)}",
+        ]
+    lines.append("    ebreak")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    instrs = random_instrs(20000)
+    mismatches = [(name, args) for name, args in instrs if legacy_asm(name, **args) != asm(name, **args)]
+    assert not mismatches, f"Assemblers disagree for: {mismatches[:10]}"
+
+    before = min(timeit.repeat(lambda: [legacy_asm(name, **args) for name, args in instrs], number=1, repeat=5))
+    after = min(timeit.repeat(lambda: [asm(name, **args) for name, args in instrs], number=1, repeat=5))
+    print(f"string asm:  {len(instrs) / before:12,.0f} instr/s")
+    print(f"integer asm: {len(instrs) / after:12,.0f} instr/s ({before / after:.1f}x)")
+
+    source = random_source(800)
+    program = assemble(source)
+    seconds = min(timeit.repeat(lambda: assemble(source), number=1, repeat=5))
+    print(f"assemble:    {len(program.data) // 4 / seconds:12,.0f} instr/s, "
+          f"{1 / seconds:,.0f} programs/s of {len(program.data) // 4} instructions")
+
+
+if __name__ == "__main__":
+    main()
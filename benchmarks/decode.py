@@ -0,0 +1,87 @@
+"""
+Microbenchmark for RV32I.decode.
+Compares against the original string-based decoder and checks both agree.
+Decodes are interned by word, so the integer decoder is timed both without the
+cache and on cache hits, which is what repeated words in an image cost.
+
+    python benchmarks/decode.py
+"""
+import random
+import timeit
+
+from pyriscv.rv32i import DecodedInstr, Opcodes, Regs, RV32I, decode_word
+import pyriscv.utils as u
+
+
+def legacy_decode(instr: int) -> DecodedInstr:
+    """Decoder prior to integer field extraction, using binary strings"""
+    bits = u.int_to_bits(instr, 32)
+
+    opcode_bits, rd_bits, funct3_bits, rs1_bits, rs2_bits, funct7_bits = (
+        u.split_bitfield(bits, (7, 5, 3, 5, 5, 7))
+    )
+    opcode = Opcodes(u.bits_to_uint(opcode_bits))
+    rd = Regs(u.bits_to_uint(rd_bits))
+    funct3 = u.bits_to_uint(funct3_bits)
+    rs1 = Regs(u.bits_to_uint(rs1_bits))
+    rs2 = Regs(u.bits_to_uint(rs2_bits))
+    funct7 = u.bits_to_uint(funct7_bits)
+    imm = None
+
+    match opcode:
+        case Opcodes.OP:
+            pass
+        case Opcodes.OP_IMM | Opcodes.LOAD | Opcodes.JALR | Opcodes.MISC_MEM | Opcodes.SYSTEM:
+            imm = u.bits_to_int(u.bitfield_slice(bits, 31, 20))
+        case Opcodes.STORE:
+            imm = u.bits_to_int(u.bitfield_slice(bits, 31, 25) + u.bitfield_slice(bits, 11, 7))
+        case Opcodes.BRANCH:
+            imm = u.bits_to_int(
+                u.bitfield_slice(bits, 31, 31)
+                + u.bitfield_slice(bits, 7, 7)
+                + u.bitfield_slice(bits, 30, 25)
+                + u.bitfield_slice(bits, 11, 8)
+                + "0"
+            )
+        case Opcodes.JAL:
+            imm = u.bits_to_int(
+                u.bitfield_slice(bits, 31, 31)
+                + u.bitfield_slice(bits, 19, 12)
+                + u.bitfield_slice(bits, 20, 20)
+                + u.bitfield_slice(bits, 30, 21)
+                + "0"
+            )
+        case Opcodes.LUI | Opcodes.AUIPC:
+            imm = u.bits_to_int(u.bitfield_slice(bits, 31, 12))
+
+    return DecodedInstr(opcode, rd, rs1, rs2, funct3, funct7, imm)
+
+
+def random_instrs(count: int, seed: int = 0) -> list[int]:
+    rng = random.Random(seed)
+    opcodes = list(Opcodes)
+    return [(rng.getrandbits(25) << 7) | rng.choice(opcodes) for _ in range(count)]
+
+
+def bench(decode, instrs: list[int], repeat: int = 5) -> float:
+    """Return decoded instructions per second"""
+    best = min(timeit.repeat(lambda: [decode(instr) for instr in instrs], number=1, repeat=repeat))
+    return len(instrs) / best
+
+
+def main() -> None:
+    instrs = random_instrs(20000)
+
+    mismatches = [instr for instr in instrs if legacy_decode(instr) != RV32I.decode(instr)]
+    assert not mismatches, f"Decoders disagree for: {[hex(instr) for instr in mismatches[:10]]}"
+
+    before = bench(legacy_decode, instrs)
+    uncached = bench(decode_word.__wrapped__, instrs)
+    cached = bench(RV32I.decode, instrs)  # Every word was decoded by the agreement check
+    print(f"string decode:   {before:12,.0f} instr/s")
+    print(f"integer decode:  {uncached:12,.0f} instr/s ({uncached / before:.1f}x)")
+    print(f"interned decode: {cached:12,.0f} instr/s ({cached / before:.1f}x, cache hits)")
+
+
+if __name__ == "__main__":
+    main()
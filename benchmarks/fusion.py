@@ -0,0 +1,61 @@
+"""
+Interpreter with and without superinstruction fusion on start-up style code,
+copying and clearing RAM in word loops like firmware/start.S.
+
+    python benchmarks/fusion.py
+"""
+import time
+
+from pyriscv.assem import FIXED_WORDS, asm
+from pyriscv.rv32i import Regs as R, RV32I
+
+
+EBREAK = FIXED_WORDS["ebreak"]
+
+PROGRAM = [
+    asm("lui", R.X20, imm=0x90000),
+    asm("addi", R.X21, R.X0, imm=100),
+    # outer:
+    asm("auipc", R.X10, imm=0),  # Copy from ROM
+    asm("addi", R.X10, R.X10, imm=0),
+    asm("addi", R.X11, R.X20, imm=0),
+    asm("addi", R.X12, R.X20, imm=1024),
+    # copy:
+    asm("lw", R.X13, R.X10, imm=0),
+    asm("sw", rs1=R.X11, rs2=R.X13, imm=0),
+    asm("addi", R.X10, R.X10, imm=4),
+    asm("addi", R.X11, R.X11, imm=4),
+    asm("blt", rs1=R.X11, rs2=R.X12, imm=-16),
+    asm("addi", R.X12, R.X12, imm=1024),
+    # fill:
+    asm("sw", rs1=R.X11, rs2=R.X0, imm=0),
+    asm("addi", R.X11, R.X11, imm=4),
+    asm("blt", rs1=R.X11, rs2=R.X12, imm=-8),
+    asm("addi", R.X21, R.X21, imm=-1),
+    asm("bne", rs1=R.X21, rs2=R.X0, imm=-56),
+    EBREAK,
+]
+PROG_BYTES = b"".join((instr & 0xFFFFFFFF).to_bytes(4, "little") for instr in PROGRAM)
+
+
+def run(fuse: bool) -> tuple[RV32I, float]:
+    rv = RV32I()
+    rv.set_pc(rv.memory.load_program(PROG_BYTES))
+    start = time.perf_counter()
+    rv.run_program(fuse=fuse)
+    return rv, time.perf_counter() - start
+
+
+def main() -> None:
+    expected, interp_time = run(fuse=False)
+    rv, fused_time = run(fuse=True)
+    assert rv.xregs == expected.xregs and rv.instret == expected.instret
+
+    print(f"instructions: {rv.instret}")
+    print(f"interpreter:  {interp_time:.3f} s")
+    print(f"fused:        {fused_time:.3f} s ({interp_time / fused_time:.1f}x)")
+    print(rv.fuser.report())
+
+
+if __name__ == "__main__":
+    main()
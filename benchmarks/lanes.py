@@ -0,0 +1,63 @@
+"""
+Throughput of LaneGroup against running RV32I once per input.
+Uses the same program for every lane, so all lanes stay in lockstep.
+
+    python benchmarks/lanes.py
+"""
+import time
+
+from pyriscv.assem import FIXED_WORDS, asm
+from pyriscv.lanes import LaneGroup
+from pyriscv.rv32i import Regs as R, RV32I
+
+
+EBREAK = FIXED_WORDS["ebreak"]
+
+# Sums x10 * i for i in 0..199 into x5, storing the running total
+PROGRAM = [
+    asm("lui", R.X20, imm=0x90000),
+    asm("addi", R.X5, R.X0, imm=0),
+    asm("addi", R.X6, R.X0, imm=0),
+    asm("addi", R.X7, R.X0, imm=200),
+    # loop:
+    asm("add", R.X5, R.X5, R.X10),
+    asm("sw", rs1=R.X20, rs2=R.X5, imm=0),
+    asm("addi", R.X6, R.X6, imm=1),
+    asm("blt", rs1=R.X6, rs2=R.X7, imm=-12),
+    EBREAK,
+]
+PROG_BYTES = b"".join((instr & 0xFFFFFFFF).to_bytes(4, "little") for instr in PROGRAM)
+
+
+def run_interpreter(inputs: range) -> float:
+    start = time.perf_counter()
+    for value in inputs:
+        rv = RV32I()
+        rv.set_pc(rv.memory.load_program(PROG_BYTES))
+        rv.set_reg(R.X10, value)
+        rv.run_program()
+    return time.perf_counter() - start
+
+
+def run_lanes(inputs: range) -> float:
+    start = time.perf_counter()
+    lanes = LaneGroup(len(inputs))
+    lanes.load_program(PROG_BYTES)
+    lanes.regs[:, R.X10] = inputs
+    lanes.run_program()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    for num_lanes in (1, 16, 256, 4096):
+        inputs = range(num_lanes)
+        lanes_time = run_lanes(inputs)
+        # Interpreter time scales linearly, so estimate from a subset for large counts
+        sample = inputs[:64]
+        interp_time = run_interpreter(sample) * num_lanes / len(sample)
+        print(f"{num_lanes:5} lanes: {lanes_time:7.3f}s, interpreter {interp_time:7.3f}s "
+              f"({interp_time / lanes_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Start-up cost of the pyriscv CLI.
+Reports import time from `python -X importtime` and wall time for running a
+tiny program end to end, against a bare interpreter start.
+
+    python benchmarks/startup.py
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from pyriscv.assem import FIXED_WORDS
+
+
+EBREAK = FIXED_WORDS["ebreak"]
+
+RUN_CLI = "import sys; from pyriscv.cli import pyriscv; sys.argv[1:] = [sys.argv[-1]]; pyriscv()"
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Cumulative import time in microseconds for every module imported by module"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def wall_time(args: list[str], repeat: int = 10) -> float:
+    """Best wall time over repeat runs, in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    times = import_times("pyriscv.cli")
+    print(f"import pyriscv.cli: {times['pyriscv.cli'] / 1000:6.1f} ms")
+    print(f"numpy imported:     {'numpy' in times}")
+
+    with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as f:
+        f.write(EBREAK.to_bytes(4, "little"))
+    try:
+        bare = wall_time(["-c", "pass"])
+        run = wall_time(["-c", RUN_CLI, f.name])
+    finally:
+        os.remove(f.name)
+    print(f"python -c pass:     {bare * 1000:6.1f} ms")
+    print(f"pyriscv ebreak.bin: {run * 1000:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
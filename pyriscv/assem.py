@@ -1,5 +1,21 @@
+"""
+Assembler for RV32I, used to build test programs without a toolchain.
+
+asm encodes one instruction from keyword arguments. assemble takes a small
+GNU-style assembly text, or a list of its lines, with labels, the .word,
+.zero and .align directives and the common pseudo-instructions. Labels are
+resolved in two passes. The first pass lays out every line, and each line
+always expands to the same number of instructions, so the second pass can
+encode it once every label address is known. assemble rejects immediates and
+offsets that don't fit their instruction, while asm masks them to their fields.
+"""
+from dataclasses import dataclass
+import re
+import struct
+import typing as t
+
 from pyriscv.rv32i import Regs
-from pyriscv.utils import int_to_bits, bits_to_int, bitfield_slice
+import pyriscv.utils as u
 
 
 ASM_INSTR_FORMATS = {
@@ -42,64 +58,330 @@ ASM_INSTR_FORMATS = {
     "and": ("R", "0000000_111_0110011"),
 }
 
+# (format, opcode, funct3, funct7) of each instruction
+ENCODINGS = {
+    name: (typ, int(opcode, 2), int(funct3, 2) if funct3 != "???" else 0,
+           0x20 if funct7 == "0100000" or name == "srai" else 0)
+    for name, (typ, pattern) in ASM_INSTR_FORMATS.items()
+    for funct7, funct3, opcode in [pattern.split("_")]
+}
+SHIFTS = ("slli", "srli", "srai")
+OFFSET_FORMS = ("lb", "lh", "lw", "lbu", "lhu", "jalr")  # I-type instructions written rd, offset(rs1)
 
-def asm(instr: str, rd: Regs | None = None, rs1: Regs | None = None,
-        rs2: Regs | None = None, imm: int | None = None) -> int:
-    """Converts assembly instruction to binary"""
-    typ, opcode_bits = ASM_INSTR_FORMATS[instr]
-    funct7, funct3, opcode = opcode_bits.split("_")
+FIXED_WORDS = {"ecall": 0x00000073, "ebreak": 0x00100073, "fence": 0x0FF0000F}  # fence iorw, iorw
+FENCE_BITS = {"i": 0x8, "o": 0x4, "r": 0x2, "w": 0x1}
+
+# Inclusive range of the immediate or offset of each format, and whether it must be even
+IMM_RANGES = {
+    "I": (-2048, 2047, False),
+    "S": (-2048, 2047, False),
+    "B": (-4096, 4094, True),
+    "U": (0, 0xFFFFF, False),
+    "J": (-(1 << 20), (1 << 20) - 2, True),
+}
+COUNTER_CSRS = {"rdcycle": 0xC00, "rdtime": 0xC01, "rdinstret": 0xC02}
 
-    if rd is not None:
-        rd = int_to_bits(rd, 5)
-    if rs1 is not None:
-        rs1 = int_to_bits(rs1, 5)
-    if rs2 is not None:
-        rs2 = int_to_bits(rs2, 5)
+ABI_NAMES = ("zero", "ra", "sp", "gp", "tp", "t0", "t1", "t2", "s0", "s1", "a0", "a1", "a2", "a3", "a4", "a5",
+             "a6", "a7", "s2", "s3", "s4", "s5", "s6", "s7", "s8", "s9", "s10", "s11", "t3", "t4", "t5", "t6")
+REG_NUMBERS = {**{f"x{reg}": reg for reg in range(32)}, **{name: reg for reg, name in enumerate(ABI_NAMES)}, "fp": 8}
 
+PROGRAM_START = 0x80000000  # Where RVMemory.load_program puts a program
+
+LABEL = re.compile(r"\s*([A-Za-z_.$][\w.$]*):")
+MEM_OPERAND = re.compile(r"(.*)\((\w+)\)$")
+RELOC = re.compile(r"%(hi|lo)\((.+)\)$")
+IGNORED_DIRECTIVES = (".text", ".data", ".bss", ".section", ".globl", ".global", ".type", ".size", ".option", ".file")
+
+
+def encode(instr: str, rd: int = 0, rs1: int = 0, rs2: int = 0, imm: int = 0) -> int:
+    """Encode instruction as an unsigned 32-bit word, masking imm to its fields, see check_imm"""
+    typ, opcode, funct3, funct7 = ENCODINGS[instr]
     match typ:
         case "R":
-            bits = funct7 + rs2 + rs1 + funct3 + rd + opcode
+            return (funct7 << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
         case "I":
-            if instr in ("slli", "srli", "srai"):
-                funct7 = 0x20 if instr == "srai" else 0x00
-                imm_i = int_to_bits(funct7, 7) + int_to_bits(imm, 5)
-            else:
-                imm_i = int_to_bits(imm, 12)
-            bits = imm_i + rs1 + funct3 + rd + opcode
-        case "U":
-            imm_u = int_to_bits(imm, 20)
-            bits = imm_u + rd + opcode
+            if instr in SHIFTS:
+                imm = (funct7 << 5) | (imm & 0x1F)
+            return ((imm & 0xFFF) << 20) | (rs1 << 15) | (funct3 << 12) | (rd << 7) | opcode
         case "S":
-            imm_s = int_to_bits(imm, 12)
-            bits = (
-                bitfield_slice(imm_s, 11, 5)
-                + rs2
-                + rs1
-                + funct3
-                + bitfield_slice(imm_s, 4, 0)
-                + opcode
+            return (((imm >> 5) & 0x7F) << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12) | ((imm & 0x1F) << 7) | opcode
+        case "B":
+            return (
+                (((imm >> 12) & 0x1) << 31) | (((imm >> 5) & 0x3F) << 25) | (rs2 << 20) | (rs1 << 15) | (funct3 << 12)
+                | (((imm >> 1) & 0xF) << 8) | (((imm >> 11) & 0x1) << 7) | opcode
             )
+        case "U":
+            return ((imm & 0xFFFFF) << 12) | (rd << 7) | opcode
         case "J":
-            imm_j = int_to_bits(imm, 21)
-            bits = (
-                bitfield_slice(imm_j, 20, 20)
-                + bitfield_slice(imm_j, 10, 1)
-                + bitfield_slice(imm_j, 11, 11)
-                + bitfield_slice(imm_j, 19, 12)
-                + rd
-                + opcode
-            )
-        case "B":
-            imm_b = int_to_bits(imm, 13)
-            bits = (
-                bitfield_slice(imm_b, 12, 12)
-                + bitfield_slice(imm_b, 10, 5)
-                + rs2
-                + rs1
-                + funct3
-                + bitfield_slice(imm_b, 4, 1)
-                + bitfield_slice(imm_b, 11, 11)
-                + opcode
+            return (
+                (((imm >> 20) & 0x1) << 31) | (((imm >> 1) & 0x3FF) << 21) | (((imm >> 11) & 0x1) << 20)
+                | (((imm >> 12) & 0xFF) << 12) | (rd << 7) | opcode
             )
+    raise ValueError(f"Unknown instruction format: {typ}")
+
+
+def asm(instr: str, rd: Regs | None = None, rs1: Regs | None = None,
+        rs2: Regs | None = None, imm: int | None = None) -> int:
+    """Converts assembly instruction to binary, as a signed int"""
+    return u.sign_extend(encode(instr, rd or 0, rs1 or 0, rs2 or 0, imm or 0), 32)
+
+
+def asm_program(instrs: t.Iterable[int]) -> bytes:
+    """Pack instruction words, such as from asm, into a little-endian image for load_program"""
+    words = [instr & 0xFFFFFFFF for instr in instrs]
+    return struct.pack(f"<{len(words)}I", *words)
+
+
+def hi_lo(value: int) -> tuple[int, int]:
+    """Split value into the upper 20 bits for LUI/AUIPC and the signed lower 12 bits added after"""
+    lo = u.sign_extend(value, 12)
+    return ((value - lo) >> 12) & 0xFFFFF, lo
+
+
+class AssemblerError(Exception):
+    pass
+
+
+def check_imm(instr: str, imm: int) -> None:
+    """Raise AssemblerError if imm does not fit the immediate of instr, which encode would silently mask"""
+    typ = ENCODINGS[instr][0]
+    if instr in SHIFTS:
+        if not 0 <= imm <= 31:
+            raise AssemblerError(f"Shift amount out of range [0, 31]: {imm}")
+    elif typ in IMM_RANGES:
+        low, high, even = IMM_RANGES[typ]
+        kind = "offset" if typ in ("B", "J") else "immediate"
+        if not low <= imm <= high:
+            raise AssemblerError(f"{instr} {kind} out of range [{low}, {high}]: {imm}")
+        if even and imm % 2:
+            raise AssemblerError(f"{instr} {kind} must be even: {imm}")
+
+
+def check_word(value: int) -> int:
+    """value, raising AssemblerError unless it fits in 32 bits as a signed or unsigned number"""
+    if not -(1 << 31) <= value < (1 << 32):
+        raise AssemblerError(f"Value out of 32-bit range: {value}")
+    return value
+
+
+@dataclass
+class AssembledProgram:
+    data: bytes
+    base: int  # Address of the first byte
+    labels: dict[str, int]  # Label addresses
+
+    @property
+    def end(self) -> int:
+        return self.base + len(self.data)
+
+
+class Assembler:
+    """Expands one line at a time, a line at addr always expanding to the same number of words"""
+
+    labels: dict[str, int]
+    resolving: bool  # Whether labels must be known, otherwise this is the layout pass
+    unresolved: bool  # Whether a label was not yet known, so the line must be encoded again
+
+    def __init__(self, labels: dict[str, int], resolving: bool) -> None:
+        self.labels = labels
+        self.resolving = resolving
+        self.unresolved = False
+
+    def encode(self, instr: str, rd: int = 0, rs1: int = 0, rs2: int = 0, imm: int = 0) -> int:
+        """encode, first checking that imm fits, unless it depends on a label that is not yet known"""
+        if not self.unresolved:
+            check_imm(instr, imm)
+        return encode(instr, rd, rs1, rs2, imm)
+
+    def fence_set(self, operand: str) -> int:
+        """Bits of a FENCE predecessor or successor set, such as rw or iorw"""
+        if not operand or operand != "".join(kind for kind in FENCE_BITS if kind in operand):
+            raise AssemblerError(f"Expected a fence set from iorw: {operand}")
+        return sum(FENCE_BITS[kind] for kind in operand)
+
+    def reg(self, operand: str) -> int:
+        reg = REG_NUMBERS.get(operand)
+        if reg is None:
+            raise AssemblerError(f"Unknown register: {operand}")
+        return reg
+
+    def number(self, operand: str) -> int:
+        """Number that sets the size of a line, so must not depend on labels"""
+        try:
+            return int(operand, 0)
+        except ValueError:
+            raise AssemblerError(f"Expected a number: {operand}") from None
+
+    def count(self, name: str, ops: list[str]) -> int:
+        """Single non-negative number operand of .zero or .align"""
+        if len(ops) != 1:
+            raise AssemblerError(f"Wrong number of operands for {name}: {len(ops)}")
+        count = self.number(ops[0])
+        if count < 0:
+            raise AssemblerError(f"{name} needs a non-negative number: {count}")
+        return count
+
+    def value(self, operand: str) -> int:
+        """Number, label address or %hi/%lo of either"""
+        if reloc := RELOC.match(operand):
+            hi, lo = hi_lo(self.value(reloc[2]))
+            return hi if reloc[1] == "hi" else lo
+        try:
+            return int(operand, 0)
+        except ValueError:
+            pass
+        if operand in self.labels:
+            return self.labels[operand]
+        if self.resolving or not LABEL.fullmatch(operand + ":"):
+            raise AssemblerError(f"Unknown label or invalid number: {operand}")
+        self.unresolved = True
+        return 0
+
+    def offset(self, operand: str, addr: int) -> int:
+        """Branch or jump offset to a label, or an offset given as a number"""
+        try:
+            return int(operand, 0)
+        except ValueError:
+            return self.value(operand) - addr
+
+    def mem(self, operand: str) -> tuple[int, int]:
+        """(offset, base register) of an offset(reg) operand"""
+        match = MEM_OPERAND.match(operand)
+        if match is None:
+            raise AssemblerError(f"Expected offset(register): {operand}")
+        return self.value(match[1]) if match[1] else 0, self.reg(match[2])
+
+    def expand(self, name: str, ops: list[str], addr: int) -> list[int]:
+        """Encode an instruction or pseudo-instruction at addr"""
+        reg, value, encode = self.reg, self.value, self.encode
+        match name, len(ops):
+            case ("nop", 0):
+                return [encode("addi")]
+            case ("li", 2):
+                lo = u.sign_extend(check_word(self.number(ops[1])), 32)
+                if -2048 <= lo < 2048:
+                    return [encode("addi", reg(ops[0]), 0, imm=lo)]
+                hi, lo = hi_lo(lo)
+                words = [encode("lui", reg(ops[0]), imm=hi)]
+                return words + [encode("addi", reg(ops[0]), reg(ops[0]), imm=lo)] if lo else words
+            case ("la", 2):
+                hi, lo = hi_lo(value(ops[1]) - addr)
+                return [encode("auipc", reg(ops[0]), imm=hi), encode("addi", reg(ops[0]), reg(ops[0]), imm=lo)]
+            case ("call" | "tail", 1):
+                link, temp = (1, 1) if name == "call" else (0, 6)
+                hi, lo = hi_lo(self.offset(ops[0], addr))
+                return [encode("auipc", temp, imm=hi), encode("jalr", link, temp, imm=lo)]
+            case ("mv", 2):
+                return [encode("addi", reg(ops[0]), reg(ops[1]))]
+            case ("not", 2):
+                return [encode("xori", reg(ops[0]), reg(ops[1]), imm=-1)]
+            case ("neg", 2):
+                return [encode("sub", reg(ops[0]), 0, reg(ops[1]))]
+            case ("seqz", 2):
+                return [encode("sltiu", reg(ops[0]), reg(ops[1]), imm=1)]
+            case ("snez", 2):
+                return [encode("sltu", reg(ops[0]), 0, reg(ops[1]))]
+            case ("j", 1):
+                return [encode("jal", 0, imm=self.offset(ops[0], addr))]
+            case ("jal", 1):
+                return [encode("jal", 1, imm=self.offset(ops[0], addr))]
+            case ("jr", 1):
+                return [encode("jalr", 0, reg(ops[0]))]
+            case ("jalr", 1):
+                return [encode("jalr", 1, reg(ops[0]))]
+            case ("jalr", 3):
+                return [encode("jalr", reg(ops[0]), reg(ops[1]), imm=value(ops[2]))]
+            case ("ret", 0):
+                return [encode("jalr", 0, 1)]
+            case ("beqz" | "bnez" | "bltz" | "bgez", 2):
+                return [encode(name[:-1], rs1=reg(ops[0]), imm=self.offset(ops[1], addr))]
+            case ("blez" | "bgtz", 2):
+                return [encode("bge" if name == "blez" else "blt", rs2=reg(ops[0]), imm=self.offset(ops[1], addr))]
+            case ("bgt" | "ble" | "bgtu" | "bleu", 3):
+                swapped = {"bgt": "blt", "ble": "bge", "bgtu": "bltu", "bleu": "bgeu"}[name]
+                return [encode(swapped, rs1=reg(ops[1]), rs2=reg(ops[0]), imm=self.offset(ops[2], addr))]
+            case (("ecall" | "ebreak" | "fence"), 0):
+                return [FIXED_WORDS[name]]
+            case ("fence", 2):
+                return [(self.fence_set(ops[0]) << 24) | (self.fence_set(ops[1]) << 20) | 0x0F]
+            case (("rdcycle" | "rdtime" | "rdinstret"), 1):
+                return [(COUNTER_CSRS[name] << 20) | (0x2 << 12) | (reg(ops[0]) << 7) | 0x73]  # CSRRS rd, csr, x0
+
+        if name not in ENCODINGS:
+            raise AssemblerError(f"Unknown instruction: {name} with {len(ops)} operands")
+        typ = ENCODINGS[name][0]
+        if len(ops) != (2 if typ in ("U", "J", "S") or name in OFFSET_FORMS else 3):
+            raise AssemblerError(f"Wrong number of operands for {name}: {len(ops)}")
+        match typ:
+            case "R":
+                return [encode(name, reg(ops[0]), reg(ops[1]), reg(ops[2]))]
+            case "I" if name in OFFSET_FORMS:
+                offset, base = self.mem(ops[1])
+                return [encode(name, reg(ops[0]), base, imm=offset)]
+            case "I":
+                return [encode(name, reg(ops[0]), reg(ops[1]), imm=value(ops[2]))]
+            case "S":
+                offset, base = self.mem(ops[1])
+                return [encode(name, rs1=base, rs2=reg(ops[0]), imm=offset)]
+            case "B":
+                return [encode(name, rs1=reg(ops[0]), rs2=reg(ops[1]), imm=self.offset(ops[2], addr))]
+            case "U":
+                return [encode(name, reg(ops[0]), imm=value(ops[1]))]
+            case _:  # J
+                return [encode(name, reg(ops[0]), imm=self.offset(ops[1], addr))]
+
+    def line(self, line: str, addr: int) -> bytes:
+        """Bytes of the instruction or directive on a line, without labels or comments"""
+        name, _, rest = line.partition(" ")
+        name = name.lower()
+        ops = [op.strip() for op in rest.split(",")] if rest.strip() else []
+        match name:
+            case ".word":
+                return asm_program(check_word(self.value(op)) for op in ops)
+            case ".zero":
+                return bytes(self.count(name, ops))
+            case ".align" | ".p2align":
+                return bytes(-addr % (1 << self.count(name, ops)))
+            case _ if name in IGNORED_DIRECTIVES:
+                return b""
+        if addr % 4:
+            raise AssemblerError(f"Instruction at unaligned address 0x{addr:08x}")
+        return asm_program(self.expand(name, ops, addr))
+
+
+def assemble(source: str | t.Iterable[str], base: int = PROGRAM_START) -> AssembledProgram:
+    """
+    Assemble GNU-style RV32I assembly, one instruction or directive per line,
+    for loading at base. Branch and jump targets are labels, or numbers giving
+    the offset from the instruction, as for asm
+    """
+    lines = source.splitlines() if isinstance(source, str) else list(source)
+    statements = []  # (line number, statement without labels, address, bytes if no forward references)
+    labels: dict[str, int] = {}
+    layout = Assembler(labels, resolving=False)
+    addr = base
+    for line_num, line in enumerate(lines, 1):
+        line = line.split("#", 1)[0]
+        try:
+            while label := LABEL.match(line):
+                if label[1] in labels:
+                    raise AssemblerError(f"Duplicate label: {label[1]}")
+                labels[label[1]] = addr
+                line = line[label.end():]
+            line = " ".join(line.split())
+            if line:
+                layout.unresolved = False
+                data = layout.line(line, addr)
+                statements.append((line_num, line, addr, None if layout.unresolved else data))
+                addr += len(data)
+        except AssemblerError as e:
+            raise AssemblerError(f"line {line_num}: {e}") from None
 
-    return bits_to_int(bits)
+    encoder = Assembler(labels, resolving=True)
+    data = bytearray()
+    for line_num, line, addr, line_data in statements:
+        try:
+            data += line_data if line_data is not None else encoder.line(line, addr)
+        except AssemblerError as e:
+            raise AssemblerError(f"line {line_num}: {e}") from None
+    return AssembledProgram(bytes(data), base, labels)
@@ -1,40 +1,305 @@
 import argparse
+import os
+import sys
+import typing as t
 
-from pyriscv import mem, rv32i, utils
+from pyriscv import devices, elf, mem, rv32i, snapshot
+from pyriscv.stats import Stats
+
+if t.TYPE_CHECKING:
+    from pyriscv.fuzz import FuzzCase
+
+
+def load_program(rv: rv32i.RV32I, filepath: str) -> elf.ElfFile | None:
+    """Load an ELF file, snapshot or flat binary, depending on the file contents"""
+    if elf.is_elf(filepath):
+        return rv.load_elf(filepath)
+    if snapshot.is_snapshot(filepath):
+        rv.load_snapshot(filepath)
+        return None
+    rv.load_bin(filepath)
+    return None
+
+
+def parse_addr(addr: str, elf_file: elf.ElfFile | None) -> int:
+    """Address given as a number or as a symbol in the ELF file"""
+    if elf_file is not None and addr in elf_file.symbols:
+        return elf_file.symbols[addr].value
+    return int(addr, 0)
 
 
 def pyriscv() -> None:
     parser = argparse.ArgumentParser()
-    parser.add_argument("bin_filepath", type=str, help="Path to program binary")
+    parser.add_argument("bin_filepath", type=str, help="Path to program ELF, binary or snapshot")
+    parser.add_argument("--translate", action="store_true", help="Run as translated basic blocks, ignored with --stats, --profile, --trace or --diff-log")
+    parser.add_argument("--fuse", action="store_true", help="Run common instruction sequences as fused operations and print how often each ran, ignored with --translate")
+    parser.add_argument("--mmio", action="store_true", help="Attach UART, exit register and timer devices")
+    parser.add_argument("--save-snapshot", type=str, help="Path to save a snapshot of the machine state")
+    parser.add_argument("--snapshot-at", type=str, help="Address or ELF symbol to save the snapshot at")
+    parser.add_argument("--stats", action="store_true", help="Print instruction counts and rate after running")
+    parser.add_argument("--profile", action="store_true", help="Print a flat profile by function, PC and block")
+    parser.add_argument("--collapsed-stacks", type=str, help="Path to write profiled call stacks for flamegraphs")
+    parser.add_argument("--trace", type=str, help="Path to write a binary execution trace, see pyriscv-trace")
+    parser.add_argument("--diff-log", type=str, help="Path to a Spike or SAIL commit log to check execution against")
 
     args = parser.parse_args()
     bin_filepath = args.bin_filepath
 
     rv = rv32i.RV32I()
-    rv.load_bin(bin_filepath)
+    elf_file = load_program(rv, bin_filepath)
+    if args.mmio:
+        devices.add_default_devices(rv.memory)
 
-    rv.run_program()
+    if args.save_snapshot:
+        stop_addr = parse_addr(args.snapshot_at, elf_file) if args.snapshot_at else rv.pc_addr
+        if rv.run_until(stop_addr):
+            rv.snapshot().save(args.save_snapshot)
+        else:
+            print(f"Program stopped before reaching 0x{stop_addr:08x}, no snapshot saved", file=sys.stderr)
 
+    stats = Stats() if args.stats else None
+    profiler = None
+    if args.profile or args.collapsed_stacks:
+        from pyriscv.profiler import Profiler
+        profiler = Profiler(elf_file)
+    if args.diff_log:
+        from pyriscv.difftest import DiffChecker
+        try:
+            result = DiffChecker(args.diff_log).run(rv)
+        except (OSError, ValueError) as e:
+            parser.error(f"--diff-log: {e}")
+        print(result, file=sys.stderr)
+        sys.exit(1 if result.divergence is not None else 0)
 
-def riscof() -> None:
-    parser = argparse.ArgumentParser()
-    parser.add_argument("bin_filepath", type=str, help="Path to program binary")
+    trace = None
+    if args.trace:
+        from pyriscv.trace import TraceWriter
+        trace = TraceWriter.open(args.trace)
+    try:
+        rv.run_program(translate=args.translate, stats=stats, profiler=profiler, trace=trace, fuse=args.fuse)
+    finally:
+        if trace is not None:
+            trace.close()
 
-    parser.add_argument("--test-signature", type=str, help="Path to output test signature")
+    if stats is not None:
+        print(f"instret: {rv.instret}\ncycle:   {rv.cycle}\n{stats.report()}", file=sys.stderr)
+    if args.profile:
+        print(profiler.flat_profile(), file=sys.stderr)
+    if rv.fuser is not None:
+        print(rv.fuser.report(), file=sys.stderr)
+    if args.collapsed_stacks:
+        with open(args.collapsed_stacks, "w") as f:
+            f.write(profiler.collapsed_stacks())
+
+    if rv.exit_code is not None:
+        sys.exit(rv.exit_code)
+
+
+def server() -> None:
+    parser = argparse.ArgumentParser(
+        description="Boot a program once, then run JSON-line jobs from the booted state, see pyriscv.server"
+    )
+    parser.add_argument("bin_filepath", type=str, help="Path to program ELF, binary or snapshot")
+    parser.add_argument("--socket", type=str, help="Unix socket path to accept jobs on, instead of stdin")
+    parser.add_argument("--mode", choices=["fork", "snapshot"], default="fork" if hasattr(os, "fork") else "snapshot",
+                        help="Start each job in a forked process or by restoring a snapshot")
+    parser.add_argument("--boot-until", type=str, help="Address or ELF symbol to boot to before taking jobs")
+    parser.add_argument("--riscof", action="store_true", help="Use the RISCOF memory map")
+    parser.add_argument("--translate", action="store_true", help="Run as translated basic blocks")
+
+    args = parser.parse_args()
+
+    from pyriscv.server import JobServer
+
+    rv = rv32i.RV32I(mem.RiscofMemory() if args.riscof else None)
+    elf_file = load_program(rv, args.bin_filepath)
+    if args.boot_until and not rv.run_until(parse_addr(args.boot_until, elf_file)):
+        sys.exit(f"Program stopped before reaching {args.boot_until}")
+
+    job_server = JobServer(rv, elf_file, fork=args.mode == "fork", translate=args.translate)
+    if args.socket:
+        job_server.serve_unix(args.socket)
+    else:
+        job_server.serve(sys.stdin, sys.stdout)
+
+
+def trace_dump() -> None:
+    parser = argparse.ArgumentParser(description="Print a binary execution trace written with pyriscv --trace")
+    parser.add_argument("trace_filepath", type=str, help="Path to trace file")
 
     args = parser.parse_args()
-    bin_filepath, test_signature_path = args.bin_filepath, args.test_signature
 
+    from pyriscv.trace import read_trace
+
+    for record in read_trace(args.trace_filepath):
+        print(record)
+
+
+def disasm() -> None:
+    parser = argparse.ArgumentParser(description="Disassemble a program ELF or flat binary")
+    parser.add_argument("bin_filepath", type=str, help="Path to program ELF or binary")
+    parser.add_argument("--base", type=str, default="0x80000000", help="Load address of a flat binary")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--blocks", action="store_true", help="Print basic blocks and their successors")
+    output.add_argument("--cfg", action="store_true", help="Print the control-flow graph in Graphviz dot format")
+
+    args = parser.parse_args()
+
+    from pyriscv.disasm import Disassembly, disassemble_elf
+
+    if elf.is_elf(args.bin_filepath):
+        disassemblies = disassemble_elf(elf.ElfFile.from_file(args.bin_filepath))
+    else:
+        with open(args.bin_filepath, "rb") as f:
+            disassemblies = [Disassembly.from_bytes(f.read(), int(args.base, 0))]
+
+    for disassembly in disassemblies:
+        if args.cfg:
+            print(disassembly.cfg_dot())
+        elif args.blocks:
+            for block in disassembly.basic_blocks():
+                successors = ", ".join(f"{kind} 0x{addr:08x}" for addr, kind in block.successors)
+                print(f"0x{block.start:08x}-0x{block.end:08x}{disassembly.label(block.start)}: {successors}")
+        else:
+            print(f"\nDisassembly of segment at 0x{disassembly.image.base:08x}:")
+            sys.stdout.writelines(line + "\n" for line in disassembly.listing())
+
+
+def print_fuzz_case(index: int, message: str, case: "FuzzCase") -> None:
+    from pyriscv.assem import asm_program, PROGRAM_START
+    from pyriscv.disasm import Disassembly
+    from pyriscv.fuzz import NOP
+
+    print(f"Case {index}:\n{message}\nInitial registers:")
+    print("  " + " ".join(f"x{reg}=0x{value:08x}" for reg, value in enumerate(case.regs) if value))
+    print(f"Data window: {'random, as generated' if any(case.data) else 'zeros'}")
+    listing = Disassembly.from_bytes(asm_program(case.program), PROGRAM_START).listing()
+    print("\n".join(line for line, word in zip(listing, case.program) if word != NOP))
+
+
+def fuzz() -> None:
+    parser = argparse.ArgumentParser(description="Check the emulator against a golden model on random programs")
+    parser.add_argument("--cases", type=int, default=100000, help="Number of random programs to run")
+    parser.add_argument("--length", type=int, default=32, help="Instructions in each program")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the run, cases are numbered within it")
+    parser.add_argument("--mode", choices=("plain", "translate", "fuse"), default="plain",
+                        help="How the emulator runs programs")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--replay", type=int, help="Run only this case number and print it")
+
+    args = parser.parse_args()
+
+    from pyriscv.fuzz import Harness, InvalidCase, fuzz as run_fuzz, generate_case
+
+    if args.replay is not None:
+        case = generate_case(args.seed, args.replay, args.length)
+        harness = Harness(args.mode)
+        try:
+            message = harness.check(case)
+        except InvalidCase as e:
+            message = f"Invalid generated case: {e}"
+        else:
+            if message is not None:
+                case = harness.minimize(case)
+                message = harness.check(case)
+        print_fuzz_case(args.replay, message or "Emulator matches the golden model", case)
+        sys.exit(1 if message else 0)
+
+    report = run_fuzz(args.cases, args.seed, args.length, args.mode, args.jobs,
+                      progress=lambda report: print(report, file=sys.stderr))
+    for failure in report.failures:
+        print_fuzz_case(failure.index, failure.message, failure.case)
+        print()
+    print(report)
+    if report.failures:
+        sys.exit(1)
+
+
+def run_riscof_test(bin_filepath: str, test_signature_path: str, translate: bool = False) -> None:
+    """Run a RISCOF test program and write its signature"""
     rv = rv32i.RV32I(mem.RiscofMemory())
-    rv.load_bin(bin_filepath)
+    elf_file = load_program(rv, bin_filepath)
 
-    rv.run_program()
+    rv.run_program(translate=translate)
 
-    test_sig_start = utils.to_uint32(rv.regs[rv32i.Regs.X10])
-    test_sig_end = utils.to_uint32(rv.regs[rv32i.Regs.X11])
+    if elf_file is not None and "begin_signature" in elf_file.symbols:
+        test_sig_start = elf_file.symbols["begin_signature"].value
+        test_sig_end = elf_file.symbols["end_signature"].value
+    else:
+        test_sig_start = rv.xregs[rv32i.Regs.X10]
+        test_sig_end = rv.xregs[rv32i.Regs.X11]
 
-    test_sig_words = [rv.memory.ram.read(addr, mem.DataSize.WORD) for addr in range(test_sig_start, test_sig_end, 4)]
+    test_sig_words = [rv.memory.read(addr, mem.DataSize.WORD) for addr in range(test_sig_start, test_sig_end, 4)]
 
     file_lines = [f"{word:08x}\n" for word in test_sig_words]
     with open(test_signature_path, "w") as f:
         f.writelines(file_lines)
+
+
+def riscof() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("bin_filepath", type=str, help="Path to program ELF or binary")
+
+    parser.add_argument("--test-signature", type=str, help="Path to output test signature")
+    parser.add_argument("--translate", action="store_true", help="Run as translated basic blocks")
+
+    args = parser.parse_args()
+    run_riscof_test(args.bin_filepath, args.test_signature, args.translate)
+
+
+def run_batch_entry(entry: tuple[str, str, bool]) -> str | None:
+    """Run one test in a batch worker, returning an error message if it failed"""
+    bin_filepath, test_signature_path, translate = entry
+    try:
+        run_riscof_test(bin_filepath, test_signature_path, translate)
+    except Exception as e:
+        return f"{bin_filepath}: {type(e).__name__}: {e}"
+    return None
+
+
+def parse_test_list(lines: t.Iterable[str]) -> list[tuple[str, str]]:
+    """Read tab-separated program and signature paths, one test per line, so paths may contain spaces"""
+    entries = []
+    for line_num, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            continue
+        fields = line.split("\t")
+        if len(fields) != 2:
+            raise ValueError(f"line {line_num}: expected <program><TAB><signature>, got {len(fields)} field(s)")
+        entries.append((fields[0], fields[1]))
+    return entries
+
+
+def riscof_batch() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run many RISCOF tests in a pool of worker processes, "
+        "so Python start-up and imports are paid once per worker rather than per test"
+    )
+    parser.add_argument("test_list", type=str, help="File with a tab-separated program path and signature path per line")
+
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--translate", action="store_true", help="Run as translated basic blocks")
+
+    args = parser.parse_args()
+
+    # Only imported here, as multiprocessing adds noticeably to start-up of the other entry points
+    from concurrent.futures import ProcessPoolExecutor
+
+    with open(args.test_list) as f:
+        try:
+            entries = [(*paths, args.translate) for paths in parse_test_list(f)]
+        except ValueError as e:
+            parser.error(f"{args.test_list}: {e}")
+
+    # Tests take similar times, so hand them out in chunks to reduce inter-process traffic
+    jobs = args.jobs or os.cpu_count() or 1
+    chunksize = max(1, len(entries) // (4 * jobs))
+    with ProcessPoolExecutor(jobs) as executor:
+        errors = [error for error in executor.map(run_batch_entry, entries, chunksize=chunksize) if error]
+
+    for error in errors:
+        print(error, file=sys.stderr)
+    print(f"Ran {len(entries)} tests, {len(errors)} failed")
+    if errors:
+        sys.exit(1)
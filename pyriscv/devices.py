@@ -0,0 +1,134 @@
+"""
+Memory-mapped I/O devices.
+
+Devices are attached to a memory with Memory.add_device and are only consulted
+for addresses outside of RAM/ROM, so ordinary accesses never pay for the lookup.
+"""
+import sys
+import time
+import typing as t
+
+from pyriscv import mem
+
+
+UART_BASE = 0x10000000
+TOHOST_BASE = 0x10001000
+CLINT_BASE = 0x02000000
+
+
+class Halt(Exception):
+    """Raised by a device to stop the program"""
+
+    exit_code: int
+
+    def __init__(self, exit_code: int) -> None:
+        super().__init__(f"Program halted with exit code {exit_code}")
+        self.exit_code = exit_code
+
+
+class Device:
+    """Base class for memory-mapped devices, accessed by offset from their base address"""
+
+    size: int = 0
+
+    def read(self, offset: int, size: mem.DataSize) -> int:
+        return 0
+
+    def write(self, offset: int, size: mem.DataSize, value: int) -> None:
+        pass
+
+
+class Uart(Device):
+    """
+    Transmit-only UART with 16550-style registers.
+    Bytes written to the data register are sent to the output stream.
+    """
+
+    size = 0x8
+
+    THR = 0x0  # Transmit holding register
+    LSR = 0x5  # Line status register
+    LSR_TX_IDLE = 0x60  # Transmit holding register and transmitter empty
+
+    output: t.BinaryIO
+
+    def __init__(self, output: t.BinaryIO | None = None) -> None:
+        self.output = output if output is not None else sys.stdout.buffer
+
+    def read(self, offset: int, size: mem.DataSize) -> int:
+        if offset == self.LSR:
+            return self.LSR_TX_IDLE
+        return 0
+
+    def write(self, offset: int, size: mem.DataSize, value: int) -> None:
+        if offset == self.THR:
+            self.output.write(bytes([value & 0xFF]))
+            self.output.flush()
+
+
+class Clint(Device):
+    """
+    CLINT-style timer with 64-bit mtime and mtimecmp registers.
+    mtime counts in microseconds of host time unless another clock is given.
+    """
+
+    size = 0x10000
+
+    MTIMECMP = 0x4000
+    MTIME = 0xBFF8
+
+    clock: t.Callable[[], int]
+    time_offset: int
+    mtimecmp: int
+
+    def __init__(self, clock: t.Callable[[], int] | None = None) -> None:
+        self.clock = clock if clock is not None else lambda: time.perf_counter_ns() // 1000
+        self.time_offset = -self.clock()
+        self.mtimecmp = 0xFFFFFFFFFFFFFFFF
+
+    @property
+    def mtime(self) -> int:
+        return (self.clock() + self.time_offset) & 0xFFFFFFFFFFFFFFFF
+
+    def read(self, offset: int, size: mem.DataSize) -> int:
+        if self.MTIME <= offset < self.MTIME + 8:
+            return (self.mtime >> (8 * (offset - self.MTIME))) & mem.SIZE_MASKS[size]
+        if self.MTIMECMP <= offset < self.MTIMECMP + 8:
+            return (self.mtimecmp >> (8 * (offset - self.MTIMECMP))) & mem.SIZE_MASKS[size]
+        return 0
+
+    def write(self, offset: int, size: mem.DataSize, value: int) -> None:
+        if self.MTIME <= offset < self.MTIME + 8:
+            shift = 8 * (offset - self.MTIME)
+            mtime = replace_bits(self.mtime, shift, size, value)
+            self.time_offset = mtime - self.clock()
+        elif self.MTIMECMP <= offset < self.MTIMECMP + 8:
+            shift = 8 * (offset - self.MTIMECMP)
+            self.mtimecmp = replace_bits(self.mtimecmp, shift, size, value)
+
+
+class ToHost(Device):
+    """
+    Exit register, as used by riscv-tests.
+    Writing a non-zero value halts the program. If the LSB is set the exit code
+    is in the upper bits, following the tohost convention, otherwise it is the value.
+    """
+
+    size = 0x8
+
+    def write(self, offset: int, size: mem.DataSize, value: int) -> None:
+        if offset == 0 and value != 0:
+            raise Halt(value >> 1 if value & 1 else value)
+
+
+def replace_bits(reg: int, shift: int, size: mem.DataSize, value: int) -> int:
+    """Replace size bytes of reg at bit offset shift with value"""
+    mask = mem.SIZE_MASKS[size] << shift
+    return (reg & ~mask) | ((value << shift) & mask)
+
+
+def add_default_devices(memory: mem.Memory, output: t.BinaryIO | None = None) -> None:
+    """Attach a UART, exit register and timer at their default addresses"""
+    memory.add_device(UART_BASE, Uart(output))
+    memory.add_device(TOHOST_BASE, ToHost())
+    memory.add_device(CLINT_BASE, Clint())
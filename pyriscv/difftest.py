@@ -0,0 +1,236 @@
+"""
+Lock-step differential testing against a reference commit log.
+
+A reference model such as Spike (--log-commits) or the SAIL C simulator logs
+the PC, instruction and register writeback of each instruction it commits.
+DiffChecker runs the program with a TraceWriter whose chunks are sent to a
+checker process. The checker parses the reference log, compares it with the
+trace record by record and stops the run at the first divergence, reporting
+it along with the instructions leading up to it.
+
+Reference models usually start in a boot ROM, so reference records are
+skipped until the PC of the first instruction pyriscv executes.
+
+The chunk queue is bounded, so the emulator waits for a checker that falls
+behind rather than buffering the trace without limit. If the checker fails or
+dies, the run stops with a RuntimeError instead of waiting for its result.
+"""
+from collections import deque
+from dataclasses import dataclass, field
+import multiprocessing
+import multiprocessing.queues
+import multiprocessing.synchronize
+import queue
+import re
+import typing as t
+
+from pyriscv.rv32i import RV32I
+from pyriscv.trace import TraceRecord, TraceWriter, decode_trace
+
+
+# core   0: 3 0x80000000 (0x00000297) x5  0x80000000
+SPIKE_COMMIT = re.compile(r"core\s+\d+:\s+\d+\s+0x([0-9a-fA-F]+)\s+\(0x([0-9a-fA-F]+)\)(.*)")
+SPIKE_REG_WRITE = re.compile(r"\bx(\d+)\s+0x([0-9a-fA-F]+)")
+
+# [4] [M]: 0x80000000 (0x00000297) auipc t0, 0x0
+# x5 <- 0x80000000
+SAIL_INSTR = re.compile(r"\[\d+\]\s+\[\w+\]:\s+0x([0-9a-fA-F]+)\s+\(0x([0-9a-fA-F]+)\)")
+SAIL_REG_WRITE = re.compile(r"x(\d+)\s+<-\s+0x([0-9a-fA-F]+)")
+
+MASK = 0xFFFFFFFF
+
+CHUNK_QUEUE_SIZE = 8  # Trace chunks waiting for the checker, each up to trace.BUFFER_SIZE bytes
+POLL_SECONDS = 0.1  # How often a waiting emulator checks that the checker is still alive
+
+
+def commit_record(pc: str, instr: str) -> TraceRecord:
+    return TraceRecord(int(pc, 16) & MASK, int(instr, 16), 0, 0, None, 0, 0, False)
+
+
+def set_rd(record: TraceRecord, rd: str, value: str) -> None:
+    if int(rd) != 0:
+        record.rd = int(rd)
+        record.rd_value = int(value, 16) & MASK
+
+
+def parse_commit_log(lines: t.Iterable[str]) -> t.Iterator[TraceRecord]:
+    """Parse a Spike or SAIL commit log into trace records, ignoring lines of any other kind"""
+    pending = None  # SAIL logs register writes on the lines after the instruction
+    for line in lines:
+        if match := SPIKE_COMMIT.match(line):
+            record = commit_record(match[1], match[2])
+            if reg_write := SPIKE_REG_WRITE.search(match[3]):
+                set_rd(record, reg_write[1], reg_write[2])
+            yield record
+        elif match := SAIL_INSTR.match(line):
+            if pending is not None:
+                yield pending
+            pending = commit_record(match[1], match[2])
+        elif pending is not None and (reg_write := SAIL_REG_WRITE.match(line)):
+            set_rd(pending, reg_write[1], reg_write[2])
+    if pending is not None:
+        yield pending
+
+
+@dataclass
+class Divergence:
+    reason: str
+    record: TraceRecord
+    reference: TraceRecord | None  # None if the reference log ended first
+    context: list[TraceRecord] = field(default_factory=list)  # Matching records leading up to the divergence
+
+    def __str__(self) -> str:
+        lines = [f"Divergence: {self.reason}"]
+        lines += [f"  {record}" for record in self.context]
+        lines.append(f"> pyriscv:   {self.record}")
+        lines.append(f"> reference: {self.reference if self.reference is not None else '<end of log>'}")
+        return "\n".join(lines)
+
+
+@dataclass
+class DiffResult:
+    checked: int  # Instructions that matched the reference
+    divergence: Divergence | None = None
+
+    def __str__(self) -> str:
+        if self.divergence is None:
+            return f"{self.checked} instructions match the reference"
+        return f"{self.checked} instructions match the reference\n{self.divergence}"
+
+
+def compare(records: t.Iterable[TraceRecord], reference: t.Iterable[TraceRecord], context: int = 8) -> DiffResult:
+    """Compare records with the reference until the first divergence or the end of records"""
+    reference = iter(reference)
+    history: deque[TraceRecord] = deque(maxlen=context)
+    checked = 0
+    for record in records:
+        ref = next(reference, None)
+        if checked == 0:
+            while ref is not None and ref.pc != record.pc:
+                ref = next(reference, None)
+
+        if ref is None:
+            reason = "reference log ended" if checked else f"reference never reaches PC 0x{record.pc:08x}"
+        elif ref.pc != record.pc:
+            reason = "PC differs"
+        elif ref.instr != record.instr:
+            reason = "instruction differs"
+        elif (ref.rd, ref.rd_value) != (record.rd, record.rd_value):
+            reason = "register write differs"
+        else:
+            history.append(record)
+            checked += 1
+            continue
+        return DiffResult(checked, Divergence(reason, record, ref, list(history)))
+    return DiffResult(checked)
+
+
+def check_commits(log_filepath: str, chunks: multiprocessing.queues.Queue, results: multiprocessing.queues.Queue,
+                  stop: multiprocessing.synchronize.Event, context: int) -> None:
+    """
+    Checker process, comparing trace chunks from the queue with the reference log until a None chunk.
+    Puts a DiffResult on results, or an error message if checking failed
+    """
+    chunk_iter = iter(chunks.get, None)
+    try:
+        with open(log_filepath) as f:
+            result: DiffResult | str = compare(decode_trace(chunk_iter), parse_commit_log(f), context)
+        if result.divergence is not None:
+            stop.set()
+    except Exception as e:
+        result = f"{type(e).__name__}: {e}"
+        stop.set()
+    for _ in chunk_iter:
+        pass  # Drain chunks sent before the emulator saw stop, so it never blocks on a full queue
+    results.put(result)
+
+
+class Diverged(Exception):
+    """Raised into the emulator loop once the checker has found a divergence"""
+
+
+class QueueFile:
+    """Write-only file passing each chunk of trace to the checker process"""
+
+    chunks: multiprocessing.queues.Queue
+    stop: multiprocessing.synchronize.Event
+    checker: multiprocessing.Process
+
+    def __init__(self, chunks: multiprocessing.queues.Queue, stop: multiprocessing.synchronize.Event,
+                 checker: multiprocessing.Process) -> None:
+        self.chunks = chunks
+        self.stop = stop
+        self.checker = checker
+
+    def send(self, chunk: bytes | None) -> None:
+        """Put chunk on the queue, waiting while it is full as long as the checker is alive"""
+        while True:
+            try:
+                self.chunks.put(chunk, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                if not self.checker.is_alive():
+                    raise RuntimeError(f"Checker process exited with code {self.checker.exitcode}") from None
+
+    def write(self, data: bytes | bytearray) -> None:
+        if self.stop.is_set():
+            raise Diverged
+        self.send(bytes(data))  # Copied, as the writer reuses its buffer
+
+    def flush(self) -> None:
+        pass
+
+
+class DiffChecker:
+    log_filepath: str
+    context: int  # Matching instructions shown before a divergence
+
+    def __init__(self, log_filepath: str, context: int = 8) -> None:
+        self.log_filepath = log_filepath
+        self.context = context
+
+    def check_log(self) -> None:
+        """Raise OSError if the reference log can't be read, or ValueError if it holds no commit records"""
+        with open(self.log_filepath) as f:
+            if next(parse_commit_log(f), None) is None:
+                raise ValueError(f"No Spike or SAIL commit records in {self.log_filepath}")
+
+    def run(self, rv: RV32I, max_instructions: int | None = None) -> DiffResult:
+        """Run program like RV32I.run_program, checking each instruction against the reference log"""
+        self.check_log()
+        chunks = multiprocessing.Queue(CHUNK_QUEUE_SIZE)
+        chunks.cancel_join_thread()  # Don't wait at exit to flush chunks that a dead checker will never read
+        results = multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        checker = multiprocessing.Process(target=check_commits, daemon=True,
+                                          args=(self.log_filepath, chunks, results, stop, self.context))
+        checker.start()
+
+        queue_file = QueueFile(chunks, stop, checker)
+        trace = TraceWriter(queue_file)  # type: ignore[arg-type]
+        try:
+            try:
+                trace.run(rv, max_instructions)
+                trace.flush()
+            except Diverged:
+                pass
+            finally:
+                queue_file.send(None)
+            result = self.wait_result(results, checker)
+        finally:
+            checker.join(POLL_SECONDS)
+            if checker.is_alive():
+                checker.terminate()
+
+        if isinstance(result, str):
+            raise RuntimeError(f"Checking against {self.log_filepath} failed: {result}")
+        return result
+
+    def wait_result(self, results: multiprocessing.queues.Queue, checker: multiprocessing.Process) -> DiffResult | str:
+        while True:
+            try:
+                return results.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                # A result put just before the checker exited is already in the queue's pipe
+                if not checker.is_alive() and results.empty():
+                    raise RuntimeError(f"Checker process exited with code {checker.exitcode} without a result")
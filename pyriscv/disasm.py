@@ -0,0 +1,260 @@
+"""
+Whole-image disassembler and static control-flow analysis.
+
+Disassembly builds on the field arrays of pyriscv.predecode.decode_image, adding
+a mnemonic for every word, worked out at once from opcode, funct3 and funct7 with
+a table lookup. Branch and jump targets, basic block leaders and the edges
+between blocks are computed over the arrays too. Only the text of the listing is
+formatted one instruction at a time.
+
+Words that are not RV32I instructions, such as data, are listed as .word and
+are not part of any basic block.
+"""
+from dataclasses import dataclass, field
+import bisect
+import typing as t
+
+import numpy as np
+import numpy.typing as npt
+
+from pyriscv import elf
+from pyriscv.assem import ABI_NAMES, ASM_INSTR_FORMATS
+from pyriscv.predecode import DecodedImage, decode_image
+from pyriscv.rv32i import Csrs, Opcodes
+
+
+CSR_NAMES = {csr.value: csr.name.lower() for csr in Csrs}
+CSR_INSTRS = {0x1: "csrrw", 0x2: "csrrs", 0x3: "csrrc", 0x5: "csrrwi", 0x6: "csrrsi", 0x7: "csrrci"}
+
+# Instruction format of each mnemonic, index 0 is for words that are not instructions
+FORMATS = {".word": "", **{name: typ for name, (typ, _) in ASM_INSTR_FORMATS.items()}, "fence": "FENCE",
+           "ecall": "", "ebreak": "", **{name: "CSR" for name in CSR_INSTRS.values()}}
+MNEMONICS = list(FORMATS)
+UNKNOWN = 0
+
+ECALL_WORD = 0x00000073
+EBREAK_WORD = 0x00100073
+
+LOADS = ("lb", "lh", "lw", "lbu", "lhu")
+BRANCHES = [MNEMONICS.index(name) for name in ("beq", "bne", "blt", "bge", "bltu", "bgeu")]
+JAL = MNEMONICS.index("jal")
+JALR = MNEMONICS.index("jalr")
+
+
+def mnemonic_key(opcode: t.Any, funct3: t.Any, alt: t.Any) -> t.Any:
+    """Index into MNEMONIC_TABLE, for ints or arrays"""
+    return (opcode << 4) | (funct3 << 1) | alt
+
+
+def mnemonic_table() -> npt.NDArray[np.uint8]:
+    """Mnemonic index for each opcode, funct3 and alt (funct7 of 0x20) combination"""
+    table = np.full(1 << 11, UNKNOWN, dtype=np.uint8)
+    for name, (typ, pattern) in ASM_INSTR_FORMATS.items():
+        funct7, funct3, opcode = pattern.split("_")
+        alt = int(funct7 == "0100000" or name == "srai")
+        funct3s = range(8) if funct3 == "???" else [int(funct3, 2)]
+        for f3 in funct3s:
+            table[mnemonic_key(int(opcode, 2), f3, alt)] = MNEMONICS.index(name)
+    table[mnemonic_key(Opcodes.MISC_MEM, 0x0, 0)] = MNEMONICS.index("fence")
+    for f3, name in CSR_INSTRS.items():
+        table[mnemonic_key(Opcodes.SYSTEM, f3, 0)] = MNEMONICS.index(name)
+    return table
+
+
+MNEMONIC_TABLE = mnemonic_table()
+
+
+def mnemonics(image: DecodedImage) -> npt.NDArray[np.uint8]:
+    """Index into MNEMONICS for every word of image"""
+    opcode = image.opcode.astype(np.int64)
+    funct3 = image.funct3.astype(np.int64)
+    funct7 = image.funct7
+    # funct7 selects the operation for OP and the immediate shifts, where only 0x00 and 0x20 are valid
+    by_funct7 = (opcode == Opcodes.OP) | ((opcode == Opcodes.OP_IMM) & ((funct3 == 0x1) | (funct3 == 0x5)))
+    alt = by_funct7 & (funct7 == 0x20)
+    result = MNEMONIC_TABLE[mnemonic_key(opcode, funct3, alt.astype(np.int64))]
+    result[by_funct7 & (funct7 != 0x00) & (funct7 != 0x20)] = UNKNOWN
+    result[~image.valid] = UNKNOWN
+    result[image.words == ECALL_WORD] = MNEMONICS.index("ecall")
+    result[image.words == EBREAK_WORD] = MNEMONICS.index("ebreak")
+    return result
+
+
+@dataclass
+class BasicBlock:
+    start: int
+    end: int  # Address after the last instruction
+    successors: list[tuple[int, str]] = field(default_factory=list)  # (address, edge kind)
+
+
+class Disassembly:
+    image: DecodedImage
+    mnemonic: npt.NDArray[np.uint8]  # Index into MNEMONICS for each word
+    target: npt.NDArray[np.int64]  # Branch and JAL target addresses, -1 for other instructions
+    symbols: dict[int, str]  # Labels by address
+    symbol_addrs: list[int]  # Sorted addresses of symbols
+
+    def __init__(self, image: DecodedImage, symbols: dict[int, str] | None = None) -> None:
+        self.image = image
+        self.mnemonic = mnemonics(image)
+        direct = np.isin(self.mnemonic, BRANCHES) | (self.mnemonic == JAL)
+        self.target = np.where(direct, self.addrs + image.imm, -1)
+        self.symbols = symbols or {}
+        self.symbol_addrs = sorted(self.symbols)
+
+    @classmethod
+    def from_bytes(cls, data: bytes | bytearray | npt.NDArray[np.uint8], base: int,
+                   symbols: dict[int, str] | None = None) -> "Disassembly":
+        """Disassemble data, such as MemoryRegion.bytes, the first word being at address base"""
+        return cls(decode_image(data, base), symbols)
+
+    @property
+    def addrs(self) -> npt.NDArray[np.int64]:
+        return self.image.base + 4 * np.arange(len(self.image), dtype=np.int64)
+
+    def index(self, addr: int) -> int:
+        return (addr - self.image.base) // 4
+
+    def label(self, addr: int) -> str:
+        """Nearest symbol at or before addr, as objdump shows branch targets"""
+        position = bisect.bisect_right(self.symbol_addrs, addr) - 1
+        if position < 0:
+            return ""
+        symbol_addr = self.symbol_addrs[position]
+        offset = addr - symbol_addr
+        return f" <{self.symbols[symbol_addr]}" + (f"+0x{offset:x}" if offset else "") + ">"
+
+    def text(self, index: int) -> str:
+        """Assembly text of the word at index"""
+        image = self.image
+        return self.format(int(self.mnemonic[index]), int(image.words[index]), int(image.rd[index]),
+                           int(image.rs1[index]), int(image.rs2[index]), int(image.imm[index]),
+                           int(self.target[index]))
+
+    def format(self, mnemonic: int, word: int, rd: int, rs1: int, rs2: int, imm: int, target: int) -> str:
+        name = MNEMONICS[mnemonic]
+        match FORMATS[name]:
+            case "R":
+                operands = f"{ABI_NAMES[rd]},{ABI_NAMES[rs1]},{ABI_NAMES[rs2]}"
+            case "I" if name in LOADS or name == "jalr":
+                operands = f"{ABI_NAMES[rd]},{imm}({ABI_NAMES[rs1]})"
+            case "I" if name in ("slli", "srli", "srai"):
+                operands = f"{ABI_NAMES[rd]},{ABI_NAMES[rs1]},0x{imm & 0x1F:x}"
+            case "I":
+                operands = f"{ABI_NAMES[rd]},{ABI_NAMES[rs1]},{imm}"
+            case "S":
+                operands = f"{ABI_NAMES[rs2]},{imm}({ABI_NAMES[rs1]})"
+            case "B":
+                operands = f"{ABI_NAMES[rs1]},{ABI_NAMES[rs2]},{target:x}{self.label(target)}"
+            case "J":
+                operands = f"{ABI_NAMES[rd]},{target:x}{self.label(target)}"
+            case "U":
+                operands = f"{ABI_NAMES[rd]},0x{imm & 0xFFFFF:x}"
+            case "FENCE":
+                operands = ",".join("".join(c for c, bit in zip("iorw", (8, 4, 2, 1)) if bits & bit)
+                                    for bits in ((imm >> 4) & 0xF, imm & 0xF))
+            case "CSR":
+                csr_name = CSR_NAMES.get(imm & 0xFFF, f"0x{imm & 0xFFF:x}")
+                source = str(rs1) if name.endswith("i") else ABI_NAMES[rs1]  # Immediate forms take a 5-bit uimm
+                operands = f"{ABI_NAMES[rd]},{csr_name},{source}"
+            case _ if name == ".word":
+                operands = f"0x{word:08x}"
+            case _:
+                operands = ""
+        return f"{name}\t{operands}" if operands else name
+
+    def listing(self) -> t.Iterator[str]:
+        """Lines of an objdump style listing, with a label line for each symbol"""
+        image = self.image
+        columns = (self.mnemonic, image.words, image.rd, image.rs1, image.rs2, image.imm, self.target)
+        for addr, fields in zip(self.addrs.tolist(), zip(*(column.tolist() for column in columns))):
+            if addr in self.symbols:
+                yield f"\n{addr:08x} <{self.symbols[addr]}>:"
+            yield f"{addr:8x}:\t{fields[1]:08x}          \t{self.format(*fields)}"
+
+    def transfers(self) -> npt.NDArray[np.bool_]:
+        """Whether each word is a branch, jump or trap"""
+        return (self.target != -1) | (self.mnemonic == JALR) | np.isin(self.image.words, (ECALL_WORD, EBREAK_WORD))
+
+    def block_ends(self) -> npt.NDArray[np.bool_]:
+        """Whether each word ends a basic block, as a control transfer or by falling into data"""
+        code = self.mnemonic != UNKNOWN
+        ends = self.transfers()
+        ends[:-1] |= ~code[1:]
+        return ends & code
+
+    def block_leaders(self) -> npt.NDArray[np.bool_]:
+        """Whether each word starts a basic block"""
+        code = self.mnemonic != UNKNOWN
+        leaders = np.zeros(len(code), dtype=bool)
+        leaders[0:1] = True
+        leaders[1:] |= self.block_ends()[:-1]
+        target_index = (self.target - self.image.base) // 4
+        in_image = (self.target != -1) & (self.target % 4 == 0) & (target_index >= 0) & (target_index < len(code))
+        leaders[target_index[in_image]] = True
+        return leaders & code
+
+    def basic_blocks(self) -> list[BasicBlock]:
+        """Basic blocks in address order, with successor edges forming the static control-flow graph.
+        Indirect jumps have no static successors and targets outside the image are left out"""
+        image = self.image
+        code = self.mnemonic != UNKNOWN
+        leaders = self.block_leaders()
+        transfers = self.transfers()
+        starts = np.flatnonzero(leaders)
+        boundaries = np.flatnonzero(leaders | ~code)
+        positions = np.searchsorted(boundaries, starts, side="right")
+        stops = np.append(boundaries, len(code))[positions]
+
+        last = stops - 1
+        mnemonic = self.mnemonic[last]
+        is_jal = mnemonic == JAL
+        is_call = (is_jal | (mnemonic == JALR)) & (image.rd[last] != 0)
+        target = self.target[last]
+        target_index = np.clip((target - image.base) // 4, 0, len(code) - 1)
+        taken = (target != -1) & (target % 4 == 0) & (target >= image.base) & (target < image.addr(len(code)))
+        taken &= leaders[target_index]
+        kinds = np.where(is_call, "call", np.where(is_jal, "jump", "taken"))
+        # Calls are assumed to return to the next instruction
+        falls_through = ~transfers[last] | np.isin(mnemonic, BRANCHES) | is_call
+        falls_through &= np.append(code, False)[stops]
+
+        blocks = []
+        for start, stop, block_target, kind, has_target, has_next in zip(
+                starts.tolist(), stops.tolist(), target.tolist(), kinds.tolist(), taken.tolist(),
+                falls_through.tolist()):
+            block = BasicBlock(image.addr(start), image.addr(stop))
+            if has_target:
+                block.successors.append((block_target, kind))
+            if has_next:
+                block.successors.append((block.end, "fallthrough"))
+            blocks.append(block)
+        return blocks
+
+    def cfg_dot(self) -> str:
+        """Control-flow graph of the basic blocks in Graphviz dot format"""
+        lines = ["digraph cfg {", "  node [shape=box fontname=monospace];"]
+        for block in self.basic_blocks():
+            text = "\\l".join(self.text(index).replace("\t", " ")
+                              for index in range(self.index(block.start), self.index(block.end)))
+            lines.append(f'  "{block.start:08x}" [label="{block.start:08x}{self.label(block.start)}:\\l{text}\\l"];')
+            for addr, kind in block.successors:
+                lines.append(f'  "{block.start:08x}" -> "{addr:08x}" [label="{kind}"];')
+        lines.append("}")
+        return "\n".join(lines)
+
+
+def elf_symbols(elf_file: elf.ElfFile) -> dict[int, str]:
+    """Labels by address, the first symbol at each address other than assembler-local labels"""
+    symbols: dict[int, str] = {}
+    for symbol in elf_file.symbols.values():
+        if symbol.name and not symbol.name.startswith(".L"):
+            symbols.setdefault(symbol.value, symbol.name)
+    return symbols
+
+
+def disassemble_elf(elf_file: elf.ElfFile) -> list[Disassembly]:
+    """One Disassembly for each loaded segment, as objdump -D covers every section"""
+    symbols = elf_symbols(elf_file)
+    return [Disassembly.from_bytes(segment.data, segment.vaddr, symbols)
+            for segment in elf_file.segments if segment.data]
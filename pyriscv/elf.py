@@ -0,0 +1,87 @@
+"""
+Reader for little-endian ELF32 RISC-V executables.
+Provides the loadable segments, entry point and symbol table.
+"""
+from dataclasses import dataclass
+import struct
+
+
+ELF_MAGIC = b"\x7fELF"
+ELFCLASS32 = 1
+ELFDATA2LSB = 1
+EM_RISCV = 243
+
+PT_LOAD = 1
+SHT_SYMTAB = 2
+STB_LOCAL = 0
+STT_FUNC = 2
+
+ELF_HEADER = struct.Struct("<16sHHIIIIIHHHHHH")
+PROGRAM_HEADER = struct.Struct("<IIIIIIII")
+SECTION_HEADER = struct.Struct("<IIIIIIIIII")
+SYMBOL = struct.Struct("<IIIBBH")
+
+
+@dataclass
+class Segment:
+    vaddr: int  # Address at run time
+    paddr: int  # Load address, differs from vaddr for data copied to RAM by startup code
+    data: bytes
+    mem_size: int  # Includes zero-filled bytes after data, e.g. .bss
+    flags: int
+
+
+@dataclass
+class Symbol:
+    name: str
+    value: int
+    size: int
+    type: int
+
+
+def is_elf(filepath: str) -> bool:
+    with open(filepath, "rb") as f:
+        return f.read(len(ELF_MAGIC)) == ELF_MAGIC
+
+
+class ElfFile:
+    entry: int
+    segments: list[Segment]
+    symbols: dict[str, Symbol]
+
+    def __init__(self, data: bytes) -> None:
+        (ident, _, machine, _, self.entry, phoff, shoff, _, _,
+         phentsize, phnum, shentsize, shnum, _) = ELF_HEADER.unpack_from(data)
+
+        if ident[:4] != ELF_MAGIC:
+            raise RuntimeError("Not an ELF file")
+        if ident[4] != ELFCLASS32 or ident[5] != ELFDATA2LSB or machine != EM_RISCV:
+            raise RuntimeError("Only little-endian ELF32 RISC-V files are supported")
+
+        self.segments = []
+        for index in range(phnum):
+            (p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags, _) = (
+                PROGRAM_HEADER.unpack_from(data, phoff + index * phentsize)
+            )
+            if p_type == PT_LOAD and p_memsz > 0:
+                segment_data = data[p_offset: p_offset + p_filesz]
+                self.segments.append(Segment(p_vaddr, p_paddr, segment_data, p_memsz, p_flags))
+
+        sections = [SECTION_HEADER.unpack_from(data, shoff + index * shentsize) for index in range(shnum)]
+        self.symbols = {}
+        for _, sh_type, _, _, sh_offset, sh_size, sh_link, _, _, sh_entsize in sections:
+            if sh_type != SHT_SYMTAB:
+                continue
+            strtab_offset = sections[sh_link][4]
+            for offset in range(sh_offset, sh_offset + sh_size, sh_entsize):
+                st_name, st_value, st_size, st_info, _, _ = SYMBOL.unpack_from(data, offset)
+                name_end = data.index(b"\0", strtab_offset + st_name)
+                name = data[strtab_offset + st_name: name_end].decode()
+                # Global definitions take priority over local symbols of the same name
+                if name and (name not in self.symbols or st_info >> 4 != STB_LOCAL):
+                    self.symbols[name] = Symbol(name, st_value, st_size, st_info & 0xF)
+
+    @classmethod
+    def from_file(cls, filepath: str) -> "ElfFile":
+        with open(filepath, "rb") as f:
+            return cls(f.read())
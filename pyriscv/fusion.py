@@ -0,0 +1,391 @@
+"""
+Superinstruction fusion for the interpreter.
+
+Compilers and hand-written start-up code repeat a few short instruction
+sequences, such as lui+addi to load a constant or auipc+jalr to call a
+function. Fuser recognises these sequences after decode and builds a single
+function, with the registers, immediates and PC of the sequence bound as
+constants, that has the same effect as executing each instruction in turn.
+
+Word copy and fill loops, like those in firmware/start.S, are recognised as
+a whole. The number of iterations left is worked out from the closing branch
+and the remaining words are copied with a single Memory.copy or Memory.fill,
+leaving the registers as the last iteration would.
+
+Fused operations are cached by start address and dropped with the decode cache
+when code is modified. Jumping into the middle of a sequence simply executes
+the instructions one at a time.
+"""
+from collections import Counter
+from dataclasses import dataclass
+import operator
+import typing as t
+
+from pyriscv import mem
+from pyriscv.rv32i import DecodedInstr, Opcodes, RV32I
+
+
+MASK = 0xFFFFFFFF
+SIGN = 0x80000000
+
+MAX_FUSED_LEN = 5
+
+TERMINATORS = (Opcodes.BRANCH, Opcodes.JAL, Opcodes.JALR, Opcodes.SYSTEM)
+
+BRANCH_TESTS: dict[int, t.Callable[[int, int], bool]] = {
+    0x0: operator.eq,  # BEQ
+    0x1: operator.ne,  # BNE
+    0x4: lambda a, b: (a ^ SIGN) < (b ^ SIGN),  # BLT
+    0x5: lambda a, b: (a ^ SIGN) >= (b ^ SIGN),  # BGE
+    0x6: operator.lt,  # BLTU
+    0x7: operator.ge,  # BGEU
+}
+
+
+@dataclass
+class FusedOp:
+    name: str
+    start: int
+    length: int  # Number of instructions replaced
+    run: t.Callable[[RV32I, int], int]  # Given the most instructions it may execute, returns the number executed
+
+
+def to_signed(value: int) -> int:
+    return (value ^ SIGN) - SIGN
+
+
+def count_iterations(funct3: int, a: int, a_step: int, b: int, b_step: int) -> int | None:
+    """
+    Iterations left in a loop closed by a branch on a and b, one of which changes by its step each
+    iteration before the branch. The current iteration is counted, so the result is at least 1.
+    None if it can't be worked out simply, such as when the loop would wrap around
+    """
+    if bool(a_step) == bool(b_step):
+        return None
+    if funct3 == 0x1:  # BNE
+        value, step, bound = (a, a_step, b) if a_step else (b, b_step, a)
+        distance = ((bound - value) if step > 0 else (value - bound)) & MASK
+        if distance == 0 or distance % abs(step):
+            return None
+        return distance // abs(step)
+    if funct3 not in (0x4, 0x5, 0x6, 0x7):
+        return None
+
+    if funct3 in (0x4, 0x5):  # BLT/BGE
+        a, b, low, high = to_signed(a), to_signed(b), -SIGN, SIGN - 1
+    else:
+        low, high = 0, MASK
+    taken_if_less = funct3 in (0x4, 0x6)
+    inclusive = not taken_if_less  # BGE/BGEU
+    if a_step:  # Loop continues while value < bound or value >= bound
+        value, step, bound, continue_if_less = a, a_step, b, taken_if_less
+    else:  # Loop continues while bound < value or bound >= value
+        value, step, bound, continue_if_less = b, b_step, a, not taken_if_less
+
+    if continue_if_less and step > 0:
+        iterations = (bound - value) // step + 1 if inclusive else -((value - bound) // step)
+    elif not continue_if_less and step < 0:
+        iterations = (value - bound) // -step + 1 if inclusive else -((bound - value) // -step)
+    else:
+        return None
+    iterations = max(iterations, 1)
+    if not low <= value + step * iterations <= high:
+        return None
+    return iterations
+
+
+def is_addi(instr: DecodedInstr) -> bool:
+    return instr.opcode == Opcodes.OP_IMM and instr.funct3 == 0x0
+
+
+def is_branch(instr: DecodedInstr) -> bool:
+    return instr.opcode == Opcodes.BRANCH and instr.funct3 in BRANCH_TESTS
+
+
+def fuse_copy_loop(instrs: list[DecodedInstr], pc: int) -> FusedOp | None:
+    """
+    lw tmp, i(src); sw tmp, j(dst); addi src, src, k; addi dst, dst, m; branch.
+    When the branch closes a loop over ascending words, the remaining iterations
+    are done as one Memory.copy, otherwise one iteration is run at a time
+    """
+    if len(instrs) < 5:
+        return None
+    load, store, inc_src, inc_dst, branch = instrs[:5]
+    tmp, src, dst = load.rd, load.rs1, store.rs1
+    if not (load.opcode == Opcodes.LOAD and load.funct3 == 0x2 and store.opcode == Opcodes.STORE
+            and store.funct3 == 0x2 and store.rs2 == tmp and is_addi(inc_src) and inc_src.rd == inc_src.rs1 == src
+            and is_addi(inc_dst) and inc_dst.rd == inc_dst.rs1 == dst and is_branch(branch)
+            and 0 not in (tmp, src, dst) and len({tmp, src, dst}) == 3):
+        return None
+
+    load_offset, store_offset, src_step, dst_step = load.imm, store.imm, inc_src.imm, inc_dst.imm
+    rs1, rs2, funct3, test = branch.rs1, branch.rs2, branch.funct3, BRANCH_TESTS[branch.funct3]
+    target, next_pc = (pc + 16 + branch.imm) & MASK, (pc + 20) & MASK
+    steps = {src: src_step, dst: dst_step}
+    bulk = target == pc and src_step == dst_step == 4 and tmp not in (rs1, rs2)
+
+    def run_bulk(rv: RV32I, limit: int) -> int:
+        """Copy all remaining words at once, 0 if the loop can't be done in bulk"""
+        x = rv.xregs
+        iterations = count_iterations(funct3, x[rs1], steps.get(rs1, 0), x[rs2], steps.get(rs2, 0))
+        if iterations is None:
+            return 0
+        count = min(iterations, limit // 5)
+        size = 4 * count
+        src_addr, dst_addr = (x[src] + load_offset) & MASK, (x[dst] + store_offset) & MASK
+        if (count < 2 or src_addr + size > MASK or dst_addr + size > MASK
+                or (dst_addr < pc + 20 and pc < dst_addr + size)):  # Would overwrite the loop itself
+            return 0
+        if not rv.memory.copy(dst_addr, src_addr, size):
+            return 0
+        x[tmp] = rv.memory.read(src_addr + size - 4, mem.DataSize.WORD)
+        x[src] = (x[src] + size) & MASK
+        x[dst] = (x[dst] + size) & MASK
+        rv.pc_addr = target if count < iterations else next_pc
+        return 5 * count
+
+    def run(rv: RV32I, limit: int) -> int:
+        if bulk:
+            executed = run_bulk(rv, limit)
+            if executed:
+                return executed
+
+        x = rv.xregs
+        val = x[tmp] = rv.memory.read((x[src] + load_offset) & MASK, mem.DataSize.WORD)
+        code_generation = rv.memory.code_generation
+        try:
+            rv.memory.write((x[dst] + store_offset) & MASK, mem.DataSize.WORD, val)
+        except Exception:
+            # The load has retired, as it would have on the interpreter
+            rv.pc_addr = (pc + 4) & MASK
+            rv.instret += 1
+            raise
+        if rv.memory.code_generation != code_generation:
+            rv.pc_addr = (pc + 8) & MASK  # The store modified code, which may include the rest of the loop
+            return 2
+        x[src] = (x[src] + src_step) & MASK
+        x[dst] = (x[dst] + dst_step) & MASK
+        rv.pc_addr = target if test(x[rs1], x[rs2]) else next_pc
+        return 5
+
+    return FusedOp("copy_loop", pc, 5, run)
+
+
+def fuse_fill_loop(instrs: list[DecodedInstr], pc: int) -> FusedOp | None:
+    """
+    sw val, j(dst); addi dst, dst, m; branch.
+    When the branch closes a loop over ascending words, the remaining iterations
+    are done as one Memory.fill, otherwise one iteration is run at a time
+    """
+    if len(instrs) < 3:
+        return None
+    store, inc_dst, branch = instrs[:3]
+    dst, val = store.rs1, store.rs2
+    if not (store.opcode == Opcodes.STORE and store.funct3 == 0x2 and is_addi(inc_dst)
+            and inc_dst.rd == inc_dst.rs1 == dst != 0 and is_branch(branch)):
+        return None
+
+    store_offset, dst_step = store.imm, inc_dst.imm
+    rs1, rs2, funct3, test = branch.rs1, branch.rs2, branch.funct3, BRANCH_TESTS[branch.funct3]
+    target, next_pc = (pc + 8 + branch.imm) & MASK, (pc + 12) & MASK
+    bulk = target == pc and dst_step == 4 and val != dst
+
+    def run_bulk(rv: RV32I, limit: int) -> int:
+        """Store all remaining words at once, 0 if the loop can't be done in bulk"""
+        x = rv.xregs
+        iterations = count_iterations(funct3, x[rs1], 4 if rs1 == dst else 0, x[rs2], 4 if rs2 == dst else 0)
+        if iterations is None:
+            return 0
+        count = min(iterations, limit // 3)
+        size = 4 * count
+        dst_addr = (x[dst] + store_offset) & MASK
+        if count < 2 or dst_addr + size > MASK or (dst_addr < pc + 12 and pc < dst_addr + size):
+            return 0
+        if not rv.memory.fill(dst_addr, x[val], size):
+            return 0
+        x[dst] = (x[dst] + size) & MASK
+        rv.pc_addr = target if count < iterations else next_pc
+        return 3 * count
+
+    def run(rv: RV32I, limit: int) -> int:
+        if bulk:
+            executed = run_bulk(rv, limit)
+            if executed:
+                return executed
+
+        x = rv.xregs
+        code_generation = rv.memory.code_generation
+        rv.memory.write((x[dst] + store_offset) & MASK, mem.DataSize.WORD, x[val])
+        if rv.memory.code_generation != code_generation:
+            rv.pc_addr = (pc + 4) & MASK
+            return 1
+        x[dst] = (x[dst] + dst_step) & MASK
+        rv.pc_addr = target if test(x[rs1], x[rs2]) else next_pc
+        return 3
+
+    return FusedOp("fill_loop", pc, 3, run)
+
+
+def fuse_constant(instrs: list[DecodedInstr], pc: int) -> FusedOp | None:
+    """lui/auipc rd, hi; addi rd, rd, lo, as used by li and la"""
+    if len(instrs) < 2:
+        return None
+    upper, addi = instrs[:2]
+    rd = upper.rd
+    if not (upper.opcode in (Opcodes.LUI, Opcodes.AUIPC) and is_addi(addi) and addi.rd == addi.rs1 == rd != 0):
+        return None
+
+    base = pc if upper.opcode == Opcodes.AUIPC else 0
+    value = (base + (upper.imm << 12) + addi.imm) & MASK
+    next_pc = (pc + 8) & MASK
+
+    def run(rv: RV32I, limit: int) -> int:
+        rv.xregs[rd] = value
+        rv.pc_addr = next_pc
+        return 2
+
+    return FusedOp("lui_addi" if upper.opcode == Opcodes.LUI else "auipc_addi", pc, 2, run)
+
+
+def fuse_call(instrs: list[DecodedInstr], pc: int) -> FusedOp | None:
+    """auipc tmp, hi; jalr rd, lo(tmp), as used by call and tail"""
+    if len(instrs) < 2:
+        return None
+    auipc, jalr = instrs[:2]
+    tmp, rd = auipc.rd, jalr.rd
+    if not (auipc.opcode == Opcodes.AUIPC and jalr.opcode == Opcodes.JALR and jalr.funct3 == 0x0
+            and jalr.rs1 == tmp != 0):
+        return None
+
+    tmp_value = (pc + (auipc.imm << 12)) & MASK
+    target = (tmp_value + jalr.imm) & MASK & ~1
+    link = (pc + 8) & MASK
+
+    def run(rv: RV32I, limit: int) -> int:
+        rv.xregs[tmp] = tmp_value
+        if rd != 0:
+            rv.xregs[rd] = link
+        rv.pc_addr = target
+        return 2
+
+    return FusedOp("auipc_jalr", pc, 2, run)
+
+
+def fuse_compare_branch(instrs: list[DecodedInstr], pc: int) -> FusedOp | None:
+    """slt/sltu/slti/sltiu rd, ...; beqz/bnez rd"""
+    if len(instrs) < 2:
+        return None
+    compare, branch = instrs[:2]
+    rd = compare.rd
+    if not (compare.funct3 in (0x2, 0x3) and rd != 0
+            and (compare.opcode == Opcodes.OP_IMM or (compare.opcode == Opcodes.OP and compare.funct7 == 0x00))
+            and branch.opcode == Opcodes.BRANCH and branch.funct3 in (0x0, 0x1)
+            and (branch.rs1, branch.rs2) in ((rd, 0), (0, rd))):
+        return None
+
+    rs1, rs2 = compare.rs1, compare.rs2
+    immediate = compare.opcode == Opcodes.OP_IMM
+    imm = compare.imm & MASK if immediate else 0
+    signed = compare.funct3 == 0x2
+    branch_if_set = branch.funct3 == 0x1  # BNE
+    target, next_pc = (pc + 4 + branch.imm) & MASK, (pc + 8) & MASK
+
+    def run(rv: RV32I, limit: int) -> int:
+        x = rv.xregs
+        a, b = x[rs1], imm if immediate else x[rs2]
+        result = (a ^ SIGN) < (b ^ SIGN) if signed else a < b
+        x[rd] = int(result)
+        rv.pc_addr = target if result == branch_if_set else next_pc
+        return 2
+
+    return FusedOp("compare_branch", pc, 2, run)
+
+
+def fuse_addi_branch(instrs: list[DecodedInstr], pc: int) -> FusedOp | None:
+    """addi rd, rs, imm; branch, as at the end of counted loops"""
+    if len(instrs) < 2:
+        return None
+    addi, branch = instrs[:2]
+    rd, src = addi.rd, addi.rs1
+    if not (is_addi(addi) and rd != 0 and is_branch(branch)):
+        return None
+
+    imm = addi.imm
+    rs1, rs2, test = branch.rs1, branch.rs2, BRANCH_TESTS[branch.funct3]
+    target, next_pc = (pc + 4 + branch.imm) & MASK, (pc + 8) & MASK
+
+    def run(rv: RV32I, limit: int) -> int:
+        x = rv.xregs
+        x[rd] = (x[src] + imm) & MASK
+        rv.pc_addr = target if test(x[rs1], x[rs2]) else next_pc
+        return 2
+
+    return FusedOp("addi_branch", pc, 2, run)
+
+
+# Tried in order, so longer sequences take priority
+PATTERNS: list[t.Callable[[list[DecodedInstr], int], FusedOp | None]] = [
+    fuse_copy_loop,
+    fuse_fill_loop,
+    fuse_constant,
+    fuse_call,
+    fuse_compare_branch,
+    fuse_addi_branch,
+]
+
+
+class Fuser:
+    rv: RV32I
+    ops: dict[int, FusedOp | DecodedInstr]  # The decoded instruction where no sequence starts
+    code_generation: int
+    counts: Counter[str]  # Times each fused operation ran, set by RV32I.run_fused
+    instructions: Counter[str]  # Instructions executed by each fused operation
+
+    def __init__(self, rv: RV32I) -> None:
+        self.rv = rv
+        self.ops = {}
+        self.code_generation = rv.memory.code_generation
+        self.counts = Counter()
+        self.instructions = Counter()
+
+    def lookup(self, addr: int) -> FusedOp | DecodedInstr | None:
+        """Get the fused operation or else the instruction at addr, None if it can't be decoded"""
+        if self.code_generation != self.rv.memory.code_generation:
+            # Code has been modified, so any sequence could be stale
+            self.ops.clear()
+            self.code_generation = self.rv.memory.code_generation
+
+        op = self.ops.get(addr)
+        if op is None:
+            instrs = self.find_sequence(addr)
+            if not instrs:
+                return None
+            op = self.ops[addr] = self.fuse(instrs, addr) or instrs[0]
+        return op
+
+    def find_sequence(self, start: int) -> list[DecodedInstr]:
+        """Decode up to MAX_FUSED_LEN instructions from start, stopping after a control transfer"""
+        instrs = []
+        for i in range(MAX_FUSED_LEN):
+            try:
+                instr = self.rv.decode_at((start + 4 * i) & MASK)
+            except (RuntimeError, ValueError):
+                break  # Not code, leave the error to the interpreter
+            instrs.append(instr)
+            if instr.opcode in TERMINATORS:
+                break
+        return instrs
+
+    def fuse(self, instrs: list[DecodedInstr], addr: int) -> FusedOp | None:
+        for pattern in PATTERNS:
+            op = pattern(instrs, addr)
+            if op is not None:
+                return op
+        return None
+
+    def report(self) -> str:
+        """Times each fused operation ran and the instructions it covered"""
+        lines = [f"{'fusion':<16} {'count':>12} {'instrs':>12}"]
+        for name, count in self.counts.most_common():
+            lines.append(f"{name:<16} {count:>12} {self.instructions[name]:>12}")
+        return "\n".join(lines)
@@ -0,0 +1,494 @@
+"""
+Differential fuzzing of the emulator against a golden model.
+
+Each case is a random sequence of valid RV32I instructions with random initial
+registers and data memory. It is run on RV32I and on GoldenModel, a plain
+rendering of the RV32I semantics written separately from RV32I, and the final
+registers, PC, instruction count and data memory must agree.
+
+Random branches and jumps only go forwards, and programs end with EBREAK. The
+only backward branches close generated loops with a known trip count: counted
+loops, and word copy and fill loops over the data window in the shapes that
+Fuser runs as bulk Memory.copy/fill. Nothing jumps into the middle of a loop,
+so every case terminates within instruction_limit. Loads and stores address a
+data window in RAM through a base register, picked per case, that the program
+never writes.
+
+Failing cases are minimized by replacing instructions with NOPs and clearing
+registers and memory for as long as the case still fails. Each case is
+generated from the run seed and its index, so any case can be replayed.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+import itertools
+import random
+import time
+import typing as t
+
+from pyriscv import mem
+from pyriscv.assem import ASM_INSTR_FORMATS, FIXED_WORDS, PROGRAM_START, asm_program, encode
+from pyriscv.rv32i import RV32I
+
+
+MASK = 0xFFFFFFFF
+DATA_START = 0x90000000  # RVMemory RAM
+DATA_SIZE = 2048
+
+NOP = encode("addi")
+EBREAK = FIXED_WORDS["ebreak"]
+
+MODES = ("plain", "translate", "fuse")
+
+# Boundary values in the style of the RISC-V architecture tests, used for registers and immediates
+INTERESTING_VALUES = [0x0, 0x1, 0x2, 0x7FFFFFFF, 0x80000000, 0x80000001, 0xFFFFFFFF, 0xFFFFFFFE, 0x55555555,
+                      0xAAAAAAAA, 0x33333333, 0x66666666, 0xB504, 0xFFFF, 0x10000, 0x800, 0x7FF, 0xFFFFF800]
+INTERESTING_IMMS = [0, 1, -1, 2, 0x7FF, -0x800, 0x555, -0x556, 0x400, 0x20]
+
+R_INSTRS = [name for name, (typ, _) in ASM_INSTR_FORMATS.items() if typ == "R"]
+I_INSTRS = ["addi", "slti", "sltiu", "xori", "ori", "andi", "slli", "srli", "srai"]
+LOAD_SIZES = {"lb": 1, "lh": 2, "lw": 4, "lbu": 1, "lhu": 2}
+STORE_SIZES = {"sb": 1, "sh": 2, "sw": 4}
+BRANCHES = ["beq", "bne", "blt", "bge", "bltu", "bgeu"]
+
+# Relative weights of each kind of instruction, or of loop
+KINDS = {"op": 30, "op_imm": 25, "upper": 8, "load": 10, "store": 10, "branch": 10, "jal": 4, "jalr": 3,
+         "loop": 3, "copy_loop": 2, "fill_loop": 2}
+LOOP_BODY_KINDS = ("op", "op_imm", "upper", "load", "store")
+LOOP_BRANCHES = ("bne", "bltu", "blt")  # Close pointer loops, continuing while the pointer is below the end
+MAX_TRIPS = 64  # Most iterations of a generated loop
+KIND_NAMES = list(KINDS)
+KIND_CUM_WEIGHTS = list(itertools.accumulate(KINDS.values()))
+
+
+@dataclass
+class FuzzCase:
+    program: list[int]  # Instruction words, ending with EBREAK
+    regs: list[int]  # Initial registers
+    data: bytes  # Initial contents of the data window
+
+
+@dataclass
+class State:
+    regs: list[int]
+    pc: int
+    instret: int
+    data: bytes
+
+
+class InvalidCase(Exception):
+    """The case leaves the program or data window or never ends, as can happen while minimizing"""
+
+
+def instruction_limit(program: list[int]) -> int:
+    """Most instructions a generated program can execute, as only loops repeat and at most MAX_TRIPS times"""
+    return len(program) * MAX_TRIPS
+
+
+def sign_extend(value: int, bits: int) -> int:
+    return (value & ((1 << (bits - 1)) - 1)) - (value & (1 << (bits - 1)))
+
+
+def signed(value: int) -> int:
+    return value - (1 << 32) if value & 0x80000000 else value
+
+
+class GoldenModel:
+    """Straightforward RV32I semantics, decoding each word afresh"""
+
+    regs: list[int]
+    pc: int
+    instret: int
+    program: list[int]
+    data: bytearray
+
+    def __init__(self, case: FuzzCase) -> None:
+        self.regs = list(case.regs)
+        self.pc = PROGRAM_START
+        self.instret = 0
+        self.program = case.program
+        self.data = bytearray(case.data)
+
+    def load(self, addr: int, size: int) -> int:
+        offset = addr - DATA_START
+        if not 0 <= offset <= len(self.data) - size:
+            raise InvalidCase(f"Load outside the data window: 0x{addr:08x}")
+        return int.from_bytes(self.data[offset: offset + size], "little")
+
+    def store(self, addr: int, size: int, value: int) -> None:
+        offset = addr - DATA_START
+        if not 0 <= offset <= len(self.data) - size:
+            raise InvalidCase(f"Store outside the data window: 0x{addr:08x}")
+        self.data[offset: offset + size] = (value & ((1 << (8 * size)) - 1)).to_bytes(size, "little")
+
+    def run(self) -> State:
+        while True:
+            index, misaligned = divmod(self.pc - PROGRAM_START, 4)
+            if misaligned or not 0 <= index < len(self.program):
+                raise InvalidCase(f"Jump outside the program: 0x{self.pc:08x}")
+            word = self.program[index]
+            if word == EBREAK:
+                return State(self.regs, self.pc, self.instret, bytes(self.data))
+            if self.instret == instruction_limit(self.program):
+                raise InvalidCase("Does not reach EBREAK within the instruction limit")
+            self.step(word)
+            self.instret += 1
+
+    def step(self, word: int) -> None:
+        opcode = word & 0x7F
+        rd = (word >> 7) & 0x1F
+        funct3 = (word >> 12) & 0x7
+        rs1 = self.regs[(word >> 15) & 0x1F]
+        rs2 = self.regs[(word >> 20) & 0x1F]
+        funct7 = word >> 25
+        imm_i = sign_extend(word >> 20, 12)
+        next_pc = self.pc + 4
+        result = None
+
+        if opcode == 0b0110011:  # OP
+            shamt = rs2 & 0x1F
+            result = {
+                (0, 0x00): rs1 + rs2,
+                (0, 0x20): rs1 - rs2,
+                (1, 0x00): rs1 << shamt,
+                (2, 0x00): int(signed(rs1) < signed(rs2)),
+                (3, 0x00): int(rs1 < rs2),
+                (4, 0x00): rs1 ^ rs2,
+                (5, 0x00): rs1 >> shamt,
+                (5, 0x20): signed(rs1) >> shamt,
+                (6, 0x00): rs1 | rs2,
+                (7, 0x00): rs1 & rs2,
+            }[funct3, funct7]
+        elif opcode == 0b0010011:  # OP-IMM
+            shamt = imm_i & 0x1F
+            imm = imm_i & MASK
+            result = {
+                0: rs1 + imm,
+                1: rs1 << shamt,
+                2: int(signed(rs1) < imm_i),
+                3: int(rs1 < imm),
+                4: rs1 ^ imm,
+                5: signed(rs1) >> shamt if funct7 == 0x20 else rs1 >> shamt,
+                6: rs1 | imm,
+                7: rs1 & imm,
+            }[funct3]
+        elif opcode == 0b0110111:  # LUI
+            result = word & 0xFFFFF000
+        elif opcode == 0b0010111:  # AUIPC
+            result = self.pc + (word & 0xFFFFF000)
+        elif opcode == 0b0000011:  # LOAD
+            size = {0: 1, 1: 2, 2: 4, 4: 1, 5: 2}[funct3]
+            result = self.load((rs1 + imm_i) & MASK, size)
+            if funct3 < 4:
+                result = sign_extend(result, 8 * size)
+        elif opcode == 0b0100011:  # STORE
+            imm_s = sign_extend((funct7 << 5) | rd, 12)
+            self.store((rs1 + imm_s) & MASK, 1 << funct3, rs2)
+        elif opcode == 0b1100011:  # BRANCH
+            imm_b = sign_extend(((word >> 31) << 12) | (((word >> 7) & 0x1) << 11) | (((word >> 25) & 0x3F) << 5)
+                                | (((word >> 8) & 0xF) << 1), 13)
+            taken = {
+                0: rs1 == rs2,
+                1: rs1 != rs2,
+                4: signed(rs1) < signed(rs2),
+                5: signed(rs1) >= signed(rs2),
+                6: rs1 < rs2,
+                7: rs1 >= rs2,
+            }[funct3]
+            if taken:
+                next_pc = self.pc + imm_b
+        elif opcode == 0b1101111:  # JAL
+            imm_j = sign_extend(((word >> 31) << 20) | (word & 0xFF000) | (((word >> 20) & 0x1) << 11)
+                                | (((word >> 21) & 0x3FF) << 1), 21)
+            result = next_pc
+            next_pc = self.pc + imm_j
+        elif opcode == 0b1100111:  # JALR
+            result = next_pc
+            next_pc = (rs1 + imm_i) & MASK & ~1
+        elif opcode == 0b0001111:  # FENCE
+            pass
+        else:
+            raise ValueError(f"Golden model does not implement: 0x{word:08x}")
+
+        if result is not None and rd != 0:
+            self.regs[rd] = result & MASK
+        self.pc = next_pc & MASK
+
+
+def random_value(rng: random.Random) -> int:
+    return rng.choice(INTERESTING_VALUES) if rng.random() < 0.5 else rng.getrandbits(32)
+
+
+def random_imm(rng: random.Random) -> int:
+    return rng.choice(INTERESTING_IMMS) if rng.random() < 0.3 else rng.randrange(-0x800, 0x800)
+
+
+def simple_instr(rng: random.Random, kind: str, base: int, dests: list[int]) -> int:
+    """Random instruction of kind that doesn't transfer control, writing one of dests"""
+    rd, rs1, rs2 = rng.choice(dests), rng.randrange(32), rng.randrange(32)
+    match kind:
+        case "op":
+            return encode(rng.choice(R_INSTRS), rd, rs1, rs2)
+        case "op_imm":
+            return encode(rng.choice(I_INSTRS), rd, rs1, imm=random_imm(rng))
+        case "upper":
+            return encode(rng.choice(("lui", "auipc")), rd, imm=random_value(rng) >> 12)
+        case "load":
+            name = rng.choice(list(LOAD_SIZES))
+            size = LOAD_SIZES[name]
+            return encode(name, rd, base, imm=size * rng.randrange(DATA_SIZE // size))
+        case _:  # store
+            name = rng.choice(list(STORE_SIZES))
+            size = STORE_SIZES[name]
+            return encode(name, rs1=base, rs2=rs2, imm=size * rng.randrange(DATA_SIZE // size))
+
+
+def counted_loop(rng: random.Random, base: int, dests: list[int], counter: int) -> list[int]:
+    """Set counter to the trip count, then repeat a short body while counting it down to zero"""
+    body_dests = [reg for reg in dests if reg != counter]
+    body = [simple_instr(rng, rng.choice(LOOP_BODY_KINDS), base, body_dests) for _ in range(rng.randint(1, 3))]
+    offset = -4 * (len(body) + 1)
+    if rng.random() < 0.5:
+        branch = encode("bne", rs1=counter, rs2=0, imm=offset)
+    else:
+        branch = encode("blt", rs1=0, rs2=counter, imm=offset)
+    return [encode("addi", counter, 0, imm=rng.randint(1, MAX_TRIPS)), *body,
+            encode("addi", counter, counter, imm=-1), branch]
+
+
+def word_range(rng: random.Random) -> tuple[int, int, int]:
+    """(offset into the data window, size, load/store offset) of a run of words for a copy or fill loop"""
+    size = 4 * rng.randint(1, MAX_TRIPS)
+    # Leave a word spare, so the end pointer offset still fits an ADDI immediate
+    return 4 * rng.randrange((DATA_SIZE - 4 - size) // 4 + 1), size, rng.choice((0, 0, 4, 8))
+
+
+def copy_loop(rng: random.Random, base: int, tmp: int, src: int, dst: int, end: int) -> list[int]:
+    """Point src, dst and end into the data window, then copy words, as in firmware/start.S"""
+    src_start, size, load_offset = word_range(rng)
+    dst_start, _, store_offset = word_range(rng)
+    dst_start = min(dst_start, DATA_SIZE - 4 - size)  # The ranges may overlap, which bulk copies must decline
+    return [
+        encode("addi", src, base, imm=src_start - load_offset),
+        encode("addi", dst, base, imm=dst_start - store_offset),
+        encode("addi", end, base, imm=dst_start - store_offset + size),
+        encode("lw", tmp, src, imm=load_offset),
+        encode("sw", rs1=dst, rs2=tmp, imm=store_offset),
+        encode("addi", src, src, imm=4),
+        encode("addi", dst, dst, imm=4),
+        encode(rng.choice(LOOP_BRANCHES), rs1=dst, rs2=end, imm=-16),
+    ]
+
+
+def fill_loop(rng: random.Random, base: int, val: int, dst: int, end: int) -> list[int]:
+    """Point dst and end into the data window, then store val to each word between them"""
+    start, size, store_offset = word_range(rng)
+    return [
+        encode("addi", dst, base, imm=start - store_offset),
+        encode("addi", end, base, imm=start - store_offset + size),
+        encode("sw", rs1=dst, rs2=val, imm=store_offset),
+        encode("addi", dst, dst, imm=4),
+        encode(rng.choice(LOOP_BRANCHES), rs1=dst, rs2=end, imm=-8),
+    ]
+
+
+def generate_case(seed: int, index: int, length: int = 32) -> FuzzCase:
+    """Random case number index of the run with seed, of length instructions before the EBREAK"""
+    rng = random.Random(f"{seed}:{index}")
+    base = rng.randrange(1, 32)  # Holds DATA_START and is never written
+    dests = [reg for reg in range(32) if reg != base]
+    loop_regs = dests[1:]  # Without x0
+
+    # Jumps are (name, rd, rs1, rs2) until their targets are picked, once the layout is known
+    program: list[int | tuple[str, int, int, int]] = []
+    no_targets = set()  # Jumping to these would skip the setup of a JALR or loop
+    kinds = iter(rng.choices(KIND_NAMES, cum_weights=KIND_CUM_WEIGHTS, k=length))
+    while len(program) < length:
+        kind = next(kinds)
+        rd, rs1, rs2 = rng.choice(dests), rng.randrange(32), rng.randrange(32)
+        match kind:
+            case "op" | "op_imm" | "upper" | "load" | "store":
+                words = [simple_instr(rng, kind, base, dests)]
+            case "branch":
+                words = [(rng.choice(BRANCHES), 0, rs1, rs2)]
+            case "jal":
+                words = [("jal", rd, 0, 0)]
+            case "jalr" if rd != 0:
+                # AUIPC gives the jump a known base
+                words = [encode("auipc", rd, imm=0), ("jalr", rng.choice(dests), rd, 0)]
+            case "loop":
+                words = counted_loop(rng, base, dests, rng.choice(loop_regs))
+            case "copy_loop":
+                words = copy_loop(rng, base, *rng.sample(loop_regs, 4))
+            case "fill_loop":
+                dst, end = rng.sample(loop_regs, 2)
+                words = fill_loop(rng, base, rng.choice([reg for reg in range(32) if reg != dst]), dst, end)
+            case _:
+                words = [NOP]
+        if len(program) + len(words) > length:
+            words = [NOP]
+        no_targets.update(range(len(program) + 1, len(program) + len(words)))
+        program += words
+
+    words = []
+    for index, word in enumerate(program):
+        if isinstance(word, tuple):
+            name, rd, rs1, rs2 = word
+            target = rng.randint(index + 1, length)  # Any later instruction or the EBREAK
+            while target in no_targets:
+                target = rng.randint(index + 1, length)
+            if name == "jalr":  # Offset from the AUIPC, with a low bit that JALR ignores
+                word = encode(name, rd, rs1, imm=4 * (target - index + 1) + rng.randrange(2))
+            else:
+                word = encode(name, rd, rs1, rs2, imm=4 * (target - index))
+        words.append(word)
+
+    regs = [0] + [random_value(rng) for _ in range(31)]
+    regs[base] = DATA_START
+    data = rng.randbytes(DATA_SIZE)
+    return FuzzCase(words + [EBREAK], regs, data)
+
+
+class Harness:
+    """Runs cases on one reused RV32I, run as given by mode"""
+
+    rv: RV32I
+    mode: str
+
+    def __init__(self, mode: str = "plain", rv: RV32I | None = None) -> None:
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode: {mode}")
+        self.rv = rv if rv is not None else RV32I(mem.RVMemory())
+        self.mode = mode
+
+    def run(self, case: FuzzCase) -> State:
+        rv = self.rv
+        memory = t.cast(mem.RVMemory, rv.memory)
+        rv.set_pc(memory.load_program(asm_program(case.program)))
+        memory.ram.load(case.data)
+        rv.xregs[:] = case.regs
+        rv.instret = 0
+        rv.run_program(instruction_limit(case.program), translate=self.mode == "translate", fuse=self.mode == "fuse")
+        return State(list(rv.xregs), rv.pc_addr, rv.instret, bytes(memory.ram.buf[:len(case.data)]))
+
+    def check(self, case: FuzzCase) -> str | None:
+        """Description of how the emulator and golden model differ, None if they agree"""
+        expected = GoldenModel(case).run()
+        try:
+            actual = self.run(case)
+        except Exception as e:
+            return f"Emulator raised {type(e).__name__}: {e}"
+
+        differences = [f"x{reg}: 0x{actual.regs[reg]:08x} != expected 0x{expected.regs[reg]:08x}"
+                       for reg in range(32) if actual.regs[reg] != expected.regs[reg]]
+        if actual.pc != expected.pc:
+            differences.append(f"pc: 0x{actual.pc:08x} != expected 0x{expected.pc:08x}")
+        if actual.instret != expected.instret:
+            differences.append(f"instret: {actual.instret} != expected {expected.instret}")
+        if actual.data != expected.data:
+            differences += [f"data 0x{DATA_START + offset:08x}: 0x{actual.data[offset]:02x} != expected 0x{byte:02x}"
+                            for offset, byte in enumerate(expected.data) if actual.data[offset] != byte][:8]
+        return "\n".join(differences) or None
+
+    def fails(self, case: FuzzCase) -> bool:
+        try:
+            return self.check(case) is not None
+        except InvalidCase:
+            return False
+
+    def minimize(self, case: FuzzCase) -> FuzzCase:
+        """Smallest variant of a failing case found by NOPing instructions and clearing state"""
+        changed = True
+        while changed:
+            changed = False
+            for index in range(len(case.program) - 1):
+                if case.program[index] != NOP:
+                    candidate = replace(case, program=case.program[:index] + [NOP] + case.program[index + 1:])
+                    if self.fails(candidate):
+                        case, changed = candidate, True
+            for reg in range(1, 32):
+                if case.regs[reg] != 0:
+                    candidate = replace(case, regs=case.regs[:reg] + [0] + case.regs[reg + 1:])
+                    if self.fails(candidate):
+                        case, changed = candidate, True
+            if any(case.data):
+                candidate = replace(case, data=bytes(len(case.data)))
+                if self.fails(candidate):
+                    case, changed = candidate, True
+        return case
+
+
+@dataclass
+class Failure:
+    index: int  # Case number, for generate_case
+    message: str
+    case: FuzzCase  # Minimized, unless the generator made an invalid case
+
+
+@dataclass
+class BatchResult:
+    cases: int = 0
+    instructions: int = 0  # Executed by the emulator
+    failures: list[Failure] = field(default_factory=list)
+
+
+def run_batch(batch: tuple[int, range, int, str]) -> BatchResult:
+    """Run cases with the indices in range, in a worker process"""
+    seed, indices, length, mode = batch
+    harness = Harness(mode)
+    result = BatchResult()
+    for index in indices:
+        case = generate_case(seed, index, length)
+        result.cases += 1
+        try:
+            message = harness.check(case)
+        except InvalidCase as e:
+            result.failures.append(Failure(index, f"Invalid generated case: {e}", case))
+            continue
+        result.instructions += harness.rv.instret
+        if message is not None:
+            minimized = harness.minimize(case)
+            result.failures.append(Failure(index, harness.check(minimized) or message, minimized))
+    return result
+
+
+@dataclass
+class FuzzReport:
+    cases: int
+    instructions: int
+    seconds: float
+    failures: list[Failure]
+
+    @property
+    def cases_per_second(self) -> float:
+        return self.cases / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.cases} cases, {self.instructions} instructions in {self.seconds:.1f} s: "
+                f"{self.cases_per_second:,.0f} cases/s, {self.instructions / (self.seconds or 1):,.0f} instr/s, "
+                f"{len(self.failures)} failures")
+
+
+def fuzz(cases: int, seed: int = 0, length: int = 32, mode: str = "plain", jobs: int = 1,
+         batch_size: int = 1000, progress: t.Callable[[FuzzReport], None] | None = None) -> FuzzReport:
+    """Run cases in batches, across jobs worker processes if more than one"""
+    batches = [(seed, range(start, min(start + batch_size, cases)), length, mode)
+               for start in range(0, cases, batch_size)]
+    report = FuzzReport(0, 0, 0.0, [])
+    start_time = time.perf_counter()
+
+    def add(result: BatchResult) -> None:
+        report.cases += result.cases
+        report.instructions += result.instructions
+        report.failures += result.failures
+        report.seconds = time.perf_counter() - start_time
+        if progress is not None:
+            progress(report)
+
+    if jobs == 1:
+        for batch in batches:
+            add(run_batch(batch))
+    else:
+        with ProcessPoolExecutor(jobs) as executor:
+            for result in executor.map(run_batch, batches):
+                add(result)
+    return report
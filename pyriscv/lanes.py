@@ -0,0 +1,246 @@
+"""
+Batched execution of one program over many independent harts.
+
+Each lane is a hart with its own registers, PC and RAM, held together as NumPy
+arrays so one instruction is executed for many lanes with a single vector op.
+ROM is read-only, so it is shared by all lanes along with the decoded code.
+The counter CSRs read the instret of each lane, as in RV32I.
+
+Lanes whose PCs differ are split into groups and the group with the lowest PC
+runs first. Lanes that diverge at a branch usually reconverge where the paths
+join, so code without data-dependent control flow runs all lanes in lockstep.
+"""
+import time
+
+import numpy as np
+import numpy.typing as npt
+
+from pyriscv import elf, mem
+from pyriscv.rv32i import Csrs, DecodedInstr, Opcodes, RV32I
+
+
+MASK = 0xFFFFFFFF
+SIGN = np.uint32(0x80000000)
+
+LOAD_SIZES = {0x0: 1, 0x1: 2, 0x2: 4, 0x4: 1, 0x5: 2}
+STORE_SIZES = {0x0: 1, 0x1: 2, 0x2: 4}
+SIZE_DTYPES = {1: np.dtype("u1"), 2: np.dtype("<u2"), 4: np.dtype("<u4")}
+
+Lanes = npt.NDArray[np.intp]  # Indices of the lanes executing an instruction
+UInt32s = npt.NDArray[np.uint32]
+
+
+def alu(funct3: int, alt: bool, a: UInt32s, b: UInt32s | np.uint32) -> UInt32s:
+    """Apply OP/OP_IMM operation funct3 lane-wise, alt selects SUB/SRA"""
+    match funct3:
+        case 0x0:  # ADD/SUB
+            return a - b if alt else a + b
+        case 0x1:  # SLL
+            return a << (b & np.uint32(0x1F))
+        case 0x2:  # SLT
+            return ((a ^ SIGN) < (b ^ SIGN)).astype(np.uint32)
+        case 0x3:  # SLTU
+            return (a < b).astype(np.uint32)
+        case 0x4:  # XOR
+            return a ^ b
+        case 0x5:  # SRL/SRA
+            shift_num = b & np.uint32(0x1F)
+            if alt:
+                return (a.view(np.int32) >> shift_num.astype(np.int32)).view(np.uint32)
+            return a >> shift_num
+        case 0x6:  # OR
+            return a | b
+        case _:  # AND
+            return a & b
+
+
+class LaneGroup:
+    """N harts running the same program from a shared ROM, each with its own RAM"""
+
+    num_lanes: int
+    memory: mem.RVMemory  # Holds the shared ROM and the initial RAM contents
+    regs: UInt32s  # (N, 32) register values
+    pc: UInt32s  # (N,) program counters
+    ram: npt.NDArray[np.uint8]  # (N, RAM size) per-lane RAM
+    running: npt.NDArray[np.bool_]  # Cleared when a lane reaches ECALL/EBREAK
+    instret: npt.NDArray[np.uint64]  # Instructions executed by each lane
+    decoded: dict[int, DecodedInstr]
+    start_time: int  # Host time in ns that the time CSR counts from
+
+    def __init__(self, num_lanes: int, memory: mem.RVMemory | None = None) -> None:
+        if memory is not None and not isinstance(memory, mem.RVMemory):
+            raise TypeError(f"Lanes need the flat ROM and RAM of an RVMemory, not {type(memory).__name__}")
+        self.num_lanes = num_lanes
+        self.memory = memory if memory is not None else mem.RVMemory()
+        self.regs = np.zeros((num_lanes, 32), dtype=np.uint32)
+        self.pc = np.zeros(num_lanes, dtype=np.uint32)
+        self.ram = np.tile(self.memory.ram.bytes, (num_lanes, 1))
+        self.running = np.ones(num_lanes, dtype=np.bool_)
+        self.instret = np.zeros(num_lanes, dtype=np.uint64)
+        self.decoded = {}
+        self.start_time = time.perf_counter_ns()
+
+    def set_pc(self, val: int) -> None:
+        self.pc[:] = val & MASK
+
+    def load_program(self, prog_bytes: bytes, offset: int = 0) -> None:
+        self.set_pc(self.memory.load_program(prog_bytes, offset))
+        self.decoded.clear()
+
+    def load_bin(self, bin_filepath: str, offset: int = 0) -> None:
+        """Load binary file into program memory at offset and initialise PC"""
+        with open(bin_filepath, "rb") as f:
+            self.load_program(f.read(), offset)
+
+    def load_elf(self, elf_filepath: str) -> elf.ElfFile:
+        """Load ELF segments into every lane and initialise PC from the entry point"""
+        rv = RV32I(self.memory)
+        elf_file = rv.load_elf(elf_filepath)
+        self.ram[:] = self.memory.ram.bytes
+        self.set_pc(rv.pc_addr)
+        self.decoded.clear()
+        return elf_file
+
+    def decode_at(self, addr: int) -> DecodedInstr:
+        decoded_instr = self.decoded.get(addr)
+        if decoded_instr is None:
+            if not self.memory.rom.addr_in_region(addr):
+                raise RuntimeError(f"Lanes can only execute from ROM, PC: 0x{addr:08x}")
+            decoded_instr = self.decoded[addr] = RV32I.decode(self.memory.rom.read(addr, mem.DataSize.WORD))
+        return decoded_instr
+
+    def read(self, lanes: Lanes, addrs: UInt32s, size: int) -> UInt32s:
+        """Read size bytes at a separate address for each lane"""
+        offsets = addrs.astype(np.int64)[:, None] + np.arange(size)
+        ram, rom = self.memory.ram, self.memory.rom
+        in_ram = (offsets[:, 0] >= ram.start_offset) & (offsets[:, -1] < ram.start_offset + ram.size)
+        if in_ram.all():
+            data = self.ram[lanes[:, None], offsets - ram.start_offset]
+        else:
+            in_rom = (offsets[:, 0] >= rom.start_offset) & (offsets[:, -1] < rom.start_offset + rom.size)
+            if not (in_ram | in_rom).all():
+                bad_addr = int(addrs[~(in_ram | in_rom)][0])
+                raise RuntimeError(f"Out of bounds read to addr: {bad_addr}")
+            data = np.empty(offsets.shape, dtype=np.uint8)
+            data[in_ram] = self.ram[lanes[in_ram, None], offsets[in_ram] - ram.start_offset]
+            data[in_rom] = rom.bytes[offsets[in_rom] - rom.start_offset]
+        return data.view(SIZE_DTYPES[size])[:, 0].astype(np.uint32)
+
+    def write(self, lanes: Lanes, addrs: UInt32s, size: int, values: UInt32s) -> None:
+        """Write the lower size bytes of each value at a separate address for each lane"""
+        offsets = addrs.astype(np.int64)[:, None] + np.arange(size)
+        ram = self.memory.ram
+        in_ram = (offsets[:, 0] >= ram.start_offset) & (offsets[:, -1] < ram.start_offset + ram.size)
+        if not in_ram.all():
+            raise RuntimeError(f"Out of bounds write to addr: {int(addrs[~in_ram][0])}")
+        data = values.astype("<u4").view(np.uint8).reshape(-1, 4)[:, :size]
+        self.ram[lanes[:, None], offsets - ram.start_offset] = data
+
+    def set_reg(self, lanes: Lanes, index: int, values: UInt32s | int) -> None:
+        if index != 0:
+            self.regs[lanes, index] = values
+
+    def read_csr(self, lanes: Lanes, csr: int) -> UInt32s:
+        """Read csr for each lane, with instret not yet counting the reading instruction"""
+        match csr:
+            case Csrs.CYCLE | Csrs.INSTRET:
+                values = self.instret[lanes] - np.uint64(1)
+            case Csrs.CYCLEH | Csrs.INSTRETH:
+                values = (self.instret[lanes] - np.uint64(1)) >> np.uint64(32)
+            case Csrs.TIME | Csrs.TIMEH:
+                time_us = (time.perf_counter_ns() - self.start_time) // 1000
+                values = np.full(len(lanes), time_us if csr == Csrs.TIME else time_us >> 32, dtype=np.uint64)
+            case _:
+                values = np.zeros(len(lanes), dtype=np.uint64)
+        return (values & np.uint64(MASK)).astype(np.uint32)
+
+    def step(self, max_instructions: int | None = None) -> bool:
+        """Execute one instruction for the lowest-PC group of lanes, False once all have stopped"""
+        active = self.running
+        if max_instructions is not None:
+            active = active & (self.instret < max_instructions)
+        active_lanes = np.flatnonzero(active)
+        if not active_lanes.size:
+            return False
+
+        pcs = self.pc[active_lanes]
+        pc = int(pcs.min())
+        lanes = active_lanes[pcs == pc]
+        self.execute(self.decode_at(pc), lanes, pc)
+        return True
+
+    def execute(self, instr: DecodedInstr, lanes: Lanes, pc: int) -> None:
+        next_pc = (pc + 4) & MASK
+        self.instret[lanes] += 1
+
+        match instr.opcode:
+            case Opcodes.OP:
+                if instr.funct7 == 0x00 or (instr.funct7 == 0x20 and instr.funct3 in (0x0, 0x5)):
+                    a, b = self.regs[lanes, instr.rs1], self.regs[lanes, instr.rs2]
+                    self.set_reg(lanes, instr.rd, alu(instr.funct3, instr.funct7 == 0x20, a, b))
+            case Opcodes.OP_IMM:
+                shift_type = (instr.imm >> 5) & 0x7F
+                if instr.funct3 not in (0x1, 0x5) or shift_type == 0x00 or (instr.funct3, shift_type) == (0x5, 0x20):
+                    a = self.regs[lanes, instr.rs1]
+                    result = alu(instr.funct3, shift_type == 0x20, a, np.uint32(instr.imm & MASK))
+                    self.set_reg(lanes, instr.rd, result)
+            case Opcodes.LOAD if instr.funct3 in LOAD_SIZES:
+                addrs = self.regs[lanes, instr.rs1] + np.uint32(instr.imm & MASK)
+                val = self.read(lanes, addrs, LOAD_SIZES[instr.funct3])
+                if instr.funct3 == 0x0:  # LB
+                    val = (val ^ np.uint32(0x80)) - np.uint32(0x80)
+                elif instr.funct3 == 0x1:  # LH
+                    val = (val ^ np.uint32(0x8000)) - np.uint32(0x8000)
+                self.set_reg(lanes, instr.rd, val)
+            case Opcodes.STORE if instr.funct3 in STORE_SIZES:
+                addrs = self.regs[lanes, instr.rs1] + np.uint32(instr.imm & MASK)
+                self.write(lanes, addrs, STORE_SIZES[instr.funct3], self.regs[lanes, instr.rs2])
+            case Opcodes.BRANCH:
+                a, b = self.regs[lanes, instr.rs1], self.regs[lanes, instr.rs2]
+                match instr.funct3:
+                    case 0x0:  # BEQ
+                        branch = a == b
+                    case 0x1:  # BNE
+                        branch = a != b
+                    case 0x4:  # BLT
+                        branch = (a ^ SIGN) < (b ^ SIGN)
+                    case 0x5:  # BGE
+                        branch = (a ^ SIGN) >= (b ^ SIGN)
+                    case 0x6:  # BLTU
+                        branch = a < b
+                    case _:  # BGEU
+                        branch = a >= b
+                target = (pc + instr.imm) & MASK
+                self.pc[lanes] = np.where(branch, np.uint32(target), np.uint32(next_pc))
+                return
+            case Opcodes.JAL:
+                self.set_reg(lanes, instr.rd, next_pc)
+                self.pc[lanes] = (pc + instr.imm) & MASK
+                return
+            case Opcodes.JALR if instr.funct3 == 0x0:
+                # RISC-V spec defines that LSB should be set to 0
+                targets = (self.regs[lanes, instr.rs1] + np.uint32(instr.imm & MASK)) & np.uint32(0xFFFFFFFE)
+                self.set_reg(lanes, instr.rd, next_pc)
+                self.pc[lanes] = targets
+                return
+            case Opcodes.LUI:
+                self.set_reg(lanes, instr.rd, (instr.imm << 12) & MASK)
+            case Opcodes.AUIPC:
+                self.set_reg(lanes, instr.rd, (pc + (instr.imm << 12)) & MASK)
+            case Opcodes.SYSTEM if instr.funct3 == 0x0 and instr.imm in (0, 1):  # ECALL/EBREAK
+                self.running[lanes] = False
+                return
+            case Opcodes.SYSTEM if instr.funct3 not in (0x0, 0x4):  # CSR instructions, writes are ignored
+                self.set_reg(lanes, instr.rd, self.read_csr(lanes, instr.imm & 0xFFF))
+
+        self.pc[lanes] = next_pc
+
+    def run_program(self, max_instructions: int | None = None) -> int:
+        """
+        Run all lanes until each reaches ECALL/EBREAK or has executed max_instructions.
+        Returns the number of steps, so lanes/steps shows how well lanes stayed together
+        """
+        steps = 0
+        while self.step(max_instructions):
+            steps += 1
+        return steps
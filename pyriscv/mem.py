@@ -1,10 +1,13 @@
-from enum import IntEnum
-import itertools
+import functools
+from enum import IntEnum, IntFlag
+import struct
+import typing as t
 
-import numpy as np
-import numpy.typing as npt
+if t.TYPE_CHECKING:
+    import numpy as np
+    import numpy.typing as npt
 
-import pyriscv.utils as u
+    from pyriscv.devices import Device
 
 
 class DataSize(IntEnum):
@@ -13,116 +16,435 @@ class DataSize(IntEnum):
     WORD = 4
 
 
+# Little-endian accessors indexed by DataSize
+UNPACKERS = [None, struct.Struct("<B").unpack_from, struct.Struct("<H").unpack_from, None,
+             struct.Struct("<I").unpack_from]
+PACKERS = [None, struct.Struct("<B").pack_into, struct.Struct("<H").pack_into, None,
+           struct.Struct("<I").pack_into]
+SIZE_MASKS = [0, 0xFF, 0xFFFF, 0, 0xFFFFFFFF]
+
+
 class MemoryRegion:
-    bytes: npt.NDArray[np.uint8]
+    buf: bytearray
     start_offset: int
 
     def __init__(self, size: int, offset: int) -> None:
-        self.bytes = np.zeros(size, dtype=np.uint8)
+        self.buf = bytearray(size)
         self.start_offset = offset
 
+    @functools.cached_property
+    def bytes(self) -> "npt.NDArray[np.uint8]":
+        """NumPy view sharing memory with buf, NumPy is only imported on first use"""
+        import numpy as np
+        return np.frombuffer(self.buf, dtype=np.uint8)
+
     @property
     def size(self):
-        return self.bytes.size
+        return len(self.buf)
 
-    def addr_in_region(self, addr: np.uint32) -> bool:
-        return self.start_offset <= addr and addr <= self.start_offset + self.bytes.size
+    def addr_in_region(self, addr: int) -> bool:
+        return self.start_offset <= addr < self.start_offset + len(self.buf)
 
     def _local_addr(self, addr: int) -> int:
         return addr - self.start_offset
 
-    def read(self, addr: int, size: DataSize) -> np.uint32:
-        local_addr = self._local_addr(addr)
-        match size:
-            case DataSize.BYTE:
-                bits = u.int_to_bits(self.bytes[local_addr], 8)
-            case DataSize.HALF:
-                bits = u.int_to_bits(self.bytes[local_addr + 1], 8) + u.int_to_bits(
-                    self.bytes[local_addr], 8
-                )
-            case DataSize.WORD:
-                bits = (
-                    u.int_to_bits(self.bytes[local_addr + 3], 8)
-                    + u.int_to_bits(self.bytes[local_addr + 2], 8)
-                    + u.int_to_bits(self.bytes[local_addr + 1], 8)
-                    + u.int_to_bits(self.bytes[local_addr], 8)
-                )
-        return u.to_uint32(u.bits_to_uint(bits))
-
-    def write(self, addr: int, size: DataSize, value: np.uint32):
-        local_addr = self._local_addr(addr)
-        reg_bits = u.int_to_bits(value, 32)
-        match size:
-            case DataSize.BYTE:
-                self.bytes[local_addr] = u.bits_to_uint(
-                    u.bitfield_slice(reg_bits, 7, 0)
-                )
-            case DataSize.HALF:
-                self.bytes[local_addr] = u.bits_to_uint(
-                    u.bitfield_slice(reg_bits, 7, 0)
-                )
-                self.bytes[local_addr + 1] = u.bits_to_uint(
-                    u.bitfield_slice(reg_bits, 15, 8)
-                )
-            case DataSize.WORD:
-                self.bytes[local_addr] = u.bits_to_uint(
-                    u.bitfield_slice(reg_bits, 7, 0)
-                )
-                self.bytes[local_addr + 1] = u.bits_to_uint(
-                    u.bitfield_slice(reg_bits, 15, 8)
-                )
-                self.bytes[local_addr + 2] = u.bits_to_uint(
-                    u.bitfield_slice(reg_bits, 23, 16)
-                )
-                self.bytes[local_addr + 3] = u.bits_to_uint(
-                    u.bitfield_slice(reg_bits, 31, 24)
-                )
-
-
-class RVMemory:
+    def load(self, data: bytes, offset: int = 0) -> None:
+        """Copy data into the region starting at local offset"""
+        assert offset >= 0 and offset + len(data) <= len(self.buf), "Data does not fit in region"
+        self.buf[offset: offset + len(data)] = data
+
+    def read(self, addr: int, size: DataSize) -> int:
+        return UNPACKERS[size](self.buf, addr - self.start_offset)[0]
+
+    def write(self, addr: int, size: DataSize, value: int):
+        PACKERS[size](self.buf, addr - self.start_offset, value & SIZE_MASKS[size])
+
+
+class Memory:
+    """Common interface to the memory seen by RV32I, with the decoded instruction cache"""
+
+    instr_cache: dict[int, t.Any]
+    code_generation: int
+    devices: list[tuple[int, int, "Device"]]
+
+    def __init__(self) -> None:
+        self.instr_cache = {}  # Decoded instructions keyed by address, filled by RV32I
+        self.code_generation = 0  # Incremented whenever cached code is modified
+        self.devices = []
+
+    def add_device(self, base: int, device: "Device") -> None:
+        """Map device at base, only reached by accesses outside of RAM/ROM"""
+        self.devices.append((base, base + device.size, device))
+
+    def device_read(self, addr: int, size: DataSize) -> int:
+        for base, end, device in self.devices:
+            if base <= addr < end:
+                return device.read(addr - base, size)
+        raise RuntimeError(f"Out of bounds read to addr: {addr}")
+
+    def device_write(self, addr: int, size: DataSize, value: int) -> None:
+        for base, end, device in self.devices:
+            if base <= addr < end:
+                return device.write(addr - base, size, value & SIZE_MASKS[size])
+        raise RuntimeError(f"Out of bounds write to addr: {addr}")
+
+    def code_modified(self) -> None:
+        self.instr_cache.clear()
+        self.code_generation += 1
+
+    def invalidate(self, addr: int, size: int) -> None:
+        """Drop cached decodes of any instruction word overlapping the write"""
+        start, end = int(addr) & ~0x3, int(addr) + size
+        if (end - start) // 4 > len(self.instr_cache):
+            # Large writes, such as bulk copies, check the cache rather than every word
+            word_addrs = [word_addr for word_addr in self.instr_cache if start <= word_addr < end]
+        else:
+            word_addrs = range(start, end, 4)
+        for word_addr in word_addrs:
+            if self.instr_cache.pop(word_addr, None) is not None:
+                self.code_generation += 1
+
+    def load_program(self, prog_bytes: bytes, offset: int = 0) -> int:
+        raise NotImplementedError
+
+    def load_data(self, addr: int, data: bytes) -> None:
+        raise NotImplementedError
+
+    def read(self, addr: int, size: DataSize) -> int:
+        raise NotImplementedError
+
+    def write(self, addr: int, size: DataSize, value: int) -> None:
+        raise NotImplementedError
+
+    def fetch(self, addr: int) -> int:
+        return self.read(addr, DataSize.WORD)
+
+    def copy(self, dst: int, src: int, size: int) -> bool:
+        """
+        Copy size bytes from src to dst at once, as a loop of loads and stores would.
+        Returns False, having done nothing, if the ranges overlap or are not plain memory
+        """
+        return False
+
+    def fill(self, dst: int, word: int, size: int) -> bool:
+        """Store word size // 4 times from dst at once, False if the range is not plain memory"""
+        return False
+
+    def snapshot(self) -> dict[int, bytes | bytearray]:
+        """Contents of memory keyed by start address, which must not be modified by the caller"""
+        raise NotImplementedError
+
+    def restore(self, contents: dict[int, bytes | bytearray]) -> None:
+        """Return memory to contents, keeping cached code outside of the parts that change"""
+        raise NotImplementedError
+
+
+class RVMemory(Memory):
     rom: MemoryRegion
     ram: MemoryRegion
 
     def __init__(self) -> None:
+        super().__init__()
         self.rom = MemoryRegion(0x8000, 0x80000000)  # 32KB
         self.ram = MemoryRegion(0x1000, 0x90000000)  # 4KB
 
-    def load_program(self, prog_bytes: bytes) -> int:
-        """Load program and return program start address"""
+    def load_program(self, prog_bytes: bytes, offset: int = 0) -> int:
+        """Load program at offset into ROM and return program start address"""
         assert (
-            len(prog_bytes) <= self.rom.size
-        ), f"Program is too large to fit into memory, requires {len(prog_bytes)} bytes but only {self.rom.size} bytes available"
+            offset + len(prog_bytes) <= self.rom.size
+        ), f"Program is too large to fit into memory, requires {offset + len(prog_bytes)} bytes but only {self.rom.size} bytes available"
 
-        start_addr = self.rom.start_offset
-        for addr, byte in zip(itertools.count(start_addr), prog_bytes):
-            self.rom.write(addr, DataSize.BYTE, byte)
+        self.rom.load(prog_bytes, offset)
+        self.code_modified()
 
-        return start_addr
+        return self.rom.start_offset + offset
+
+    def region_for(self, addr: int) -> MemoryRegion:
+        for region in (self.rom, self.ram):
+            if region.addr_in_region(addr):
+                return region
+        raise RuntimeError(f"No memory region at addr: {addr:#x}")
+
+    def load_data(self, addr: int, data: bytes) -> None:
+        """Copy data into whichever region contains addr, bypassing write permissions"""
+        region = self.region_for(addr)
+        region.load(data, addr - region.start_offset)
+        if self.instr_cache:
+            self.invalidate(addr, len(data))
+
+    def in_region(self, region: MemoryRegion, addr: int, size: int) -> bool:
+        return region.start_offset <= addr and addr + size <= region.start_offset + region.size
+
+    def copy(self, dst: int, src: int, size: int) -> bool:
+        ram = self.ram
+        if not self.in_region(ram, dst, size) or (src < dst + size and dst < src + size):
+            return False
+        for region in (self.rom, ram):
+            if self.in_region(region, src, size):
+                src_offset, dst_offset = src - region.start_offset, dst - ram.start_offset
+                ram.buf[dst_offset: dst_offset + size] = region.buf[src_offset: src_offset + size]
+                if self.instr_cache:
+                    self.invalidate(dst, size)
+                return True
+        return False
 
-    def write(self, addr: np.uint32, size: DataSize, value: np.uint32) -> None:
+    def fill(self, dst: int, word: int, size: int) -> bool:
+        if not self.in_region(self.ram, dst, size):
+            return False
+        self.load_data(dst, word.to_bytes(4, "little") * (size // 4))
+        return True
+
+    def write(self, addr: int, size: DataSize, value: int) -> None:
         if self.ram.addr_in_region(addr):
             self.ram.write(addr, size, value)
+            if self.instr_cache:
+                self.invalidate(addr, size)
         else:
-            raise RuntimeError(f"Out of bounds write to addr: {addr}")
+            self.device_write(addr, size, value)
 
-    def read(self, addr: np.uint32, size: DataSize) -> np.uint32:
+    def read(self, addr: int, size: DataSize) -> int:
         if self.rom.addr_in_region(addr):
             return self.rom.read(addr, size)
         elif self.ram.addr_in_region(addr):
             return self.ram.read(addr, size)
         else:
+            return self.device_read(addr, size)
+
+    def snapshot(self) -> dict[int, bytes | bytearray]:
+        return {region.start_offset: bytes(region.buf) for region in (self.rom, self.ram)}
+
+    def restore(self, contents: dict[int, bytes | bytearray]) -> None:
+        for addr, data in contents.items():
+            region = self.region_for(addr)
+            offset = addr - region.start_offset
+            if region.buf[offset: offset + len(data)] != data:
+                region.load(data, offset)
+                if self.instr_cache:
+                    self.invalidate(addr, len(data))
+
+
+class Perm(IntFlag):
+    R = 1
+    W = 2
+    X = 4
+    RW = R | W
+    RX = R | X
+    RWX = R | W | X
+
+
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS  # 4KB
+PAGE_MASK = PAGE_SIZE - 1
+
+
+class PagedMemory(Memory):
+    """
+    Sparse memory made of fixed size pages, allocated on first write.
+    Accesses are only allowed inside mapped regions, with per-region permissions.
+    Snapshots share pages with the memory, which are copied on their next write.
+    """
+
+    program_start: int
+    regions: list[tuple[int, int, Perm]]
+    pages: dict[int, bytearray]  # All allocated pages, keyed by page number
+    readable: dict[int, bytearray]
+    writable: dict[int, bytearray]
+    executable: dict[int, bytearray]
+    shared: set[int]  # Pages also held by a snapshot, left out of writable until copied
+
+    def __init__(self, program_start: int) -> None:
+        super().__init__()
+        self.program_start = program_start
+        self.regions = []
+        self.pages = {}
+        self.readable = {}
+        self.writable = {}
+        self.executable = {}
+        self.shared = set()
+
+    def map_region(self, start: int, size: int, perms: Perm) -> None:
+        assert start % PAGE_SIZE == 0 and size % PAGE_SIZE == 0, "Regions must be page aligned"
+        self.regions.append((start, start + size, perms))
+
+    def region_at(self, addr: int) -> tuple[int, int, Perm] | None:
+        for region in self.regions:
+            if region[0] <= addr < region[1]:
+                return region
+        return None
+
+    def allocate(self, page_num: int) -> bytearray | None:
+        """Allocate a page if it is inside a mapped region"""
+        region = self.region_at(page_num << PAGE_BITS)
+        if region is None:
+            return None
+        return self.install(page_num, bytearray(PAGE_SIZE), region[2])
+
+    def install(self, page_num: int, page: bytearray, perms: Perm) -> bytearray:
+        self.pages[page_num] = page
+        if perms & Perm.R:
+            self.readable[page_num] = page
+        if perms & Perm.W and page_num not in self.shared:
+            self.writable[page_num] = page
+        if perms & Perm.X:
+            self.executable[page_num] = page
+        return page
+
+    def page_for_write(self, page_num: int) -> bytearray | None:
+        """Get page to modify, allocating it or copying it away from a snapshot as needed"""
+        if page_num in self.shared:
+            self.shared.discard(page_num)
+            region = self.region_at(page_num << PAGE_BITS)
+            return self.install(page_num, bytearray(self.pages[page_num]), region[2])
+        return self.pages.get(page_num) or self.allocate(page_num)
+
+    def load_program(self, prog_bytes: bytes, offset: int = 0) -> int:
+        """Load program at offset from program_start and return program start address"""
+        start_addr = self.program_start + offset
+        region = self.region_at(start_addr)
+        available = region[1] - start_addr if region is not None else 0
+        assert (
+            len(prog_bytes) <= available
+        ), f"Program is too large to fit into memory, requires {len(prog_bytes)} bytes but only {available} bytes available"
+
+        self.load_data(start_addr, prog_bytes)
+        return start_addr
+
+    def load_data(self, addr: int, data: bytes) -> None:
+        """Copy data into mapped pages, bypassing write permissions"""
+        pos = 0
+        while pos < len(data):
+            page_num, offset = (addr + pos) >> PAGE_BITS, (addr + pos) & PAGE_MASK
+            page = self.page_for_write(page_num)
+            if page is None:
+                raise RuntimeError(f"Out of bounds load to addr: {addr + pos:#x}")
+            chunk = min(PAGE_SIZE - offset, len(data) - pos)
+            page[offset: offset + chunk] = data[pos: pos + chunk]
+            pos += chunk
+        if self.instr_cache:
+            self.invalidate(addr, len(data))
+
+    def read(self, addr: int, size: DataSize) -> int:
+        page = self.readable.get(addr >> PAGE_BITS)
+        offset = addr & PAGE_MASK
+        if page is not None and offset + size <= PAGE_SIZE:
+            return UNPACKERS[size](page, offset)[0]
+        return self.slow_read(addr, size, Perm.R)
+
+    def fetch(self, addr: int) -> int:
+        page = self.executable.get(addr >> PAGE_BITS)
+        offset = addr & PAGE_MASK
+        if page is not None and offset + DataSize.WORD <= PAGE_SIZE:
+            return UNPACKERS[DataSize.WORD](page, offset)[0]
+        return self.slow_read(addr, DataSize.WORD, Perm.X)
+
+    def slow_read(self, addr: int, size: DataSize, perm: Perm) -> int:
+        """Read from an unallocated page or across a page boundary"""
+        if (addr & PAGE_MASK) + size > PAGE_SIZE:
+            return sum(self.slow_read(addr + i, DataSize.BYTE, perm) << (8 * i) for i in range(size))
+
+        page_num = addr >> PAGE_BITS
+        region = self.region_at(addr)
+        if region is None and perm == Perm.R:
+            return self.device_read(addr, size)
+        if region is None or not region[2] & perm:
             raise RuntimeError(f"Out of bounds read to addr: {addr}")
+        page = self.pages.get(page_num)
+        if page is None:
+            return 0  # Untouched memory reads as zero without being allocated
+        return UNPACKERS[size](page, addr & PAGE_MASK)[0]
+
+    def write(self, addr: int, size: DataSize, value: int) -> None:
+        page = self.writable.get(addr >> PAGE_BITS)
+        offset = addr & PAGE_MASK
+        if page is not None and offset + size <= PAGE_SIZE:
+            PACKERS[size](page, offset, value & SIZE_MASKS[size])
+        else:
+            self.slow_write(addr, size, value)
+        if self.instr_cache:
+            self.invalidate(addr, size)
+
+    def in_regions(self, addr: int, size: int, perm: Perm) -> bool:
+        """Whether all of addr to addr + size is in mapped regions with perm"""
+        end = addr + size
+        while addr < end:
+            region = self.region_at(addr)
+            if region is None or not region[2] & perm:
+                return False
+            addr = region[1]
+        return True
 
+    def copy(self, dst: int, src: int, size: int) -> bool:
+        if (src < dst + size and dst < src + size) or not (self.in_regions(src, size, Perm.R)
+                                                           and self.in_regions(dst, size, Perm.W)):
+            return False
+        data = bytearray(size)
+        pos = 0
+        while pos < size:
+            page_num, offset = (src + pos) >> PAGE_BITS, (src + pos) & PAGE_MASK
+            chunk = min(PAGE_SIZE - offset, size - pos)
+            page = self.pages.get(page_num)
+            if page is not None:  # Unallocated pages read as zero
+                data[pos: pos + chunk] = page[offset: offset + chunk]
+            pos += chunk
+        self.load_data(dst, data)
+        return True
 
-class RiscofMemory(RVMemory):
+    def fill(self, dst: int, word: int, size: int) -> bool:
+        if not self.in_regions(dst, size, Perm.W):
+            return False
+        self.load_data(dst, word.to_bytes(4, "little") * (size // 4))
+        return True
+
+    def slow_write(self, addr: int, size: DataSize, value: int) -> None:
+        """Write to an unallocated page or across a page boundary"""
+        if (addr & PAGE_MASK) + size > PAGE_SIZE:
+            for i in range(size):
+                self.slow_write(addr + i, DataSize.BYTE, value >> (8 * i))
+            return
+
+        page_num = addr >> PAGE_BITS
+        region = self.region_at(addr)
+        if region is None:
+            return self.device_write(addr, size, value)
+        if not region[2] & Perm.W:
+            raise RuntimeError(f"Out of bounds write to addr: {addr}")
+        page = self.page_for_write(page_num)
+        PACKERS[size](page, addr & PAGE_MASK, value & SIZE_MASKS[size])
+
+    def snapshot(self) -> dict[int, bytes | bytearray]:
+        """Share all pages with the snapshot, so nothing is copied until it is written"""
+        for page_num in self.pages:
+            self.writable.pop(page_num, None)
+        self.shared.update(self.pages)
+        return {page_num << PAGE_BITS: page for page_num, page in self.pages.items()}
+
+    def restore(self, contents: dict[int, bytes | bytearray]) -> None:
+        # Pages still shared with contents are unchanged, so code cached in them stays valid
+        changed = [page_num for page_num, page in self.pages.items()
+                   if contents.get(page_num << PAGE_BITS) is not page]
+        changed += [addr >> PAGE_BITS for addr in contents if addr >> PAGE_BITS not in self.pages]
+        for pages in (self.pages, self.readable, self.writable, self.executable):
+            pages.clear()
+        self.shared = {addr >> PAGE_BITS for addr in contents}
+        for addr, page in contents.items():
+            assert addr & PAGE_MASK == 0 and len(page) == PAGE_SIZE, "Contents must be whole pages"
+            region = self.region_at(addr)
+            if region is None:
+                raise RuntimeError(f"Out of bounds load to addr: {addr:#x}")
+            # Pages stay shared with contents and are copied on their next write
+            self.install(addr >> PAGE_BITS, page, region[2])
+        if self.instr_cache:
+            for page_num in changed:
+                self.invalidate(page_num << PAGE_BITS, PAGE_SIZE)
+
+
+class RiscofMemory(PagedMemory):
     """
     Memory for RISCOF tests.
-    All program memory goes into RAM.
+    All program memory goes into a single RWX region, allocated as it is touched.
     """
 
-    ram: MemoryRegion
-
     def __init__(self) -> None:
+        super().__init__(program_start=0x80000000)
         # Riscof requires 1.7MB for jal-01.S
-        self.ram = MemoryRegion(0x200000, 0x80000000)  # 2MB
-        self.rom = self.ram  # To load program into RAM instead
+        self.map_region(0x80000000, 0x200000, Perm.RWX)  # 2MB
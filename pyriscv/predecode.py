@@ -0,0 +1,103 @@
+"""
+Bulk pre-decoding of a whole program image.
+
+decode_image splits every word of an image into its fields at once with NumPy,
+giving parallel arrays of opcode, rd, rs1, rs2, funct3, funct7 and imm indexed
+by word. fill_cache then fills the decoded instruction cache of a Memory, with
+each distinct word decoded once and shared by every address holding it, so a
+large image costs one dict entry per word rather than one object per word.
+
+Words that are not valid RV32I instructions, such as data, are marked invalid
+and left out of the cache.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+from pyriscv import mem
+from pyriscv.rv32i import DecodedInstr, Opcodes, decode_word
+
+
+I_TYPES = (Opcodes.OP_IMM, Opcodes.LOAD, Opcodes.JALR, Opcodes.MISC_MEM, Opcodes.SYSTEM)
+U_TYPES = (Opcodes.LUI, Opcodes.AUIPC)
+
+
+def sign_extend(values: npt.NDArray[np.int64], bits: int) -> npt.NDArray[np.int64]:
+    sign = 1 << (bits - 1)
+    return (values ^ sign) - sign
+
+
+@dataclass
+class DecodedImage:
+    base: int  # Address of the first word
+    words: npt.NDArray[np.uint32]
+    opcode: npt.NDArray[np.uint8]
+    rd: npt.NDArray[np.uint8]
+    rs1: npt.NDArray[np.uint8]
+    rs2: npt.NDArray[np.uint8]
+    funct3: npt.NDArray[np.uint8]
+    funct7: npt.NDArray[np.uint8]
+    imm: npt.NDArray[np.int32]  # 0 for instructions without an immediate
+    valid: npt.NDArray[np.bool_]  # Whether the opcode is an RV32I opcode
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def addr(self, index: int) -> int:
+        return self.base + 4 * index
+
+    def instr(self, index: int) -> DecodedInstr | None:
+        """The shared DecodedInstr for the word at index, None if it is not an instruction"""
+        return decode_word(int(self.words[index])) if self.valid[index] else None
+
+    def fill_cache(self, memory: mem.Memory) -> int:
+        """Add every valid word to the decoded instruction cache of memory and return how many were added"""
+        indices = np.flatnonzero(self.valid)
+        unique_words, inverse = np.unique(self.words[indices], return_inverse=True)
+        decoded = [decode_word(word) for word in unique_words.tolist()]
+        addrs = (self.base + 4 * indices).tolist()
+        memory.instr_cache.update(zip(addrs, [decoded[i] for i in inverse.tolist()]))
+        return len(addrs)
+
+
+def decode_image(data: bytes | bytearray, base: int) -> DecodedImage:
+    """Decode each whole little-endian word of data, the first being at address base"""
+    words = np.frombuffer(data, dtype="<u4", count=len(data) // 4).astype(np.uint32)
+    w = words.astype(np.int64)
+    opcode = w & 0x7F
+    rd = (w >> 7) & 0x1F
+    funct7 = w >> 25
+
+    imm = np.select(
+        [
+            np.isin(opcode, I_TYPES),
+            opcode == Opcodes.STORE,
+            opcode == Opcodes.BRANCH,
+            opcode == Opcodes.JAL,
+            np.isin(opcode, U_TYPES),
+        ],
+        [
+            sign_extend(w >> 20, 12),
+            sign_extend((funct7 << 5) | rd, 12),
+            sign_extend(((w >> 31) << 12) | (((w >> 7) & 0x1) << 11) | (((w >> 25) & 0x3F) << 5)
+                        | (((w >> 8) & 0xF) << 1), 13),
+            sign_extend(((w >> 31) << 20) | (w & 0xFF000) | (((w >> 20) & 0x1) << 11)
+                        | (((w >> 21) & 0x3FF) << 1), 21),
+            sign_extend(w >> 12, 20),
+        ],
+        0,
+    )
+
+    return DecodedImage(
+        base=base,
+        words=words,
+        opcode=opcode.astype(np.uint8),
+        rd=rd.astype(np.uint8),
+        rs1=((w >> 15) & 0x1F).astype(np.uint8),
+        rs2=((w >> 20) & 0x1F).astype(np.uint8),
+        funct3=((w >> 12) & 0x7).astype(np.uint8),
+        funct7=funct7.astype(np.uint8),
+        imm=imm.astype(np.int32),
+        valid=np.isin(opcode, [op.value for op in Opcodes]),
+    )
@@ -0,0 +1,187 @@
+"""
+Guest profiler, counting where a program spends its instructions.
+
+Profiler.run is an interpreter loop that records execution counts per PC and
+per basic block, host time spent in each instruction handler, and a shadow
+call stack maintained from JAL/JALR calls and returns. Results can be
+aggregated by ELF function symbols into a flat profile, or written as
+collapsed stacks for flamegraph tools.
+"""
+import bisect
+from collections import Counter
+import itertools
+import time
+import typing as t
+
+from pyriscv import devices, elf
+from pyriscv.rv32i import DecodedInstr, EBreak, ECall, Opcodes, Regs, RV32I
+
+
+PF_X = 0x1  # Executable segment flag
+
+LINK_REGS = (Regs.X1, Regs.X5)  # ra and the alternate link register t0
+BLOCK_ENDS = (Opcodes.BRANCH, Opcodes.JAL, Opcodes.JALR, Opcodes.SYSTEM)
+
+HANDLER_GROUPS = {
+    Opcodes.LOAD: "memory",
+    Opcodes.STORE: "memory",
+    Opcodes.OP: "alu",
+    Opcodes.OP_IMM: "alu",
+    Opcodes.LUI: "alu",
+    Opcodes.AUIPC: "alu",
+    Opcodes.BRANCH: "control",
+    Opcodes.JAL: "control",
+    Opcodes.JALR: "control",
+}
+
+
+class Profiler:
+    pc_counts: Counter[int]
+    block_counts: Counter[int]  # Keyed by the address each dynamic basic block starts at
+    handler_ns: Counter[Opcodes]  # Host time spent executing each opcode
+    stack_counts: Counter[tuple[int, ...]]  # Instructions executed under each call stack
+    call_stack: list[tuple[int, int]]  # (function address, return address) for each active call
+    function_addrs: list[int]  # Sorted start addresses of known functions
+    function_names: list[str]
+
+    def __init__(self, elf_file: elf.ElfFile | None = None) -> None:
+        self.pc_counts = Counter()
+        self.block_counts = Counter()
+        self.handler_ns = Counter()
+        self.stack_counts = Counter()
+        self.call_stack = []
+
+        functions = sorted(self.code_symbols(elf_file)) if elf_file is not None else []
+        self.function_addrs = [addr for addr, _ in functions]
+        self.function_names = [name for _, name in functions]
+
+    @staticmethod
+    def code_symbols(elf_file: elf.ElfFile) -> t.Iterator[tuple[int, str]]:
+        """
+        Function symbols, or if there are none, as for hand-written assembly,
+        labels inside executable segments other than assembler-local labels.
+        """
+        symbols = [symbol for symbol in elf_file.symbols.values() if symbol.type == elf.STT_FUNC]
+        if not symbols:
+            code = [(seg.vaddr, seg.vaddr + seg.mem_size) for seg in elf_file.segments if seg.flags & PF_X]
+            symbols = [
+                symbol for symbol in elf_file.symbols.values()
+                if not symbol.name.startswith(".L") and any(start <= symbol.value < end for start, end in code)
+            ]
+        seen = set()
+        for symbol in symbols:
+            if symbol.value not in seen:
+                seen.add(symbol.value)
+                yield symbol.value, symbol.name
+
+    def function_at(self, addr: int) -> int:
+        """Start address of the function containing addr, or addr if no symbol precedes it"""
+        index = bisect.bisect_right(self.function_addrs, addr) - 1
+        return self.function_addrs[index] if index >= 0 else addr
+
+    def name(self, addr: int) -> str:
+        index = bisect.bisect_right(self.function_addrs, addr) - 1
+        if index < 0:
+            return f"0x{addr:08x}"
+        offset = addr - self.function_addrs[index]
+        return self.function_names[index] + (f"+0x{offset:x}" if offset else "")
+
+    def run(self, rv: RV32I, max_instructions: int | None = None) -> None:
+        """Run program like RV32I.run_program, recording the profile"""
+        pc_counts, block_counts, handler_ns, stack_counts = (
+            self.pc_counts, self.block_counts, self.handler_ns, self.stack_counts
+        )
+        perf_counter_ns = time.perf_counter_ns
+        if not self.call_stack:
+            self.call_stack.append((self.function_at(rv.pc_addr), 0))
+        stack = tuple(addr for addr, _ in self.call_stack)
+        new_block = True
+
+        end = rv.instret + (max_instructions or 0)
+        for rv.instret in itertools.count(rv.instret):
+            if max_instructions is not None:
+                if not rv.instret < end:
+                    break
+
+            pc = rv.pc_addr
+            decoded_instr = rv.fetch_decoded()
+            pc_counts[pc] += 1
+            if new_block:
+                block_counts[pc] += 1
+            stack_counts[stack] += 1
+
+            start = perf_counter_ns()
+            try:
+                rv.execute(decoded_instr)
+            except (ECall, EBreak):
+                break
+            except devices.Halt as halt:
+                rv.exit_code = halt.exit_code
+                break
+            finally:
+                handler_ns[decoded_instr.opcode] += perf_counter_ns() - start
+
+            opcode = decoded_instr.opcode
+            new_block = opcode in BLOCK_ENDS
+            if opcode == Opcodes.JAL or opcode == Opcodes.JALR:
+                if self.track_call(decoded_instr, pc, rv.pc_addr):
+                    stack = tuple(addr for addr, _ in self.call_stack)
+
+    def track_call(self, instr: DecodedInstr, pc: int, target: int) -> bool:
+        """Update the shadow call stack for a jump, returning True if it changed"""
+        if instr.rd in LINK_REGS:
+            self.call_stack.append((target, (pc + 4) & 0xFFFFFFFF))
+            return True
+        if instr.opcode == Opcodes.JALR and instr.rd == Regs.X0:
+            # Any indirect jump to a saved return address is a return, whichever register holds it.
+            # Returning to an older caller also drops frames left by tail calls or longjmp
+            for depth in range(len(self.call_stack) - 1, 0, -1):
+                if self.call_stack[depth][1] == target:
+                    del self.call_stack[depth:]
+                    return True
+        return False
+
+    def function_counts(self) -> tuple[Counter[int], Counter[int]]:
+        """Self and inclusive instruction counts keyed by function address"""
+        self_counts = Counter()
+        for pc, count in self.pc_counts.items():
+            self_counts[self.function_at(pc)] += count
+        inclusive_counts = Counter()
+        for stack, count in self.stack_counts.items():
+            for addr in set(stack):
+                inclusive_counts[addr] += count
+        return self_counts, inclusive_counts
+
+    def flat_profile(self, limit: int = 20) -> str:
+        total = sum(self.pc_counts.values()) or 1
+        self_counts, inclusive_counts = self.function_counts()
+        lines = [f"{'self':>12} {'%':>6} {'inclusive':>12} {'%':>6}  function"]
+        for addr, count in self_counts.most_common(limit):
+            # Code that is only jumped to, never called, has no frame of its own
+            inclusive = max(inclusive_counts[addr], count)
+            lines.append(f"{count:>12} {100 * count / total:6.2f} {inclusive:>12} "
+                         f"{100 * inclusive / total:6.2f}  {self.name(addr)}")
+
+        lines += ["", f"{'count':>12}  hottest PCs"]
+        for pc, count in self.pc_counts.most_common(limit):
+            lines.append(f"{count:>12}  0x{pc:08x} {self.name(pc)}")
+
+        lines += ["", f"{'count':>12}  hottest basic blocks"]
+        for pc, count in self.block_counts.most_common(limit):
+            lines.append(f"{count:>12}  0x{pc:08x} {self.name(pc)}")
+
+        group_ns = Counter()
+        for opcode, ns in self.handler_ns.items():
+            group_ns[HANDLER_GROUPS.get(opcode, "system")] += ns
+        total_ns = sum(group_ns.values()) or 1
+        lines += ["", f"{'ms':>12}  handler time"]
+        for group, ns in group_ns.most_common():
+            lines.append(f"{ns / 1e6:>12.3f}  {group} ({100 * ns / total_ns:.1f}%)")
+        return "\n".join(lines)
+
+    def collapsed_stacks(self) -> str:
+        """One line per call stack, as "outer;inner count", for flamegraph.pl or speedscope"""
+        lines = []
+        for stack, count in sorted(self.stack_counts.items()):
+            lines.append(";".join(self.name(addr) for addr in stack) + f" {count}")
+        return "\n".join(lines) + "\n"
@@ -1,13 +1,23 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import IntEnum
+import functools
 import itertools
-
-import numpy as np
-import numpy.typing as npt
-
-from pyriscv import mem
+import operator
+import sys
+import time
+import typing as t
+
+from pyriscv import devices, elf, mem
+from pyriscv.snapshot import Snapshot
+from pyriscv.stats import Stats
 import pyriscv.utils as u
 
+if t.TYPE_CHECKING:
+    from pyriscv.fusion import Fuser
+    from pyriscv.profiler import Profiler
+    from pyriscv.trace import TraceWriter
+    from pyriscv.translate import BlockTranslator
+
 
 class ECall(Exception):
     pass
@@ -66,261 +76,333 @@ class Opcodes(IntEnum):
     SYSTEM = 0b1110011
 
 
-@dataclass
+class Csrs(IntEnum):
+    CYCLE = 0xC00
+    TIME = 0xC01
+    INSTRET = 0xC02
+    CYCLEH = 0xC80
+    TIMEH = 0xC81
+    INSTRETH = 0xC82
+
+
+AluFunc = t.Callable[[int, int], int]
+
+
+def alu_table(ops: dict[tuple[int, int | None], AluFunc]) -> list[AluFunc | None]:
+    """
+    Handler table indexed by funct7 << 3 | funct3, None for unknown combinations.
+    A funct7 of None fills the entry for every funct7, where those bits are part of an immediate
+    """
+    table: list[AluFunc | None] = [None] * (1 << 10)
+    for (funct3, funct7), func in ops.items():
+        for index in range(funct3, 1 << 10, 8) if funct7 is None else [(funct7 << 3) | funct3]:
+            table[index] = func
+    return table
+
+
+# Results are masked by set_reg
+OP_FUNCS = alu_table({
+    (0x0, 0x00): operator.add,  # ADD
+    (0x0, 0x20): operator.sub,  # SUB
+    (0x4, 0x00): operator.xor,  # XOR
+    (0x6, 0x00): operator.or_,  # OR
+    (0x7, 0x00): operator.and_,  # AND
+    (0x1, 0x00): lambda a, b: a << (b & 0x1F),  # SLL, only considering lower 5 bits
+    (0x5, 0x00): lambda a, b: a >> (b & 0x1F),  # SRL
+    (0x5, 0x20): lambda a, b: u.to_int32(a) >> (b & 0x1F),  # SRA
+    (0x2, 0x00): lambda a, b: 1 if u.to_int32(a) < u.to_int32(b) else 0,  # SLT
+    (0x3, 0x00): lambda a, b: 1 if a < b else 0,  # SLTU
+})
+
+# Immediates are signed, for shifts funct7 holds the upper bits of the immediate
+IMM_FUNCS = alu_table({
+    (0x0, None): operator.add,  # ADDI
+    (0x4, None): operator.xor,  # XORI
+    (0x6, None): operator.or_,  # ORI
+    (0x7, None): operator.and_,  # ANDI
+    (0x1, 0x00): lambda a, imm: a << (imm & 0x1F),  # SLLI
+    (0x5, 0x00): lambda a, imm: a >> (imm & 0x1F),  # SRLI
+    (0x5, 0x20): lambda a, imm: u.to_int32(a) >> (imm & 0x1F),  # SRAI
+    (0x2, None): lambda a, imm: 1 if u.to_int32(a) < imm else 0,  # SLTI
+    (0x3, None): lambda a, imm: 1 if a < (imm & u.MASK32) else 0,  # SLTIU
+})
+
+# Indexed by funct3
+BRANCH_FUNCS: list[t.Callable[[int, int], bool] | None] = [
+    operator.eq,  # BEQ
+    operator.ne,  # BNE
+    None,
+    None,
+    lambda a, b: u.to_int32(a) < u.to_int32(b),  # BLT
+    lambda a, b: u.to_int32(a) >= u.to_int32(b),  # BGE
+    operator.lt,  # BLTU
+    operator.ge,  # BGEU
+]
+
+# (size, sign bit width) indexed by funct3, a width of 0 zero-extends
+LOAD_FORMATS: list[tuple[mem.DataSize, int] | None] = [
+    (mem.DataSize.BYTE, 8),  # LB
+    (mem.DataSize.HALF, 16),  # LH
+    (mem.DataSize.WORD, 0),  # LW
+    None,
+    (mem.DataSize.BYTE, 0),  # LBU
+    (mem.DataSize.HALF, 0),  # LHU
+    None,
+    None,
+]
+
+STORE_SIZES: list[mem.DataSize | None] = [mem.DataSize.BYTE, mem.DataSize.HALF, mem.DataSize.WORD, None, None,
+                                          None, None, None]
+
+OPCODE_HANDLERS = {
+    Opcodes.OP: "execute_op",
+    Opcodes.OP_IMM: "execute_imm",
+    Opcodes.LOAD: "execute_load",
+    Opcodes.STORE: "execute_store",
+    Opcodes.BRANCH: "execute_branch",
+    Opcodes.JAL: "execute_jal",
+    Opcodes.JALR: "execute_jalr",
+    Opcodes.LUI: "execute_lui",
+    Opcodes.AUIPC: "execute_auipc",
+    Opcodes.MISC_MEM: "execute_mem",
+    Opcodes.SYSTEM: "execute_system",
+}
+
+
+@dataclass(slots=True)
 class DecodedInstr:
-    opcode: Opcodes
-    rd: Regs | None = None
-    rs1: Regs | None = None
-    rs2: Regs | None = None
+    """
+    Decoded fields as plain ints. Decodes are interned by instruction word,
+    so a DecodedInstr may be shared by many addresses and must not be modified
+    """
+
+    opcode: int
+    rd: int | None = None
+    rs1: int | None = None
+    rs2: int | None = None
     funct3: int | None = None
     funct7: int | None = None
     imm: int | None = None
+    # Operation looked up from the tables above, such as the ALU function, None for unknown combinations
+    func: t.Any = field(default=None, compare=False, repr=False)
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def decode_word(instr: int) -> DecodedInstr:
+    """Decode a 32-bit instruction word, use RV32I.decode for any int"""
+    opcode = instr & 0x7F
+    rd = (instr >> 7) & 0x1F
+    funct3 = (instr >> 12) & 0x7
+    rs1 = (instr >> 15) & 0x1F
+    rs2 = (instr >> 20) & 0x1F
+    funct7 = instr >> 25
+    imm = None
+    func = None
+
+    match opcode:
+        case Opcodes.OP:
+            func = OP_FUNCS[(funct7 << 3) | funct3]
+        case Opcodes.OP_IMM:  # I-type
+            imm = u.sign_extend(instr >> 20, 12)
+            func = IMM_FUNCS[(funct7 << 3) | funct3]
+        case Opcodes.LOAD:  # I-type
+            imm = u.sign_extend(instr >> 20, 12)
+            func = LOAD_FORMATS[funct3]
+        case Opcodes.JALR | Opcodes.MISC_MEM | Opcodes.SYSTEM:  # I-type
+            imm = u.sign_extend(instr >> 20, 12)
+        case Opcodes.STORE:  # S-Type
+            imm = u.sign_extend((funct7 << 5) | rd, 12)
+            func = STORE_SIZES[funct3]
+        case Opcodes.BRANCH:  # B-Type
+            imm = u.sign_extend(
+                ((instr >> 31) << 12)
+                | (((instr >> 7) & 0x1) << 11)
+                | (((instr >> 25) & 0x3F) << 5)
+                | (((instr >> 8) & 0xF) << 1),
+                13,
+            )
+            func = BRANCH_FUNCS[funct3]
+        case Opcodes.JAL:  # J-Type
+            imm = u.sign_extend(
+                ((instr >> 31) << 20)
+                | (instr & 0xFF000)
+                | (((instr >> 20) & 0x1) << 11)
+                | (((instr >> 21) & 0x3FF) << 1),
+                21,
+            )
+        case Opcodes.LUI | Opcodes.AUIPC:  # U-type
+            imm = u.sign_extend(instr >> 12, 20)
+        case _:
+            raise RuntimeError(f"Unknown opcode: {opcode:#x}")
 
+    return DecodedInstr(opcode, rd, rs1, rs2, funct3, funct7, imm, func)
 
-class RV32I:
-    memory: mem.RVMemory
-    regs: npt.NDArray[np.int32]
-    pc: np.int32
 
-    def __init__(self, memory: mem.RVMemory | None = None) -> None:
+class RegisterFile:
+    """Signed view of the unsigned register values, so callers see two's complement ints"""
+
+    values: list[int]
+
+    def __init__(self, values: list[int]) -> None:
+        self.values = values
+
+    @t.overload
+    def __getitem__(self, index: Regs | int) -> int: ...
+
+    @t.overload
+    def __getitem__(self, index: slice) -> list[int]: ...
+
+    def __getitem__(self, index: Regs | int | slice) -> int | list[int]:
+        if isinstance(index, slice):
+            return [u.to_int32(val) for val in self.values[index]]
+        return u.to_int32(self.values[index])
+
+    def __setitem__(self, index: Regs, val: u.IntTypes) -> None:
+        if index == 0:
+            return
+        self.values[index] = int(val) & u.MASK32
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self) -> t.Iterator[int]:
+        return (u.to_int32(val) for val in self.values)
+
+    def __repr__(self) -> str:
+        return f"RegisterFile({list(self)})"
+
+
+class RV32I:
+    memory: mem.Memory
+    xregs: list[int]  # Unsigned register values
+    regs: RegisterFile
+    pc_addr: int  # Unsigned PC
+    instret: int  # Instructions retired, instructions that trap are not counted
+    start_time: int  # Host time in ns that the time CSR counts from
+    exit_code: int | None  # Set when a device halts the program
+    translator: "BlockTranslator | None"
+    fuser: "Fuser | None"
+    handlers: t.ClassVar[list[t.Callable[["RV32I", DecodedInstr], None]]]  # Indexed by opcode
+
+    def __init__(self, memory: mem.Memory | None = None) -> None:
         self.memory = memory if memory is not None else mem.RVMemory()
-        self.regs = np.zeros(32, dtype=np.int32)
-        self.pc = np.int32(0)
+        self.xregs = [0] * 32
+        self.regs = RegisterFile(self.xregs)
+        self.pc_addr = 0
+        self.instret = 0
+        self.start_time = time.perf_counter_ns()
+        self.exit_code = None
+        self.translator = None
+        self.fuser = None
+
+    @property
+    def pc(self) -> int:
+        """Signed view of the PC"""
+        return u.to_int32(self.pc_addr)
+
+    @pc.setter
+    def pc(self, val: u.IntTypes) -> None:
+        self.pc_addr = int(val) & u.MASK32
+
+    @property
+    def cycle(self) -> int:
+        """Cycles taken, modelled as one cycle per instruction"""
+        return self.instret
 
     def set_pc(self, val: u.IntTypes) -> None:
-        self.pc = u.to_int32(val)
+        self.pc_addr = int(val) & u.MASK32
 
     def inc_pc(self) -> None:
-        self.pc += mem.DataSize.WORD
+        self.pc_addr = (self.pc_addr + mem.DataSize.WORD) & u.MASK32
 
     def set_reg(self, index: Regs, val: u.IntTypes) -> None:
         if index == 0:
             return
-        self.regs[index] = u.to_int32(val)
+        self.xregs[index] = int(val) & u.MASK32
 
-    def fetch(self) -> np.uint32:
-        instr_addr = u.to_uint32(self.pc)
-        return self.memory.read(instr_addr, mem.DataSize.WORD)
+    def fetch(self) -> int:
+        return self.memory.fetch(self.pc_addr)
 
-    @staticmethod
-    def decode(instr: np.uint32):
-        bits = u.int_to_bits(instr, 32)
-
-        opcode_bits, rd_bits, funct3_bits, rs1_bits, rs2_bits, funct7_bits = (
-            u.split_bitfield(bits, (7, 5, 3, 5, 5, 7))
-        )
-        opcode = Opcodes(u.bits_to_uint(opcode_bits))
-        rd = Regs(u.bits_to_uint(rd_bits))
-        funct3 = u.bits_to_uint(funct3_bits)
-        rs1 = Regs(u.bits_to_uint(rs1_bits))
-        rs2 = Regs(u.bits_to_uint(rs2_bits))
-        funct7 = u.bits_to_uint(funct7_bits)
-        imm = None
-
-        match opcode:
-            case Opcodes.OP:
-                pass
-            case Opcodes.OP_IMM | Opcodes.LOAD | Opcodes.JALR | Opcodes.MISC_MEM | Opcodes.SYSTEM:  # I-type
-                imm = u.bits_to_int(u.bitfield_slice(bits, 31, 20))
-            case Opcodes.STORE:  # S-Type
-                imm = u.bits_to_int(
-                    u.bitfield_slice(bits, 31, 25) + u.bitfield_slice(bits, 11, 7)
-                )
-            case Opcodes.BRANCH:  # B-Type
-                imm = u.bits_to_int(
-                    u.bitfield_slice(bits, 31, 31)
-                    + u.bitfield_slice(bits, 7, 7)
-                    + u.bitfield_slice(bits, 30, 25)
-                    + u.bitfield_slice(bits, 11, 8)
-                    + "0"
-                )
-            case Opcodes.JAL:  # J-Type
-                imm = u.bits_to_int(
-                    u.bitfield_slice(bits, 31, 31)
-                    + u.bitfield_slice(bits, 19, 12)
-                    + u.bitfield_slice(bits, 20, 20)
-                    + u.bitfield_slice(bits, 30, 21)
-                    + "0"
-                )
-            case Opcodes.LUI | Opcodes.AUIPC:  # U-type
-                imm = u.bits_to_int(u.bitfield_slice(bits, 31, 12))
-            case _:
-                raise RuntimeError(f"Unknown opcode: {opcode}")
+    def fetch_decoded(self) -> DecodedInstr:
+        """Fetch and decode the instruction at the PC, reusing earlier decodes"""
+        return self.decode_at(self.pc_addr)
+
+    def decode_at(self, instr_addr: int) -> DecodedInstr:
+        """Decode the instruction at instr_addr, reusing earlier decodes.
+        Entries are dropped by RVMemory when the instruction word is written"""
+        decoded_instr = self.memory.instr_cache.get(instr_addr)
+        if decoded_instr is None:
+            decoded_instr = self.decode(self.memory.fetch(instr_addr))
+            self.memory.instr_cache[instr_addr] = decoded_instr
+        return decoded_instr
 
-        return DecodedInstr(opcode, rd, rs1, rs2, funct3, funct7, imm)
+    @staticmethod
+    def decode(instr: int) -> DecodedInstr:
+        """Decode instruction, equal words share one DecodedInstr"""
+        return decode_word(int(instr) & 0xFFFFFFFF)
+
+    def __init_subclass__(cls, **kwargs: t.Any) -> None:
+        super().__init_subclass__(**kwargs)
+        cls.build_dispatch()
+
+    @classmethod
+    def build_dispatch(cls) -> None:
+        """Build the table of handlers indexed by opcode, once per class so overridden handlers are used"""
+        handlers = [cls.execute_unknown] * (1 << 7)
+        for opcode, name in OPCODE_HANDLERS.items():
+            handlers[opcode] = getattr(cls, name)
+        cls.handlers = handlers
 
     def execute(self, instr: DecodedInstr):
-        match instr.opcode:
-            case Opcodes.OP:
-                return self.execute_op(instr)
-            case Opcodes.OP_IMM:
-                return self.execute_imm(instr)
-            case Opcodes.LOAD:
-                return self.execute_load(instr)
-            case Opcodes.STORE:
-                return self.execute_store(instr)
-            case Opcodes.BRANCH:
-                return self.execute_branch(instr)
-            case Opcodes.JAL:
-                return self.execute_jal(instr)
-            case Opcodes.JALR:
-                return self.execute_jalr(instr)
-            case Opcodes.LUI:
-                return self.execute_lui(instr)
-            case Opcodes.AUIPC:
-                return self.execute_auipc(instr)
-            case Opcodes.MISC_MEM:
-                return self.execute_mem(instr)
-            case Opcodes.SYSTEM:
-                return self.execute_system(instr)
-            case _:
-                raise RuntimeError(f"Unknown opcode: {instr.opcode}")
+        return self.handlers[instr.opcode](self, instr)
+
+    def execute_unknown(self, instr: DecodedInstr):
+        raise RuntimeError(f"Unknown opcode: {instr.opcode}")
 
     def execute_op(self, instr: DecodedInstr):
-        if instr.funct3 == 0x0 and instr.funct7 == 0x00:  # ADD
-            result = self.regs[instr.rs1] + self.regs[instr.rs2]
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x0 and instr.funct7 == 0x20:  # SUB
-            result = self.regs[instr.rs1] - self.regs[instr.rs2]
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x4 and instr.funct7 == 0x00:  # XOR
-            result = self.regs[instr.rs1] ^ self.regs[instr.rs2]
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x6 and instr.funct7 == 0x00:  # OR
-            result = self.regs[instr.rs1] | self.regs[instr.rs2]
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x7 and instr.funct7 == 0x00:  # AND
-            result = self.regs[instr.rs1] & self.regs[instr.rs2]
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x1 and instr.funct7 == 0x00:  # SLL
-            shift_num = self.regs[instr.rs2] & 0x1F  # Only consider lower 5 bits
-            result = (u.to_uint32(self.regs[instr.rs1]) << shift_num) % (1 << 32)
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x5 and instr.funct7 == 0x00:  # SRL
-            shift_num = self.regs[instr.rs2] & 0x1F  # Only consider lower 5 bits
-            result = u.to_uint32(self.regs[instr.rs1]) >> shift_num
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x5 and instr.funct7 == 0x20:  # SRA
-            shift_num = self.regs[instr.rs2] & 0x1F  # Only consider lower 5 bits
-            result = self.regs[instr.rs1] >> shift_num
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x2 and instr.funct7 == 0x00:  # SLT
-            result = 1 if self.regs[instr.rs1] < self.regs[instr.rs2] else 0
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x3 and instr.funct7 == 0x00:  # SLTU
-            result = (
-                1
-                if u.to_uint32(self.regs[instr.rs1]) < u.to_uint32(self.regs[instr.rs2])
-                else 0
-            )
-            self.set_reg(instr.rd, result)
+        func = instr.func
+        if func is not None:
+            self.set_reg(instr.rd, func(self.xregs[instr.rs1], self.xregs[instr.rs2]))
         self.inc_pc()
 
     def execute_imm(self, instr: DecodedInstr):
-        if instr.funct3 == 0x0:  # ADDI
-            result = self.regs[instr.rs1] + u.to_int32(instr.imm)
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x4:  # XORI
-            result = self.regs[instr.rs1] ^ u.to_int32(instr.imm)
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x6:  # ORI
-            result = self.regs[instr.rs1] | u.to_int32(instr.imm)
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x7:  # ANDI
-            result = self.regs[instr.rs1] & u.to_int32(instr.imm)
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x1:
-            if ((instr.imm >> 5) & 0x7F) == 0x00:  # SLLI
-                shift_num = u.to_int32(instr.imm) & 0x1F  # Only consider lower 5 bits
-                result = (u.to_uint32(self.regs[instr.rs1]) << shift_num) % (1 << 32)
-                self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x5:
-            if ((instr.imm >> 5) & 0x7F) == 0x00:  # SRLI
-                shift_num = u.to_int32(instr.imm) & 0x1F  # Only consider lower 5 bits
-                result = u.to_uint32(self.regs[instr.rs1]) >> shift_num
-                self.set_reg(instr.rd, result)
-            elif ((instr.imm >> 5) & 0x7F) == 0x20:  # SRAI
-                shift_num = u.to_int32(instr.imm) & 0x1F  # Only consider lower 5 bits
-                result = self.regs[instr.rs1] >> shift_num
-                self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x2:  # SLTI
-            result = 1 if self.regs[instr.rs1] < u.to_int32(instr.imm) else 0
-            self.set_reg(instr.rd, result)
-        elif instr.funct3 == 0x3:  # SLTIU
-            result = (
-                1 if u.to_uint32(self.regs[instr.rs1]) < u.to_uint32(instr.imm) else 0
-            )
-            self.set_reg(instr.rd, result)
+        func = instr.func
+        if func is not None:
+            self.set_reg(instr.rd, func(self.xregs[instr.rs1], instr.imm))
         self.inc_pc()
 
     def execute_load(self, instr: DecodedInstr):
-        addr = u.to_uint32(self.regs[instr.rs1] + instr.imm)
-        match instr.funct3:
-            case 0x0:  # LB
-                read_val = self.memory.read(addr, mem.DataSize.BYTE)
-                val = u.bits_to_int(u.int_to_bits(read_val, 8))
-            case 0x1:  # LH
-                read_val = self.memory.read(addr, mem.DataSize.HALF)
-                val = u.bits_to_int(u.int_to_bits(read_val, 16))
-            case 0x2:  # LW
-                read_val = self.memory.read(addr, mem.DataSize.WORD)
-                val = u.bits_to_int(u.int_to_bits(read_val, 32))
-            case 0x4:  # LBU
-                read_val = self.memory.read(addr, mem.DataSize.BYTE)
-                val = u.bits_to_uint(u.int_to_bits(read_val, 8))
-            case 0x5:  # LHU
-                read_val = self.memory.read(addr, mem.DataSize.HALF)
-                val = u.bits_to_uint(u.int_to_bits(read_val, 16))
-        self.set_reg(instr.rd, val)
+        load_format = instr.func
+        if load_format is not None:
+            size, sign_width = load_format
+            val = self.memory.read((self.xregs[instr.rs1] + instr.imm) & u.MASK32, size)
+            self.set_reg(instr.rd, u.sign_extend(val, sign_width) if sign_width else val)
         self.inc_pc()
 
     def execute_store(self, instr: DecodedInstr):
-        addr = u.to_uint32(self.regs[instr.rs1] + instr.imm)
-        value = u.to_uint32(self.regs[instr.rs2])
-        match instr.funct3:
-            case 0x0:  # SB
-                self.memory.write(addr=addr, size=mem.DataSize.BYTE, value=value)
-            case 0x1:  # SH
-                self.memory.write(addr, mem.DataSize.HALF, value)
-            case 0x2:  # SW
-                self.memory.write(addr=addr, size=mem.DataSize.WORD, value=value)
+        size = instr.func
+        if size is not None:
+            self.memory.write((self.xregs[instr.rs1] + instr.imm) & u.MASK32, size, self.xregs[instr.rs2])
         self.inc_pc()
 
     def execute_branch(self, instr: DecodedInstr):
-        match instr.funct3:
-            case 0x0:  # BEQ
-                branch = self.regs[instr.rs1] == self.regs[instr.rs2]
-            case 0x1:  # BNE
-                branch = self.regs[instr.rs1] != self.regs[instr.rs2]
-            case 0x4:  # BLT
-                branch = self.regs[instr.rs1] < self.regs[instr.rs2]
-            case 0x5:  # BGT
-                branch = self.regs[instr.rs1] >= self.regs[instr.rs2]
-            case 0x6:  # BLTU
-                branch = u.to_uint32(self.regs[instr.rs1]) < u.to_uint32(
-                    self.regs[instr.rs2]
-                )
-            case 0x7:  # BGEU
-                branch = u.to_uint32(self.regs[instr.rs1]) >= u.to_uint32(
-                    self.regs[instr.rs2]
-                )
-
-        if branch:
-            self.pc += instr.imm
+        func = instr.func
+        if func is not None and func(self.xregs[instr.rs1], self.xregs[instr.rs2]):
+            self.pc_addr = (self.pc_addr + instr.imm) & u.MASK32
         else:
             self.inc_pc()
 
     def execute_jal(self, instr: DecodedInstr):
-        self.set_reg(instr.rd, self.pc + 4)
-        self.pc += instr.imm
+        self.set_reg(instr.rd, self.pc_addr + 4)
+        self.pc_addr = (self.pc_addr + instr.imm) & u.MASK32
 
     def execute_jalr(self, instr: DecodedInstr):
         if instr.funct3 == 0x0:
-            dest_addr = self.regs[instr.rs1] + instr.imm
+            dest_addr = self.xregs[instr.rs1] + instr.imm
             dest_addr &= ~1  # RISC-V spec defines that LSB should be set to 0
 
-            self.set_reg(instr.rd, self.pc + 4)
-            self.pc = dest_addr
+            self.set_reg(instr.rd, self.pc_addr + 4)
+            self.pc_addr = dest_addr & u.MASK32
         else:
             self.inc_pc()
 
@@ -330,7 +412,7 @@ class RV32I:
         self.inc_pc()
 
     def execute_auipc(self, instr: DecodedInstr):
-        val = self.pc + (instr.imm << 12)
+        val = self.pc_addr + (instr.imm << 12)
         self.set_reg(instr.rd, val)
         self.inc_pc()
 
@@ -345,24 +427,196 @@ class RV32I:
                 raise ECall
             if instr.imm == 1:  # EBREAK
                 raise EBreak
+        elif instr.funct3 != 0x4:  # CSRRW, CSRRS, CSRRC and immediate forms
+            # Only the read-only counters are implemented, so writes are ignored
+            self.set_reg(instr.rd, self.read_csr(instr.imm & 0xFFF))
         self.inc_pc()
 
-    def run_program(self, max_instructions: int | None = None):
-        """Run program until ECALL/EBREAK instruction or after max_instructions"""
-        for i in itertools.count():
+    def read_csr(self, csr: int) -> int:
+        match csr:
+            case Csrs.CYCLE | Csrs.INSTRET:
+                return self.instret & u.MASK32
+            case Csrs.CYCLEH | Csrs.INSTRETH:
+                return (self.instret >> 32) & u.MASK32
+            case Csrs.TIME:
+                return self.time_us() & u.MASK32
+            case Csrs.TIMEH:
+                return (self.time_us() >> 32) & u.MASK32
+            case _:
+                return 0
+
+    def time_us(self) -> int:
+        """Value of the time CSR, microseconds of host time since the RV32I was created"""
+        return (time.perf_counter_ns() - self.start_time) // 1000
+
+    def run_program(self, max_instructions: int | None = None, translate: bool = False,
+                    stats: Stats | None = None, profiler: "Profiler | None" = None,
+                    trace: "TraceWriter | None" = None, fuse: bool = False):
+        """Run program until ECALL/EBREAK instruction or after max_instructions.
+        With translate, straight-line code is run as translated basic blocks.
+        With fuse, common instruction sequences are run as single fused operations.
+        With stats, profiler or trace, they are collected on the interpreter instead"""
+        if trace is not None:
+            return trace.run(self, max_instructions)
+        if profiler is not None:
+            return profiler.run(self, max_instructions)
+        if stats is not None:
+            return self.run_with_stats(stats, max_instructions)
+        if translate:
+            return self.run_blocks(max_instructions)
+        if fuse:
+            return self.run_fused(max_instructions)
+
+        # instret is the loop variable, so counting costs no more than the loop itself
+        end = self.instret + (max_instructions or 0)
+        for self.instret in itertools.count(self.instret):
             if max_instructions is not None:
-                if not i < max_instructions:
+                if not self.instret < end:
                     break
 
-            bin_instr = self.fetch()
-            decoded_instr = self.decode(bin_instr)
+            decoded_instr = self.fetch_decoded()
 
             try:
                 self.execute(decoded_instr)
             except (ECall, EBreak):
                 break
+            except devices.Halt as halt:
+                self.exit_code = halt.exit_code
+                break
+
+    def run_until(self, stop_addr: int, max_instructions: int | None = None) -> bool:
+        """Run on the interpreter until the PC reaches stop_addr, e.g. to checkpoint after start-up.
+        Returns False if the program stopped or reached max_instructions first"""
+        end = self.instret + (max_instructions or 0)
+        for self.instret in itertools.count(self.instret):
+            if self.pc_addr == stop_addr:
+                return True
+            if max_instructions is not None:
+                if not self.instret < end:
+                    return False
+
+            try:
+                self.execute(self.fetch_decoded())
+            except (ECall, EBreak):
+                return False
+            except devices.Halt as halt:
+                self.exit_code = halt.exit_code
+                return False
+
+    def run_blocks(self, max_instructions: int | None = None):
+        """Run program as translated basic blocks, see pyriscv.translate"""
+        if self.translator is None:
+            from pyriscv.translate import BlockTranslator
+            self.translator = BlockTranslator(self)
+
+        end = self.instret + (max_instructions or 0)
+        while True:
+            block = self.translator.lookup(self.pc_addr)
+            if max_instructions is not None and self.instret + block.length > end:
+                # Finish on the interpreter so the instruction limit is exact
+                return self.run_program(end - self.instret)
+
+            try:
+                self.instret += block.run(self, self.xregs)
+            except (ECall, EBreak):
+                break
+            except devices.Halt as halt:
+                self.exit_code = halt.exit_code
+                break
+
+    def run_fused(self, max_instructions: int | None = None):
+        """Interpreter loop that runs recognised instruction sequences as one operation, see pyriscv.fusion"""
+        if self.fuser is None:
+            from pyriscv.fusion import Fuser
+            self.fuser = Fuser(self)
+        fuser, memory = self.fuser, self.memory
+        ops, counts, instructions = fuser.ops, fuser.counts, fuser.instructions
+
+        end = self.instret + (max_instructions or 0)
+        while max_instructions is None or self.instret < end:
+            op = ops.get(self.pc_addr) if fuser.code_generation == memory.code_generation else None
+            if op is None:
+                op = fuser.lookup(self.pc_addr)
+            try:
+                if op.__class__ is DecodedInstr:
+                    self.execute(op)
+                    self.instret += 1
+                elif op is not None and (max_instructions is None or self.instret + op.length <= end):
+                    executed = op.run(self, end - self.instret if max_instructions is not None else sys.maxsize)
+                    self.instret += executed
+                    counts[op.name] += 1
+                    instructions[op.name] += executed
+                else:
+                    # Not decodable, or a fused operation would pass max_instructions
+                    self.execute(self.fetch_decoded())
+                    self.instret += 1
+            except (ECall, EBreak):
+                break
+            except devices.Halt as halt:
+                self.exit_code = halt.exit_code
+                break
 
-    def load_bin(self, bin_filepath: str):
-        """Load binary file into program memory and initialise PC"""
-        prog_bytes = open(bin_filepath, "rb").read()
-        self.pc = self.memory.load_program(prog_bytes)
+    def run_with_stats(self, stats: Stats, max_instructions: int | None = None):
+        """Interpreter loop that also counts instructions by opcode and funct3.
+        Kept separate from run_program so that runs without stats pay nothing for them"""
+        counts = stats.counts
+        start_instret, start_time = self.instret, time.perf_counter()
+        end = self.instret + (max_instructions or 0)
+        try:
+            for self.instret in itertools.count(self.instret):
+                if max_instructions is not None:
+                    if not self.instret < end:
+                        break
+
+                decoded_instr = self.fetch_decoded()
+                counts[decoded_instr.opcode, decoded_instr.funct3] += 1
+
+                try:
+                    self.execute(decoded_instr)
+                except (ECall, EBreak):
+                    break
+                except devices.Halt as halt:
+                    self.exit_code = halt.exit_code
+                    break
+        finally:
+            stats.instructions += self.instret - start_instret
+            stats.seconds += time.perf_counter() - start_time
+
+    def snapshot(self) -> Snapshot:
+        """Capture registers, PC and memory, see pyriscv.snapshot"""
+        return Snapshot(list(self.xregs), self.pc_addr, self.instret, self.memory.snapshot(),
+                        dict(self.memory.instr_cache))
+
+    def restore(self, snapshot: Snapshot) -> None:
+        self.xregs[:] = snapshot.xregs
+        self.pc_addr = snapshot.pc_addr
+        self.instret = snapshot.instret
+        self.exit_code = None
+        self.memory.restore(snapshot.memory)
+        # Decodes taken along with the snapshot are valid for the restored memory
+        self.memory.instr_cache.update(snapshot.instr_cache)
+
+    def load_snapshot(self, snapshot_filepath: str) -> Snapshot:
+        snapshot = Snapshot.from_file(snapshot_filepath)
+        self.restore(snapshot)
+        return snapshot
+
+    def load_elf(self, elf_filepath: str) -> elf.ElfFile:
+        """Load ELF segments into memory and initialise PC from the entry point"""
+        elf_file = elf.ElfFile.from_file(elf_filepath)
+        for segment in elf_file.segments:
+            self.memory.load_data(segment.paddr, segment.data)
+            bss_size = segment.mem_size - len(segment.data)
+            if bss_size > 0:
+                self.memory.load_data(segment.paddr + len(segment.data), bytes(bss_size))
+        self.set_pc(elf_file.entry)
+        return elf_file
+
+    def load_bin(self, bin_filepath: str, offset: int = 0):
+        """Load binary file into program memory at offset and initialise PC"""
+        with open(bin_filepath, "rb") as f:
+            prog_bytes = f.read()
+        self.set_pc(self.memory.load_program(prog_bytes, offset))
+
+
+RV32I.build_dispatch()
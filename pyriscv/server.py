@@ -0,0 +1,132 @@
+"""
+Job server for running many test cases from one booted image.
+
+The program is loaded and booted once. Each job then starts from the booted
+state, either in a forked child process or by restoring a snapshot, so a job
+costs little more than its own emulation.
+
+Jobs are JSON objects, one per line, read from stdin or a Unix socket:
+
+    {"id": 1, "regs": {"10": 5}, "memory": {"0x90000000": "01000000"},
+     "signature": ["begin_signature", "end_signature"], "max_instructions": 100000}
+
+All fields are optional. Addresses are numbers, numeric strings or ELF symbols,
+and memory data is hex. Each job is answered with one JSON line:
+
+    {"id": 1, "pc": 2147483720, "regs": [0, ...], "instret": 9, "exit_code": null, "signature": [...]}
+
+or {"id": 1, "error": "..."} if the job failed.
+"""
+import json
+import os
+import socketserver
+import typing as t
+
+from pyriscv import elf, mem
+from pyriscv.rv32i import RV32I
+from pyriscv.snapshot import Snapshot
+
+
+class JobServer:
+    rv: RV32I
+    elf_file: elf.ElfFile | None
+    fork: bool  # Run each job in a forked child, otherwise restore a snapshot
+    translate: bool
+    booted: Snapshot
+
+    def __init__(self, rv: RV32I, elf_file: elf.ElfFile | None = None, fork: bool = True,
+                 translate: bool = False) -> None:
+        self.rv = rv
+        self.elf_file = elf_file
+        self.fork = fork
+        self.translate = translate
+        self.booted = rv.snapshot()
+
+    def resolve_addr(self, addr: int | str) -> int:
+        if isinstance(addr, int):
+            return addr
+        if self.elf_file is not None and addr in self.elf_file.symbols:
+            return self.elf_file.symbols[addr].value
+        return int(addr, 0)
+
+    def run_job(self, job: dict[str, t.Any]) -> dict[str, t.Any]:
+        """Run job from the booted state, leaving the booted state untouched"""
+        if self.fork:
+            return self.run_forked(job)
+        self.rv.restore(self.booted)
+        return self.execute_job(job)
+
+    def run_forked(self, job: dict[str, t.Any]) -> dict[str, t.Any]:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            try:
+                result = json.dumps(self.execute_job(job)).encode()
+                with os.fdopen(write_fd, "wb") as f:
+                    f.write(result)
+            finally:
+                os._exit(0)  # Skip cleanup inherited from the server, such as flushing its output
+
+        os.close(write_fd)
+        with os.fdopen(read_fd, "rb") as f:
+            result = f.read()
+        os.waitpid(pid, 0)
+        if not result:
+            return {"id": job.get("id"), "error": "Job process exited without a result"}
+        return json.loads(result)
+
+    def execute_job(self, job: dict[str, t.Any]) -> dict[str, t.Any]:
+        rv = self.rv
+        try:
+            for reg, value in job.get("regs", {}).items():
+                rv.set_reg(int(reg), value)
+            for addr, data in job.get("memory", {}).items():
+                rv.memory.load_data(self.resolve_addr(addr), bytes.fromhex(data))
+
+            rv.run_program(job.get("max_instructions"), translate=self.translate)
+
+            result = {"id": job.get("id"), "pc": rv.pc_addr, "regs": list(rv.xregs), "instret": rv.instret,
+                      "exit_code": rv.exit_code}
+            signature = job.get("signature", self.default_signature())
+            if signature is not None:
+                start, end = (self.resolve_addr(addr) for addr in signature)
+                result["signature"] = [rv.memory.read(addr, mem.DataSize.WORD) for addr in range(start, end, 4)]
+            return result
+        except Exception as e:
+            return {"id": job.get("id"), "error": f"{type(e).__name__}: {e}"}
+
+    def default_signature(self) -> list[str] | None:
+        if self.elf_file is not None and "begin_signature" in self.elf_file.symbols:
+            return ["begin_signature", "end_signature"]
+        return None
+
+    def handle_line(self, line: str) -> str:
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as e:
+            return json.dumps({"id": None, "error": f"Invalid job: {e}"})
+        return json.dumps(self.run_job(job))
+
+    def serve(self, infile: t.TextIO, outfile: t.TextIO) -> None:
+        """Answer each job line from infile on outfile, until infile is closed"""
+        for line in infile:
+            if line.strip():
+                outfile.write(self.handle_line(line) + "\n")
+                outfile.flush()
+
+    def serve_unix(self, socket_path: str) -> None:
+        """Accept connections on a Unix socket, each sending any number of job lines"""
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                for line in self.rfile:
+                    if line.strip():
+                        self.wfile.write(server.handle_line(line.decode()).encode() + b"\n")
+
+        with socketserver.UnixStreamServer(socket_path, Handler) as unix_server:
+            try:
+                unix_server.serve_forever()
+            finally:
+                os.remove(socket_path)
@@ -0,0 +1,60 @@
+"""
+Checkpoints of machine state.
+
+A Snapshot holds the registers, PC, instret and memory contents of an RV32I, taken with
+RV32I.snapshot and applied with RV32I.restore. PagedMemory shares its pages with
+snapshots and copies them on write, so taking or restoring a snapshot of a
+mostly untouched memory does not copy memory at all.
+
+Snapshots saved to a file are zlib compressed, so zeroed memory costs almost nothing.
+"""
+from dataclasses import dataclass, field
+import struct
+import typing as t
+import zlib
+
+
+SNAPSHOT_MAGIC = b"PRVSNAP1"
+
+STATE = struct.Struct("<32IIQ")  # xregs, pc, instret
+CHUNK_HEADER = struct.Struct("<II")  # address, length
+
+
+@dataclass
+class Snapshot:
+    xregs: list[int]
+    pc_addr: int
+    instret: int
+    memory: dict[int, bytes | bytearray]  # Contents keyed by start address
+    instr_cache: dict[int, t.Any] = field(default_factory=dict)  # Decodes matching memory, not saved
+
+    def save(self, filepath: str) -> None:
+        parts = [STATE.pack(*self.xregs, self.pc_addr, self.instret)]
+        for addr, data in self.memory.items():
+            parts.append(CHUNK_HEADER.pack(addr, len(data)))
+            parts.append(data)
+        with open(filepath, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(zlib.compress(b"".join(parts), level=1))
+
+    @classmethod
+    def from_file(cls, filepath: str) -> "Snapshot":
+        with open(filepath, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise RuntimeError("Not a pyriscv snapshot file")
+            data = zlib.decompress(f.read())
+
+        *xregs, pc_addr, instret = STATE.unpack_from(data)
+        memory = {}
+        pos = STATE.size
+        while pos < len(data):
+            addr, length = CHUNK_HEADER.unpack_from(data, pos)
+            pos += CHUNK_HEADER.size
+            memory[addr] = bytearray(data[pos: pos + length])
+            pos += length
+        return cls(xregs, pc_addr, instret, memory)
+
+
+def is_snapshot(filepath: str) -> bool:
+    with open(filepath, "rb") as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
@@ -0,0 +1,49 @@
+"""
+Execution statistics collected by RV32I.run_program(stats=...).
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+
+
+# Opcodes whose funct3 field selects the operation, for the others it is part of an immediate
+FUNCT3_OPCODES = ("OP", "OP_IMM", "LOAD", "STORE", "BRANCH", "JALR", "MISC_MEM", "SYSTEM")
+
+
+@dataclass
+class Stats:
+    counts: Counter[tuple[int, int]] = field(default_factory=Counter)  # Keyed by (opcode, funct3)
+    instructions: int = 0
+    seconds: float = 0.0  # Host time spent running
+
+    @property
+    def instructions_per_second(self) -> float:
+        return self.instructions / self.seconds if self.seconds else 0.0
+
+    def opcode_counts(self) -> Counter[str]:
+        from pyriscv.rv32i import Opcodes  # Not at the top, as rv32i imports this module
+
+        opcodes = Counter()
+        for (opcode, _), count in self.counts.items():
+            opcodes[Opcodes(opcode).name] += count
+        return opcodes
+
+    def funct3_counts(self, opcode_name: str) -> Counter[int]:
+        from pyriscv.rv32i import Opcodes
+
+        opcode = Opcodes[opcode_name]
+        return Counter({funct3: count for (op, funct3), count in self.counts.items() if op == opcode})
+
+    def report(self) -> str:
+        lines = [
+            f"instructions: {self.instructions}",
+            f"seconds:      {self.seconds:.3f}",
+            f"instr/s:      {self.instructions_per_second:,.0f}",
+            "",
+        ]
+        total = sum(self.counts.values()) or 1
+        for name, count in self.opcode_counts().most_common():
+            lines.append(f"{name:<10} {count:>12} {100 * count / total:6.2f}%")
+            if name in FUNCT3_OPCODES:
+                for funct3, funct3_count in sorted(self.funct3_counts(name).items()):
+                    lines.append(f"  funct3={funct3} {funct3_count:>12}")
+        return "\n".join(lines)
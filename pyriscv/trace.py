@@ -0,0 +1,194 @@
+"""
+Binary execution traces.
+
+TraceWriter.run is an interpreter loop that records, for every instruction, the
+PC, raw instruction word, register writeback and any data memory access.
+Records are struct-packed into a fixed size buffer that is flushed to the file
+as it fills, so memory use stays constant however long the run.
+
+Each record is a header of PC, instruction, rd and flags, followed by the rd
+value if rd is non-zero and the address and value if there was a memory access.
+The flags hold the access size in bytes, with MEM_WRITE set for stores.
+read_trace decodes a trace file lazily, one record at a time, and decode_trace
+does the same for chunks from any other stream.
+"""
+from dataclasses import dataclass
+import itertools
+import struct
+import typing as t
+
+from pyriscv import devices, mem
+from pyriscv.rv32i import EBreak, ECall, Opcodes, RV32I
+
+
+TRACE_MAGIC = b"PRVTRACE"
+
+RECORD_HEADER = struct.Struct("<IIBB")  # pc, instr, rd, flags
+REG_VALUE = struct.Struct("<I")
+MEM_ACCESS = struct.Struct("<II")  # addr, value
+
+MEM_SIZE_MASK = 0x7
+MEM_WRITE = 0x8
+
+WRITES_RD = (Opcodes.OP, Opcodes.OP_IMM, Opcodes.LOAD, Opcodes.JAL, Opcodes.JALR, Opcodes.LUI, Opcodes.AUIPC,
+             Opcodes.SYSTEM)
+
+BUFFER_SIZE = 1 << 20
+
+
+@dataclass
+class TraceRecord:
+    pc: int
+    instr: int
+    rd: int  # 0 if no register was written
+    rd_value: int
+    mem_addr: int | None  # None if there was no data memory access
+    mem_value: int
+    mem_size: int
+    mem_write: bool
+
+    def __str__(self) -> str:
+        line = f"0x{self.pc:08x} (0x{self.instr:08x})"
+        if self.rd:
+            line += f" x{self.rd} 0x{self.rd_value:08x}"
+        if self.mem_addr is not None:
+            kind = "mem" if self.mem_write else "load"
+            line += f" {kind}{self.mem_size * 8} 0x{self.mem_addr:08x} 0x{self.mem_value:0{self.mem_size * 2}x}"
+        return line
+
+
+class RecordingMemory:
+    """Passes accesses through to memory, keeping the last data access for the trace"""
+
+    memory: mem.Memory
+    access: tuple[int, int, int] | None  # (addr, value, flags)
+
+    def __init__(self, memory: mem.Memory) -> None:
+        self.memory = memory
+        self.access = None
+
+    def __getattr__(self, name: str) -> t.Any:
+        return getattr(self.memory, name)
+
+    def read(self, addr: int, size: mem.DataSize) -> int:
+        value = self.memory.read(addr, size)
+        self.access = (addr, value, size)
+        return value
+
+    def write(self, addr: int, size: mem.DataSize, value: int) -> None:
+        self.memory.write(addr, size, value)
+        self.access = (addr, value & mem.SIZE_MASKS[size], size | MEM_WRITE)
+
+
+class TraceWriter:
+    file: t.BinaryIO
+    buffer: bytearray
+    records: int
+
+    def __init__(self, file: t.BinaryIO) -> None:
+        self.file = file
+        self.buffer = bytearray(TRACE_MAGIC)
+        self.records = 0
+
+    @classmethod
+    def open(cls, filepath: str) -> "TraceWriter":
+        return cls(open(filepath, "wb"))
+
+    def flush(self) -> None:
+        self.file.write(self.buffer)
+        self.buffer.clear()
+        self.file.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+    def __enter__(self) -> "TraceWriter":
+        return self
+
+    def __exit__(self, *exc_info: t.Any) -> None:
+        self.close()
+
+    def run(self, rv: RV32I, max_instructions: int | None = None) -> None:
+        """Run program like RV32I.run_program, writing a record for each instruction that retires"""
+        buffer = self.buffer
+        recorder = RecordingMemory(rv.memory)
+        memory, rv.memory = rv.memory, recorder  # type: ignore[assignment]
+        start_instret = rv.instret
+        end = rv.instret + (max_instructions or 0)
+        try:
+            for rv.instret in itertools.count(rv.instret):
+                if max_instructions is not None:
+                    if not rv.instret < end:
+                        break
+
+                pc = rv.pc_addr
+                decoded_instr = rv.fetch_decoded()
+                instr = memory.fetch(pc)
+                recorder.access = None
+
+                try:
+                    rv.execute(decoded_instr)
+                except (ECall, EBreak):
+                    break
+                except devices.Halt as halt:
+                    rv.exit_code = halt.exit_code
+                    break
+
+                rd = decoded_instr.rd if decoded_instr.opcode in WRITES_RD else 0
+                access = recorder.access
+                buffer += RECORD_HEADER.pack(pc, instr, rd, access[2] if access else 0)
+                if rd:
+                    buffer += REG_VALUE.pack(rv.xregs[rd])
+                if access:
+                    buffer += MEM_ACCESS.pack(access[0], access[1])
+                if len(buffer) >= BUFFER_SIZE:
+                    self.file.write(buffer)
+                    buffer.clear()
+        finally:
+            rv.memory = memory
+            self.records += rv.instret - start_instret
+
+
+def read_trace(filepath: str) -> t.Iterator[TraceRecord]:
+    """Decode trace records lazily, reading the file in fixed size chunks"""
+    with open(filepath, "rb") as f:
+        yield from decode_trace(iter(lambda: f.read(BUFFER_SIZE), b""))
+
+
+def decode_trace(chunks: t.Iterable[bytes]) -> t.Iterator[TraceRecord]:
+    """Decode trace records from a stream of chunks, as written by TraceWriter, split at any byte"""
+    data = b""
+    pos = 0
+    started = False
+    for chunk in chunks:
+        data = data[pos:] + chunk
+        pos = 0
+        if not started:
+            if len(data) < len(TRACE_MAGIC):
+                continue
+            if not data.startswith(TRACE_MAGIC):
+                raise RuntimeError("Not a pyriscv trace file")
+            pos = len(TRACE_MAGIC)
+            started = True
+
+        while pos + RECORD_HEADER.size <= len(data):
+            pc, instr, rd, flags = RECORD_HEADER.unpack_from(data, pos)
+            size = flags & MEM_SIZE_MASK
+            end = pos + RECORD_HEADER.size + (REG_VALUE.size if rd else 0) + (MEM_ACCESS.size if size else 0)
+            if end > len(data):
+                break  # Record continues in the next chunk
+
+            offset = pos + RECORD_HEADER.size
+            rd_value = 0
+            if rd:
+                rd_value, = REG_VALUE.unpack_from(data, offset)
+                offset += REG_VALUE.size
+            mem_addr, mem_value = MEM_ACCESS.unpack_from(data, offset) if size else (None, 0)
+            yield TraceRecord(pc, instr, rd, rd_value, mem_addr, mem_value, size, bool(flags & MEM_WRITE))
+            pos = end
+
+    if not started:
+        raise RuntimeError("Not a pyriscv trace file")
+    if pos != len(data):
+        raise RuntimeError("Trace file ends part way through a record")
@@ -0,0 +1,285 @@
+"""
+Basic-block translation engine.
+
+Runs of instructions ending at a BRANCH, JAL, JALR or SYSTEM instruction are
+translated once into a single Python function, cached by start address.
+Registers are held in local variables for the duration of a block, so a block
+executes without the per-instruction dispatch of RV32I.execute.
+"""
+from dataclasses import dataclass
+import typing as t
+
+from pyriscv.rv32i import DecodedInstr, Opcodes, RV32I
+
+
+MASK = 0xFFFFFFFF
+SIGN = 0x80000000
+
+MAX_BLOCK_LEN = 64
+
+TERMINATORS = (Opcodes.BRANCH, Opcodes.JAL, Opcodes.JALR, Opcodes.SYSTEM)
+
+LOAD_SIZES = {0x0: 1, 0x1: 2, 0x2: 4, 0x4: 1, 0x5: 2}
+STORE_SIZES = {0x0: 1, 0x1: 2, 0x2: 4}
+
+OP_EXPRS = {
+    (0x0, 0x00): "({a} + {b}) & MASK",  # ADD
+    (0x0, 0x20): "({a} - {b}) & MASK",  # SUB
+    (0x4, 0x00): "{a} ^ {b}",  # XOR
+    (0x6, 0x00): "{a} | {b}",  # OR
+    (0x7, 0x00): "{a} & {b}",  # AND
+    (0x1, 0x00): "({a} << ({b} & 0x1F)) & MASK",  # SLL
+    (0x5, 0x00): "{a} >> ({b} & 0x1F)",  # SRL
+    (0x5, 0x20): "((({a} ^ SIGN) - SIGN) >> ({b} & 0x1F)) & MASK",  # SRA
+    (0x2, 0x00): "(1 if ({a} ^ SIGN) < ({b} ^ SIGN) else 0)",  # SLT
+    (0x3, 0x00): "(1 if {a} < {b} else 0)",  # SLTU
+}
+
+BRANCH_CONDS = {
+    0x0: "{a} == {b}",  # BEQ
+    0x1: "{a} != {b}",  # BNE
+    0x4: "({a} ^ SIGN) < ({b} ^ SIGN)",  # BLT
+    0x5: "({a} ^ SIGN) >= ({b} ^ SIGN)",  # BGE
+    0x6: "{a} < {b}",  # BLTU
+    0x7: "{a} >= {b}",  # BGEU
+}
+
+
+@dataclass
+class TranslatedBlock:
+    start: int
+    length: int
+    source: str
+    run: t.Callable[[RV32I, list[int]], int]  # Returns number of instructions executed
+
+
+class BlockTranslator:
+    rv: RV32I
+    blocks: dict[int, TranslatedBlock]
+    code_generation: int
+
+    def __init__(self, rv: RV32I) -> None:
+        self.rv = rv
+        self.blocks = {}
+        self.code_generation = rv.memory.code_generation
+
+    def lookup(self, addr: int) -> TranslatedBlock:
+        """Get translated block starting at addr, translating it if needed"""
+        if self.code_generation != self.rv.memory.code_generation:
+            # Code has been modified, so any block could be stale
+            self.blocks.clear()
+            self.code_generation = self.rv.memory.code_generation
+
+        block = self.blocks.get(addr)
+        if block is None:
+            block = self.blocks[addr] = self.translate(addr)
+        return block
+
+    def find_block(self, start: int) -> list[DecodedInstr]:
+        """Decode instructions from start up to and including the next control transfer"""
+        instrs = []
+        addr = start
+        while len(instrs) < MAX_BLOCK_LEN:
+            try:
+                instr = self.rv.decode_at(addr)
+            except (RuntimeError, ValueError):
+                # Leave the error to be raised if execution reaches it
+                if not instrs:
+                    raise
+                break
+            instrs.append(instr)
+            if instr.opcode in TERMINATORS:
+                break
+            addr += 4
+        return instrs
+
+    def translate(self, start: int) -> TranslatedBlock:
+        instrs = self.find_block(start)
+        source = BlockCompiler(start, instrs, self.code_generation).compile()
+        namespace = {
+            "MASK": MASK,
+            "SIGN": SIGN,
+            "memory": self.rv.memory,
+            "instrs": tuple(instrs),
+        }
+        exec(compile(source, f"<block 0x{start:08x}>", "exec"), namespace)
+        return TranslatedBlock(start, len(instrs), source, namespace["block"])
+
+
+class BlockCompiler:
+    """Generates the Python source for a single basic block"""
+
+    start: int
+    instrs: list[DecodedInstr]
+    code_generation: int
+    lines: list[str]
+    loaded: set[int]
+    dirty: set[int]
+
+    def __init__(self, start: int, instrs: list[DecodedInstr], code_generation: int) -> None:
+        self.start = start
+        self.instrs = instrs
+        self.code_generation = code_generation
+        self.lines = []
+        self.loaded = set()
+        self.dirty = set()
+
+    def emit(self, line: str, indent: int = 1) -> None:
+        self.lines.append("    " * indent + line)
+
+    def read_reg(self, reg: int) -> str:
+        """Expression for the unsigned value of reg, loading it into a local on first use"""
+        if reg == 0:
+            return "0"
+        if reg not in self.loaded:
+            self.emit(f"x{reg} = xregs[{reg}]")
+            self.loaded.add(reg)
+        return f"x{reg}"
+
+    def write_reg(self, reg: int, expr: str) -> None:
+        if reg == 0:
+            return
+        self.emit(f"x{reg} = {expr}")
+        self.loaded.add(reg)
+        self.dirty.add(reg)
+
+    def write_back(self, indent: int = 1) -> None:
+        for reg in sorted(self.dirty):
+            self.emit(f"xregs[{reg}] = x{reg}", indent)
+
+    def set_pc(self, expr: str, indent: int = 1) -> None:
+        self.emit(f"rv.pc_addr = {expr}", indent)
+
+    def emit_access(self, line: str, index: int, pc: int) -> None:
+        """
+        Emit a memory access, which may raise from a device or bad address.
+        Registers, PC and instret are written back first so state matches the interpreter.
+        """
+        self.emit("try:")
+        self.emit(line, indent=2)
+        self.emit("except BaseException:")
+        self.write_back(indent=2)
+        self.set_pc(f"0x{pc:08x}", indent=2)
+        if index:
+            self.emit(f"rv.instret += {index}", indent=2)
+        self.emit("raise", indent=2)
+
+    def fallback(self, index: int, pc: int) -> None:
+        """Run instruction on the interpreter, for anything without a translation"""
+        self.write_back()
+        self.loaded.clear()
+        self.dirty.clear()
+        self.set_pc(f"0x{pc:08x}")
+        if index:
+            # instret is visible to CSR reads, the caller adds the whole block once it returns
+            self.emit(f"rv.instret += {index}")
+            self.emit(f"rv.execute(instrs[{index}])")
+            self.emit(f"rv.instret -= {index}")
+        else:
+            self.emit(f"rv.execute(instrs[{index}])")
+
+    def compile(self) -> str:
+        self.emit("def block(rv, xregs):", indent=0)
+
+        for index, instr in enumerate(self.instrs):
+            pc = self.start + 4 * index
+            next_pc = (pc + 4) & MASK
+
+            match instr.opcode:
+                case Opcodes.OP:
+                    expr = OP_EXPRS.get((instr.funct3, instr.funct7))
+                    if expr is not None:
+                        a, b = self.read_reg(instr.rs1), self.read_reg(instr.rs2)
+                        self.write_reg(instr.rd, expr.format(a=a, b=b))
+                case Opcodes.OP_IMM:
+                    self.compile_imm(instr)
+                case Opcodes.LOAD if instr.funct3 in LOAD_SIZES:
+                    self.compile_load(instr, index, pc)
+                case Opcodes.STORE if instr.funct3 in STORE_SIZES:
+                    self.compile_store(instr, index, pc)
+                case Opcodes.STORE | Opcodes.MISC_MEM:
+                    pass
+                case Opcodes.LUI:
+                    self.write_reg(instr.rd, f"0x{(instr.imm << 12) & MASK:x}")
+                case Opcodes.AUIPC:
+                    self.write_reg(instr.rd, f"0x{(pc + (instr.imm << 12)) & MASK:x}")
+                case Opcodes.BRANCH if instr.funct3 in BRANCH_CONDS:
+                    a, b = self.read_reg(instr.rs1), self.read_reg(instr.rs2)
+                    self.write_back()
+                    cond = BRANCH_CONDS[instr.funct3].format(a=a, b=b)
+                    target = (pc + instr.imm) & MASK
+                    self.set_pc(f"0x{target:08x} if {cond} else 0x{next_pc:08x}")
+                case Opcodes.JAL:
+                    self.write_reg(instr.rd, f"0x{next_pc:08x}")
+                    self.write_back()
+                    self.set_pc(f"0x{(pc + instr.imm) & MASK:08x}")
+                case Opcodes.JALR if instr.funct3 == 0x0:
+                    # RISC-V spec defines that LSB should be set to 0
+                    self.emit(f"target = ({self.read_reg(instr.rs1)} + {instr.imm}) & 0xFFFFFFFE")
+                    self.write_reg(instr.rd, f"0x{next_pc:08x}")
+                    self.write_back()
+                    self.set_pc("target")
+                case _:
+                    self.fallback(index, pc)
+
+            if instr.opcode in TERMINATORS:
+                break
+        else:
+            self.write_back()
+            self.set_pc(f"0x{(self.start + 4 * len(self.instrs)) & MASK:08x}")
+
+        self.emit(f"return {len(self.instrs)}")
+        return "\n".join(self.lines) + "\n"
+
+    def compile_imm(self, instr: DecodedInstr) -> None:
+        imm = instr.imm & MASK
+        shift_num = instr.imm & 0x1F  # Only consider lower 5 bits
+        shift_type = (instr.imm >> 5) & 0x7F
+        match instr.funct3, shift_type:
+            case 0x0, _:  # ADDI
+                expr = "({a} + %d) & MASK" % instr.imm
+            case 0x4, _:  # XORI
+                expr = "{a} ^ 0x%x" % imm
+            case 0x6, _:  # ORI
+                expr = "{a} | 0x%x" % imm
+            case 0x7, _:  # ANDI
+                expr = "{a} & 0x%x" % imm
+            case 0x1, 0x00:  # SLLI
+                expr = "({a} << %d) & MASK" % shift_num
+            case 0x5, 0x00:  # SRLI
+                expr = "{a} >> %d" % shift_num
+            case 0x5, 0x20:  # SRAI
+                expr = "((({a} ^ SIGN) - SIGN) >> %d) & MASK" % shift_num
+            case 0x2, _:  # SLTI
+                expr = "(1 if ({a} ^ SIGN) < 0x%x else 0)" % (imm ^ SIGN)
+            case 0x3, _:  # SLTIU
+                expr = "(1 if {a} < 0x%x else 0)" % imm
+            case _:
+                return
+        self.write_reg(instr.rd, expr.format(a=self.read_reg(instr.rs1)))
+
+    def compile_load(self, instr: DecodedInstr, index: int, pc: int) -> None:
+        addr = f"({self.read_reg(instr.rs1)} + {instr.imm}) & MASK"
+        read = f"memory.read({addr}, {LOAD_SIZES[instr.funct3]})"
+        if instr.rd == 0:
+            self.emit_access(read, index, pc)
+            return
+
+        self.emit_access(f"val = {read}", index, pc)
+        match instr.funct3:
+            case 0x0:  # LB
+                self.write_reg(instr.rd, "((val ^ 0x80) - 0x80) & MASK")
+            case 0x1:  # LH
+                self.write_reg(instr.rd, "((val ^ 0x8000) - 0x8000) & MASK")
+            case _:  # LW, LBU, LHU
+                self.write_reg(instr.rd, "val")
+
+    def compile_store(self, instr: DecodedInstr, index: int, pc: int) -> None:
+        addr = f"({self.read_reg(instr.rs1)} + {instr.imm}) & MASK"
+        self.emit_access(f"memory.write({addr}, {STORE_SIZES[instr.funct3]}, {self.read_reg(instr.rs2)})", index, pc)
+
+        # Stop early if the store modified decoded code, which may include this block
+        self.emit(f"if memory.code_generation != {self.code_generation}:")
+        self.write_back(indent=2)
+        self.set_pc(f"0x{(pc + 4) & MASK:08x}", indent=2)
+        self.emit(f"return {index + 1}", indent=2)
@@ -1,30 +1,39 @@
 import itertools
 import typing as t
 
-import numpy as np
+if t.TYPE_CHECKING:
+    import numpy as np
 
+    IntTypes = int | np.uint32 | np.int32
+else:
+    # NumPy scalars are still accepted, but NumPy is not imported just for the annotation
+    IntTypes = t.SupportsInt
 
-IntTypes = int | np.uint32 | np.int32
+MASK32 = 0xFFFFFFFF
 
 
-def to_uint32(val: IntTypes) -> np.uint32:
-    int_val = int(val)
-    if int_val < 0:
-        int_val += 1 << 32
-    return np.uint32(int_val)
+def to_uint32(val: IntTypes) -> int:
+    return int(val) & MASK32
 
 
-def to_int32(val: IntTypes) -> np.int32:
-    int_val = int(val)
-    if int_val >= (1 << 31):
-        int_val -= 1 << 32
-    return np.int32(int_val)
+def to_int32(val: IntTypes) -> int:
+    int_val = int(val) & MASK32
+    return int_val - ((int_val & 0x80000000) << 1)
+
+
+def sign_extend(val: int, width: int) -> int:
+    """Interpret the lower width bits of val as a two's complement signed int"""
+    sign_bit = 1 << (width - 1)
+    return (val & (sign_bit - 1)) - (val & sign_bit)
 
 
 def int_to_bits(val: IntTypes, width: int) -> str:
     """Get binary representation as a string.
     Uses two's complement for negative numbers"""
-    return np.binary_repr(val, width)
+    val = int(val)
+    if val < 0:
+        val += 1 << width
+    return format(val, f"0{width}b")
 
 
 def bits_to_uint(bits: str) -> int:
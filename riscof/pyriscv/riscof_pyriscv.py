@@ -1,5 +1,6 @@
 import logging
 import os
+import subprocess
 
 import riscof.utils as utils
 from riscof.pluginTemplate import pluginTemplate
@@ -30,6 +31,9 @@ class pyriscv(pluginTemplate):
         self.dut_exe = os.path.join(
             config["PATH"] if "PATH" in config else "", "pyriscv-riscof"
         )
+        self.batch_exe = os.path.join(
+            config["PATH"] if "PATH" in config else "", "pyriscv-riscof-batch"
+        )
 
         # Number of parallel jobs that can be spawned off by RISCOF
         # for various actions performed in later functions, specifically to run the tests in
@@ -52,6 +56,10 @@ class pyriscv(pluginTemplate):
         else:
             self.target_run = True
 
+        # With batch=1 the Makefile only compiles the tests, then all tests are run by a single
+        # pyriscv-riscof-batch process so Python start-up is not paid for every test
+        self.batch = "batch" in config and config["batch"] == "1"
+
     def initialise(self, suite, work_dir, archtest_env):
 
         # capture the working directory. Any artifacts that the DUT creates should be placed in this
@@ -121,6 +129,9 @@ class pyriscv(pluginTemplate):
         # function earlier
         make.makeCommand = "make -k -j" + self.num_jobs
 
+        # (elf, signature) paths of the tests to run in batch mode
+        batch_tests = []
+
         # we will iterate over each entry in the testList. Each entry node will be refered to by the
         # variable testname.
         for testname in testList:
@@ -137,7 +148,6 @@ class pyriscv(pluginTemplate):
 
             # name of the elf file after compilation of the test
             elf_file = "test.elf"
-            bin_file = "test.bin"
 
             # name of the signature file as per requirement of RISCOF. RISCOF expects the signature to
             # be named as DUT-<dut-name>.signature. The below variable creates an absolute path of
@@ -155,19 +165,22 @@ class pyriscv(pluginTemplate):
                 testentry["isa"].lower(), self.xlen, test, elf_file, compile_macros
             )
 
-            copy_command = f"riscv{self.xlen}-unknown-elf-objcopy --strip-all -O binary {elf_file} {bin_file}"
-
             # if the user wants to disable running the tests and only compile the tests, then
             # the "else" clause is executed below assigning the sim command to simple no action
             # echo statement.
-            if self.target_run:
+            if self.target_run and self.batch:
+                # the test is run after compilation by the batch runner
+                batch_tests.append((os.path.join(test_dir, elf_file), sig_file))
+                simcmd = "true"
+            elif self.target_run:
                 # set up the simulation command. Template is for spike. Please change.
-                simcmd = f"{self.dut_exe} {bin_file} --test-signature={sig_file}"
+                # The emulator loads the ELF directly and finds the signature bounds by symbol
+                simcmd = f"{self.dut_exe} {elf_file} --test-signature={sig_file}"
             else:
                 simcmd = 'echo "NO RUN"'
 
             # concatenate all commands that need to be executed within a make-target.
-            execute = f"@cd {testentry['work_dir']}; {compile_cmd}; {copy_command}; {simcmd};"
+            execute = f"@cd {testentry['work_dir']}; {compile_cmd}; {simcmd};"
 
             # create a target. The makeutil will create a target with the name "TARGET<num>" where num
             # starts from 0 and increments automatically for each new target that is added
@@ -177,6 +190,15 @@ class pyriscv(pluginTemplate):
         # parallel using the make command set above.
         make.execute_all(self.work_dir)
 
+        if batch_tests:
+            test_list = os.path.join(self.work_dir, "batch_tests." + self.name[:-1])
+            with open(test_list, "w") as f:
+                f.writelines(f"{elf}\t{sig}\n" for elf, sig in batch_tests)
+            # Tests that failed to run have no signature, so RISCOF reports them as for make -k
+            result = subprocess.run([self.batch_exe, test_list, "--jobs", self.num_jobs], cwd=self.work_dir)
+            if result.returncode:
+                logger.error(f"{self.batch_exe} exited with status {result.returncode}, see above for failed tests")
+
         # if target runs are not required then we simply exit as this point after running all
         # the makefile targets.
         if not self.target_run:
@@ -0,0 +1,15 @@
+"""
+Helpers for tests that run small programs of instruction words from asm
+"""
+from pyriscv.assem import FIXED_WORDS, asm_program
+from pyriscv.rv32i import RV32I
+
+
+EBREAK = FIXED_WORDS["ebreak"]
+
+
+def load_program(rv: RV32I, instrs: list[int]) -> int:
+    """Load instruction words at the start of ROM, point the PC at them and return the start address"""
+    start = rv.memory.load_program(asm_program(instrs))
+    rv.set_pc(start)
+    return start
@@ -0,0 +1,166 @@
+import re
+
+import pytest
+
+from pyriscv.assem import PROGRAM_START, AssemblerError, asm, asm_program, assemble
+from pyriscv.rv32i import Regs as R, RV32I
+
+
+def words(source: str, base: int = PROGRAM_START) -> list[int]:
+    data = assemble(source, base).data
+    return [int.from_bytes(data[i: i + 4], "little") for i in range(0, len(data), 4)]
+
+
+@pytest.mark.parametrize(
+    "line,expected",
+    [
+        ("add a0, a1, a2", asm("add", R.X10, R.X11, R.X12)),
+        ("SUB x1,x2,x3", asm("sub", R.X1, R.X2, R.X3)),
+        ("srai t0, t1, 3", asm("srai", R.X5, R.X6, imm=3)),
+        ("addi sp, sp, -16", asm("addi", R.X2, R.X2, imm=-16)),
+        ("xori s0, fp, 0x7ff", asm("xori", R.X8, R.X8, imm=0x7FF)),
+        ("lw a5, -20(s0)", asm("lw", R.X15, R.X8, imm=-20)),
+        ("lbu a0, (a1)", asm("lbu", R.X10, R.X11, imm=0)),
+        ("sb a1, 3(a0)", asm("sb", rs1=R.X10, rs2=R.X11, imm=3)),
+        ("lui t0, 0x80000", asm("lui", R.X5, imm=0x80000)),
+        ("auipc gp, 1", asm("auipc", R.X3, imm=1)),
+        ("jalr ra, 8(t0)", asm("jalr", R.X1, R.X5, imm=8)),
+        ("jalr t0", asm("jalr", R.X1, R.X5, imm=0)),
+        ("bne a0, zero, -8", asm("bne", rs1=R.X10, rs2=R.X0, imm=-8)),
+        ("jal ra, 16", asm("jal", R.X1, imm=16)),
+        ("nop", asm("addi", R.X0, R.X0, imm=0)),
+        ("mv a0, a1", asm("addi", R.X10, R.X11, imm=0)),
+        ("not a0, a1", asm("xori", R.X10, R.X11, imm=-1)),
+        ("neg a0, a1", asm("sub", R.X10, R.X0, R.X11)),
+        ("seqz a0, a1", asm("sltiu", R.X10, R.X11, imm=1)),
+        ("snez a0, a1", asm("sltu", R.X10, R.X0, R.X11)),
+        ("j -4", asm("jal", R.X0, imm=-4)),
+        ("jr t1", asm("jalr", R.X0, R.X6, imm=0)),
+        ("ret", asm("jalr", R.X0, R.X1, imm=0)),
+        ("bgtz a0, 8", asm("blt", rs1=R.X0, rs2=R.X10, imm=8)),
+        ("bleu a0, a1, 8", asm("bgeu", rs1=R.X11, rs2=R.X10, imm=8)),
+        ("ecall", 0x00000073),
+        ("ebreak", 0x00100073),
+        ("rdcycle a0", 0xC0002573),
+        ("fence", 0x0FF0000F),
+        ("fence rw, rw", 0x0330000F),
+        ("fence iorw, ow", 0x0F50000F),
+        ("addi a0, a0, -2048", asm("addi", R.X10, R.X10, imm=-2048)),
+        ("srai a0, a0, 31", asm("srai", R.X10, R.X10, imm=31)),
+        ("blt a0, a1, -4096", asm("blt", rs1=R.X10, rs2=R.X11, imm=-4096)),
+        ("lui a0, 0xfffff", asm("lui", R.X10, imm=0xFFFFF)),
+    ],
+)
+def test_line(line: str, expected: int):
+    assert words(line) == [expected & 0xFFFFFFFF]
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        (5, [asm("addi", R.X10, R.X0, imm=5)]),
+        (-2048, [asm("addi", R.X10, R.X0, imm=-2048)]),
+        (0x12345000, [asm("lui", R.X10, imm=0x12345)]),
+        (0x12345FFF, [asm("lui", R.X10, imm=0x12346), asm("addi", R.X10, R.X10, imm=-1)]),
+        (0xFFFFF800, [asm("addi", R.X10, R.X0, imm=-2048)]),
+        (-0x80000000, [asm("lui", R.X10, imm=0x80000)]),
+    ],
+)
+def test_li(value: int, expected: list[int]):
+    assert words(f"li a0, {value}") == [word & 0xFFFFFFFF for word in expected]
+
+
+def test_labels_and_directives():
+    program = assemble("""
+    _start:
+        la a0, data     # Forward reference
+        call func
+    loop: j loop
+    func:
+        ret
+        .align 4
+    data: .word 0x12345678, -1, data
+        .zero 2
+    end:
+    """)
+    base = PROGRAM_START
+    assert program.labels == {"_start": base, "loop": base + 16, "func": base + 20, "data": base + 32,
+                              "end": base + 46}
+    assert program.end == base + 46
+    assert program.data[:24] == assemble("\n".join(
+        ["auipc a0, 0", "addi a0, a0, 32", "auipc ra, 0", "jalr ra, 12(ra)", "jal zero, 0", "jalr zero, 0(ra)"])).data
+    assert program.data[32:46] == bytes.fromhex("78563412ffffffff20000080") + bytes(2)
+
+
+SUM_PROGRAM = """
+# Sums the words of table into a0
+_start:
+    la t0, table
+    li t1, 4            # Words left
+    li a0, 0
+loop:
+    lw t2, 0(t0)
+    add a0, a0, t2
+    addi t0, t0, 4
+    addi t1, t1, -1
+    bnez t1, loop
+    call double
+    li a1, 0xDEADBEEF
+    ebreak
+double:
+    add a0, a0, a0
+    ret
+table:
+    .word 1, 20, 300, 4000
+"""
+
+
+def test_program_runs():
+    program = assemble(SUM_PROGRAM)
+    rv = RV32I()
+    rv.set_pc(rv.memory.load_program(program.data))
+    rv.run_program()
+    assert rv.xregs[R.X10] == 2 * 4321
+    assert rv.xregs[R.X11] == 0xDEADBEEF
+    assert rv.pc_addr == program.labels["double"] - 4
+
+
+@pytest.mark.parametrize(
+    "source,message",
+    [
+        ("j nowhere", "line 1: Unknown label or invalid number: nowhere"),
+        ("a:\na:", "line 2: Duplicate label: a"),
+        ("nop\nmul a0, a1, a2", "line 2: Unknown instruction: mul with 3 operands"),
+        ("add a0, a1", "line 1: Wrong number of operands for add: 2"),
+        ("addi a0, a9, 1", "line 1: Unknown register: a9"),
+        ("li a0, label", "line 1: Expected a number: label"),
+        (".zero 2\nnop", "line 2: Instruction at unaligned address 0x80000002"),
+        ("addi a0, a0, 5000", "line 1: addi immediate out of range [-2048, 2047]: 5000"),
+        ("jalr ra, -2049(t0)", "line 1: jalr immediate out of range [-2048, 2047]: -2049"),
+        ("sw a0, 2048(a1)", "line 1: sw immediate out of range [-2048, 2047]: 2048"),
+        ("slli a0, a0, 40", "line 1: Shift amount out of range [0, 31]: 40"),
+        ("srai a0, a0, -1", "line 1: Shift amount out of range [0, 31]: -1"),
+        ("beq a0, a1, far\n.zero 8192\nfar:", "line 1: beq offset out of range [-4096, 4094]: 8196"),
+        ("bnez a0, 6\nbne a0, a1, 3", "line 2: bne offset must be even: 3"),
+        ("j 0x100000", "line 1: jal offset out of range [-1048576, 1048574]: 1048576"),
+        ("jal ra, 5", "line 1: jal offset must be even: 5"),
+        ("lui a0, 0x100000", "line 1: lui immediate out of range [0, 1048575]: 1048576"),
+        ("auipc a0, -1", "line 1: auipc immediate out of range [0, 1048575]: -1"),
+        ("fence wr, rw", "line 1: Expected a fence set from iorw: wr"),
+        ("fence rw", "line 1: Unknown instruction: fence with 1 operands"),
+        (".zero", "line 1: Wrong number of operands for .zero: 0"),
+        (".zero -4", "line 1: .zero needs a non-negative number: -4"),
+        (".align 2, 0", "line 1: Wrong number of operands for .align: 2"),
+        (".p2align -1", "line 1: .p2align needs a non-negative number: -1"),
+        ("li a0, 0x100000001", "line 1: Value out of 32-bit range: 4294967297"),
+        ("li a0, -0x80000001", "line 1: Value out of 32-bit range: -2147483649"),
+        (".word 1, 0x100000000", "line 1: Value out of 32-bit range: 4294967296"),
+    ],
+)
+def test_errors(source: str, message: str):
+    with pytest.raises(AssemblerError, match=f"^{re.escape(message)}$"):
+        assemble(source)
+
+
+def test_asm_program():
+    assert asm_program([asm("addi", R.X1, R.X0, imm=-1), 0x00100073]) == bytes.fromhex("9300f0ff73001000")
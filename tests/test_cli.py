@@ -0,0 +1,33 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from pyriscv.cli import parse_test_list, riscof_batch
+
+
+def test_cli_does_not_import_numpy():
+    code = "import sys, pyriscv.cli; print('numpy' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False", "NumPy should only be imported when a NumPy feature is used"
+
+
+def test_parse_test_list():
+    lines = ["work/add test/add.elf\twork/add test/add.sig\n", "\n", "b.elf\tb.sig"]
+    assert parse_test_list(lines) == [("work/add test/add.elf", "work/add test/add.sig"), ("b.elf", "b.sig")]
+
+
+@pytest.mark.parametrize("line", ["a.elf a.sig", "a.elf\ta.sig\textra"])
+def test_parse_test_list_bad_line(line: str):
+    with pytest.raises(ValueError, match="line 2"):
+        parse_test_list(["a.elf\ta.sig", line])
+
+
+def test_riscof_batch_unknown_cpu_count(tmp_path, monkeypatch, capsys):
+    test_list = tmp_path / "tests.txt"
+    test_list.write_text("")
+    monkeypatch.setattr(os, "cpu_count", lambda: None)
+    monkeypatch.setattr(sys, "argv", ["pyriscv-riscof-batch", str(test_list)])
+    riscof_batch()
+    assert capsys.readouterr().out == "Ran 0 tests, 0 failed\n"
@@ -0,0 +1,72 @@
+import io
+
+import pytest
+
+from pyriscv import devices, mem
+from pyriscv.assem import asm
+from pyriscv.rv32i import Regs as R, RV32I
+
+from programs import EBREAK, load_program
+
+
+@pytest.mark.parametrize("memory_type", [mem.RVMemory, mem.RiscofMemory])
+def test_uart_output(memory_type: type[mem.Memory]):
+    output = io.BytesIO()
+    memory = memory_type()
+    devices.add_default_devices(memory, output)
+    for char in b"hi\n":
+        memory.write(devices.UART_BASE, mem.DataSize.BYTE, char)
+    assert output.getvalue() == b"hi\n"
+    assert memory.read(devices.UART_BASE + devices.Uart.LSR, mem.DataSize.BYTE) == devices.Uart.LSR_TX_IDLE
+
+
+def test_unmapped_device_address():
+    memory = mem.RVMemory()
+    devices.add_default_devices(memory, io.BytesIO())
+    with pytest.raises(RuntimeError):
+        memory.read(devices.UART_BASE + 0x100, mem.DataSize.WORD)
+
+
+def test_clint_time():
+    now = 1000
+    clint = devices.Clint(clock=lambda: now)
+    memory = mem.RVMemory()
+    memory.add_device(devices.CLINT_BASE, clint)
+    mtime = devices.CLINT_BASE + devices.Clint.MTIME
+
+    now += 0x1_0000_0005
+    assert memory.read(mtime, mem.DataSize.WORD) == 5
+    assert memory.read(mtime + 4, mem.DataSize.WORD) == 1
+
+    memory.write(mtime, mem.DataSize.WORD, 0x20)
+    now += 3
+    assert memory.read(mtime, mem.DataSize.WORD) == 0x23
+    assert memory.read(mtime + 4, mem.DataSize.WORD) == 1
+
+    memory.write(devices.CLINT_BASE + devices.Clint.MTIMECMP, mem.DataSize.WORD, 0x1234)
+    assert clint.mtimecmp == 0xFFFFFFFF00001234
+
+
+@pytest.mark.parametrize("translate", [False, True])
+def test_tohost_halts(translate: bool):
+    output = io.BytesIO()
+    rv = RV32I()
+    devices.add_default_devices(rv.memory, output)
+    load_program(rv, [
+        asm("lui", R.X10, imm=devices.UART_BASE >> 12),
+        asm("addi", R.X11, R.X0, imm=ord("A")),
+        asm("sb", rs1=R.X10, rs2=R.X11, imm=0),
+        asm("lui", R.X12, imm=devices.TOHOST_BASE >> 12),
+        asm("addi", R.X13, R.X0, imm=(3 << 1) | 1),
+        asm("sw", rs1=R.X12, rs2=R.X13, imm=0),
+        asm("addi", R.X14, R.X0, imm=1),  # Not reached
+        EBREAK,
+    ])
+    rv.run_program(translate=translate)
+
+    assert output.getvalue() == b"A"
+    assert rv.exit_code == 3
+    # Registers and PC are left at the halting store
+    assert rv.pc_addr == rv.memory.rom.start_offset + 20
+    assert rv.xregs[R.X13] == 7
+    assert rv.xregs[R.X14] == 0
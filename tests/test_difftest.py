@@ -0,0 +1,130 @@
+import pytest
+
+from pyriscv.assem import asm
+from pyriscv.difftest import DiffChecker, compare, parse_commit_log
+from pyriscv.rv32i import Regs as R, RV32I
+from pyriscv.trace import TraceRecord
+
+from programs import EBREAK, load_program
+
+
+PROGRAM = [
+    asm("lui", R.X7, imm=0x90000),
+    asm("addi", R.X5, R.X0, imm=3),
+    # loop:
+    asm("add", R.X6, R.X6, R.X5),
+    asm("sw", rs1=R.X7, rs2=R.X6, imm=0x100),
+    asm("addi", R.X5, R.X5, imm=-1),
+    asm("bne", rs1=R.X5, rs2=R.X0, imm=-12),
+    EBREAK,
+]
+PROGRAM = [instr & 0xFFFFFFFF for instr in PROGRAM]
+
+
+def make_rv() -> RV32I:
+    rv = RV32I()
+    load_program(rv, PROGRAM)
+    return rv
+
+
+def spike_log(records: list[TraceRecord]) -> list[str]:
+    lines = ["core   0: 3 0x00001000 (0x00000297) x5  0x00001000"]  # Boot ROM
+    for record in records:
+        line = f"core   0: 3 0x{record.pc:08x} (0x{record.instr:08x})"
+        if record.rd:
+            line += f" x{record.rd:<2} 0x{record.rd_value:08x}"
+        if record.mem_write:
+            line += f" mem 0x{record.mem_addr:08x} 0x{record.mem_value:08x}"
+        lines.append(line)
+    return lines
+
+
+def sail_log(records: list[TraceRecord]) -> list[str]:
+    lines = []
+    for i, record in enumerate(records):
+        lines.append(f"[{i}] [M]: 0x{record.pc:08X} (0x{record.instr:08X}) some instr")
+        if record.rd:
+            lines.append(f"x{record.rd} <- 0x{record.rd_value:08X}")
+        lines.append("")
+    return lines
+
+
+def reference_records() -> list[TraceRecord]:
+    addr = 0x80000000
+    x5, x6 = 3, 0
+    records = [
+        TraceRecord(addr, PROGRAM[0], 7, 0x90000000, None, 0, 0, False),
+        TraceRecord(addr + 4, PROGRAM[1], 5, 3, None, 0, 0, False),
+    ]
+    while x5:
+        x6 += x5
+        records.append(TraceRecord(addr + 8, PROGRAM[2], 6, x6, None, 0, 0, False))
+        records.append(TraceRecord(addr + 12, PROGRAM[3], 0, 0, 0x90000100, x6, 4, True))
+        x5 -= 1
+        records.append(TraceRecord(addr + 16, PROGRAM[4], 5, x5, None, 0, 0, False))
+        records.append(TraceRecord(addr + 20, PROGRAM[5], 0, 0, None, 0, 0, False))
+    return records
+
+
+@pytest.mark.parametrize("log_format", [spike_log, sail_log])
+def test_parse_commit_log(log_format):
+    records = reference_records()
+    parsed = [record for record in parse_commit_log(log_format(records)) if record.pc != 0x1000]
+    assert [(r.pc, r.instr, r.rd, r.rd_value) for r in parsed] == [(r.pc, r.instr, r.rd, r.rd_value) for r in records]
+
+
+def test_compare_context():
+    records = reference_records()
+    reference = list(parse_commit_log(spike_log(records)))
+    reference[7].rd_value += 1  # Second add of x6 (after the boot ROM record)
+    result = compare(records, reference, context=2)
+    assert result.checked == 6
+    assert result.divergence.reason == "register write differs"
+    assert result.divergence.record is records[6]
+    assert result.divergence.context == records[4:6]
+
+
+@pytest.mark.parametrize("log_format", [spike_log, sail_log])
+def test_diff_checker_match(log_format, tmp_path):
+    log_path = tmp_path / "ref.log"
+    log_path.write_text("\n".join(log_format(reference_records())))
+    rv = make_rv()
+    result = DiffChecker(str(log_path)).run(rv)
+    assert result.divergence is None
+    assert result.checked == rv.instret == 14
+
+
+def test_diff_checker_divergence(tmp_path):
+    records = reference_records()
+    records[10].pc += 4
+    log_path = tmp_path / "ref.log"
+    log_path.write_text("\n".join(spike_log(records)))
+    result = DiffChecker(str(log_path)).run(make_rv())
+    assert result.checked == 10
+    assert result.divergence.reason == "PC differs"
+    assert "> reference: 0x8000000c" in str(result)
+
+
+def test_diff_checker_reference_ends(tmp_path):
+    log_path = tmp_path / "ref.log"
+    log_path.write_text("\n".join(spike_log(reference_records()[:4])))
+    result = DiffChecker(str(log_path)).run(make_rv())
+    assert result.checked == 4
+    assert result.divergence.reason == "reference log ended"
+
+
+def test_diff_checker_bad_log(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        DiffChecker(str(tmp_path / "missing.log")).run(make_rv())
+    log_path = tmp_path / "empty.log"
+    log_path.write_text("no commits here\n")
+    with pytest.raises(ValueError):
+        DiffChecker(str(log_path)).run(make_rv())
+
+
+def test_diff_checker_crash(tmp_path):
+    # The first record is readable, but the checker fails on bytes far past it while skipping to the start PC
+    log_path = tmp_path / "ref.log"
+    log_path.write_bytes("\n".join(spike_log([])).encode() + b"\n" + b"padding\n" * 20000 + b"\xff\xfe\n")
+    with pytest.raises(RuntimeError, match="UnicodeDecodeError"):
+        DiffChecker(str(log_path)).run(make_rv())
@@ -0,0 +1,96 @@
+import random
+
+import numpy as np
+import pytest
+
+from pyriscv.assem import ASM_INSTR_FORMATS, asm
+from pyriscv.disasm import MNEMONICS, Disassembly
+from pyriscv.rv32i import Regs as R
+
+
+BASE = 0x80000000
+
+
+def disassemble(words: list[int], symbols: dict[int, str] | None = None) -> Disassembly:
+    return Disassembly.from_bytes(np.array(words, dtype=np.int64).astype("<u4").tobytes(), BASE, symbols)
+
+
+@pytest.mark.parametrize(
+    "word,expected",
+    [
+        (asm("add", R.X10, R.X11, R.X12), "add\ta0,a1,a2"),
+        (asm("sub", R.X1, R.X2, R.X3), "sub\tra,sp,gp"),
+        (asm("srai", R.X5, R.X6, imm=3), "srai\tt0,t1,0x3"),
+        (asm("addi", R.X2, R.X2, imm=-16), "addi\tsp,sp,-16"),
+        (asm("lw", R.X15, R.X8, imm=-20), "lw\ta5,-20(s0)"),
+        (asm("sb", rs1=R.X10, rs2=R.X11, imm=3), "sb\ta1,3(a0)"),
+        (asm("lui", R.X5, imm=0x80000), "lui\tt0,0x80000"),
+        (asm("jalr", R.X0, R.X1, imm=0), "jalr\tzero,0(ra)"),
+        (asm("bne", rs1=R.X10, rs2=R.X0, imm=-8), "bne\ta0,zero,7ffffff8"),
+        (asm("jal", R.X1, imm=16), "jal\tra,80000010 <main+0x4>"),
+        (0x0FF0000F, "fence\tiorw,iorw"),
+        (0xC0002573, "csrrs\ta0,cycle,zero"),
+        (0x00000073, "ecall"),
+        (0x00100073, "ebreak"),
+        (0x02208033, ".word\t0x02208033"),  # MUL
+        (0x40209093, ".word\t0x40209093"),  # SLLI with funct7 0x20
+        (0x0000000B, ".word\t0x0000000b"),
+    ],
+)
+def test_text(word: int, expected: str):
+    assert disassemble([word], {BASE + 12: "main"}).text(0) == expected
+
+
+def test_every_mnemonic_round_trips():
+    rng = random.Random(0)
+    words, names = [], []
+    for name in ASM_INSTR_FORMATS:
+        for _ in range(20):
+            regs = {"rd": R(rng.randrange(32)), "rs1": R(rng.randrange(32)), "rs2": R(rng.randrange(32))}
+            imm = rng.randrange(32) if name in ("slli", "srli", "srai") else rng.randrange(-2048, 2048) * 2
+            typ = ASM_INSTR_FORMATS[name][0]
+            words.append(asm(name, **regs, imm=None if typ == "R" else imm))
+            names.append(name)
+    disassembly = disassemble(words)
+    assert [MNEMONICS[index] for index in disassembly.mnemonic] == names
+
+
+LOOP_PROGRAM = [
+    asm("addi", R.X5, R.X0, imm=0),
+    # loop:
+    asm("addi", R.X5, R.X5, imm=1),
+    asm("blt", rs1=R.X5, rs2=R.X6, imm=-4),  # Branch to loop
+    asm("jal", R.X1, imm=12),  # Call func
+    0x00100073,  # EBREAK
+    0x1234560B,  # Data, not an RV32I opcode
+    # func:
+    asm("addi", R.X10, R.X0, imm=1),
+    asm("jalr", R.X0, R.X1, imm=0),
+]
+
+
+def test_basic_blocks():
+    blocks = disassemble(LOOP_PROGRAM).basic_blocks()
+    assert [(block.start - BASE, block.end - BASE, block.successors) for block in blocks] == [
+        (0x0, 0x4, [(BASE + 0x4, "fallthrough")]),
+        (0x4, 0xC, [(BASE + 0x4, "taken"), (BASE + 0xC, "fallthrough")]),
+        (0xC, 0x10, [(BASE + 0x18, "call"), (BASE + 0x10, "fallthrough")]),
+        (0x10, 0x14, []),
+        (0x18, 0x20, []),
+    ]
+
+
+def test_cfg_dot():
+    dot = disassemble(LOOP_PROGRAM, {BASE + 0x18: "func"}).cfg_dot()
+    assert '"8000000c" -> "80000018" [label="call"];' in dot
+    assert '"80000018" [label="80000018 <func>:\\laddi a0,zero,1\\ljalr zero,0(ra)\\l"];' in dot
+    assert "80000014" not in dot  # Data word
+
+
+def test_listing():
+    lines = list(disassemble(LOOP_PROGRAM[:2], {BASE: "_start"}).listing())
+    assert lines == [
+        "\n80000000 <_start>:",
+        "80000000:\t00000293          \taddi\tt0,zero,0",
+        "80000004:\t00128293          \taddi\tt0,t0,1",
+    ]
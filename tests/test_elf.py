@@ -0,0 +1,53 @@
+import os
+
+from pyriscv import elf
+from pyriscv.rv32i import Regs as R, RV32I
+
+
+# Built from firmware/basic_asm.S and firmware/start.S with firmware/sections.lds
+BASIC_ASM_ELF = os.path.join(os.path.dirname(__file__), "data", "basic_asm.elf")
+
+
+def test_elf_file():
+    elf_file = elf.ElfFile.from_file(BASIC_ASM_ELF)
+    assert elf_file.entry == 0x80000000
+    assert elf_file.symbols["main"].value == 0x80000064
+    assert elf_file.symbols["_estack"].value == 0x90000204
+
+    text, data = elf_file.segments
+    assert (text.vaddr, text.paddr) == (0x80000000, 0x80000000)
+    # Initialised data is loaded after .text and copied to RAM by start.S
+    assert (data.vaddr, data.paddr) == (0x90000000, elf_file.symbols["_sidata"].value)
+
+
+def test_load_elf():
+    assert elf.is_elf(BASIC_ASM_ELF)
+    rv = RV32I()
+    elf_file = rv.load_elf(BASIC_ASM_ELF)
+    assert rv.pc_addr == elf_file.entry
+
+    rv.run_program()
+    assert rv.regs[R.X11] == 2000
+    assert rv.xregs[R.X2] == elf_file.symbols["_estack"].value
+    variable_addr = elf_file.symbols["variable"].value
+    assert rv.memory.read(variable_addr, 4) == 0xDEADBEEF
+
+
+def test_load_elf_zeroes_bss_at_load_address(tmp_path):
+    # Give the data segment 8 bytes of bss, zeroed after its file data at the load address
+    data = bytearray(open(BASIC_ASM_ELF, "rb").read())
+    header = elf.ELF_HEADER.unpack_from(data)
+    memsz_offset = header[5] + header[9] + 20  # p_memsz of the second program header
+    memsz = int.from_bytes(data[memsz_offset: memsz_offset + 4], "little")
+    data[memsz_offset: memsz_offset + 4] = (memsz + 8).to_bytes(4, "little")
+    elf_path = tmp_path / "bss.elf"
+    elf_path.write_bytes(data)
+
+    rv = RV32I()
+    _, segment = elf.ElfFile.from_file(str(elf_path)).segments
+    load_end, run_end = segment.paddr + len(segment.data), segment.vaddr + len(segment.data)
+    rv.memory.load_data(load_end, b"\xff" * 8)
+    rv.memory.load_data(run_end, b"\xff" * 8)
+    rv.load_elf(str(elf_path))
+    assert rv.memory.read(load_end, 4) == 0 and rv.memory.read(load_end + 4, 4) == 0
+    assert rv.memory.read(run_end, 4) == 0xFFFFFFFF, "Memory after the data at its run address should be untouched"
@@ -0,0 +1,181 @@
+import pytest
+
+import numpy as np
+
+from pyriscv import mem
+from pyriscv.assem import asm
+from pyriscv.rv32i import Regs as R, RV32I
+
+from programs import EBREAK, load_program
+
+
+# Copies and clears words of RAM in loops like firmware/start.S, then calls a function
+FUSION_PROGRAM = [
+    asm("lui", R.X20, imm=0x90000),  # RAM base
+    asm("addi", R.X20, R.X20, imm=0x100),
+    asm("auipc", R.X10, imm=0),  # Copy the code itself
+    asm("addi", R.X10, R.X10, imm=-8),
+    asm("addi", R.X11, R.X20, imm=0),
+    asm("addi", R.X12, R.X20, imm=64),
+    # copy:
+    asm("lw", R.X13, R.X10, imm=0),
+    asm("sw", rs1=R.X11, rs2=R.X13, imm=0),
+    asm("addi", R.X10, R.X10, imm=4),
+    asm("addi", R.X11, R.X11, imm=4),
+    asm("blt", rs1=R.X11, rs2=R.X12, imm=-16),
+    asm("addi", R.X12, R.X12, imm=32),
+    # fill:
+    asm("sw", rs1=R.X11, rs2=R.X0, imm=0),
+    asm("addi", R.X11, R.X11, imm=4),
+    asm("bltu", rs1=R.X11, rs2=R.X12, imm=-8),
+    asm("addi", R.X5, R.X0, imm=-5),
+    # count:
+    asm("slti", R.X6, R.X5, imm=3),
+    asm("beq", rs1=R.X6, rs2=R.X0, imm=12),
+    asm("addi", R.X5, R.X5, imm=1),
+    asm("jal", R.X0, imm=-12),
+    asm("auipc", R.X1, imm=0),
+    asm("jalr", R.X1, R.X1, imm=12),  # Call function
+    EBREAK,
+    # function:
+    asm("lui", R.X7, imm=0x12345),
+    asm("addi", R.X7, R.X7, imm=0x678),
+    asm("sltu", R.X8, R.X0, R.X7),
+    asm("bne", rs1=R.X8, rs2=R.X0, imm=8),
+    asm("addi", R.X7, R.X0, imm=0),
+    asm("jalr", R.X0, R.X1, imm=0),
+]
+
+
+def run_fusion_program(fuse: bool, max_instructions: int | None = None) -> RV32I:
+    rv = RV32I()
+    load_program(rv, FUSION_PROGRAM)
+    rv.run_program(max_instructions, fuse=fuse)
+    return rv
+
+
+def assert_same_state(rv: RV32I, expected: RV32I) -> None:
+    assert rv.pc == expected.pc, f"Found PC 0x{rv.pc:x}, expected 0x{expected.pc:x}"
+    assert rv.xregs == expected.xregs
+    assert rv.instret == expected.instret
+    np.testing.assert_array_equal(rv.memory.ram.bytes, expected.memory.ram.bytes)
+
+
+@pytest.mark.parametrize("max_instructions", [None, 0, 1, 4, 9, 10, 83, 84, 85, 130])
+def test_fusion_matches_interpreter(max_instructions: int | None):
+    expected = run_fusion_program(False, max_instructions)
+    rv = run_fusion_program(True, max_instructions)
+    assert_same_state(rv, expected)
+
+
+def test_fusion_counts():
+    rv = run_fusion_program(True)
+    assert rv.xregs[R.X7] == 0x12345678
+    assert rv.fuser.counts == {
+        "lui_addi": 2, "auipc_addi": 1, "copy_loop": 1, "fill_loop": 1, "compare_branch": 10, "auipc_jalr": 1,
+    }
+    assert rv.fuser.instructions["copy_loop"] == 80 and rv.fuser.instructions["fill_loop"] == 24
+    assert "copy_loop" in rv.fuser.report()
+
+
+def test_fill_loop_modifies_itself():
+    rv = RV32I(mem.RiscofMemory())
+    load_program(rv, [
+        asm("lui", R.X10, imm=0x80000),
+        asm("addi", R.X10, R.X10, imm=12),
+        asm("addi", R.X11, R.X0, imm=0x13),  # nop
+        # fill, overwriting its own branch with nops:
+        asm("sw", rs1=R.X10, rs2=R.X11, imm=8),
+        asm("addi", R.X10, R.X10, imm=4),
+        asm("bne", rs1=R.X10, rs2=R.X0, imm=-8),
+        asm("addi", R.X5, R.X0, imm=1),
+        EBREAK,
+    ])
+    rv.run_program(fuse=True)
+    assert rv.xregs[R.X5] == 1
+    assert rv.instret == 7
+    assert rv.fuser.counts["fill_loop"] == 1
+
+
+def test_copy_loop_store_fault():
+    rv = RV32I()
+    load_program(rv, [
+        asm("lui", R.X10, imm=0x90000),
+        asm("lui", R.X11, imm=0x70000),  # Not mapped
+        asm("lw", R.X13, R.X10, imm=0),
+        asm("sw", rs1=R.X11, rs2=R.X13, imm=0),
+        asm("addi", R.X10, R.X10, imm=4),
+        asm("addi", R.X11, R.X11, imm=4),
+        asm("bne", rs1=R.X11, rs2=R.X0, imm=-16),
+    ])
+    rv.memory.write(0x90000000, mem.DataSize.WORD, 0x1234)
+    with pytest.raises(RuntimeError):
+        rv.run_program(fuse=True)
+    assert (rv.pc_addr, rv.instret, rv.xregs[R.X13]) == (0x8000000C, 3, 0x1234)
+
+
+@pytest.mark.parametrize("start", [-10, 10, 0x7FF])
+def test_addi_branch(start: int):
+    program = [
+        asm("addi", R.X5, R.X0, imm=start),
+        asm("addi", R.X6, R.X0, imm=-3),
+        # loop:
+        asm("addi", R.X5, R.X5, imm=-1),
+        asm("bge", rs1=R.X5, rs2=R.X6, imm=-4),
+        EBREAK,
+    ]
+    expected = RV32I()
+    load_program(expected, program)
+    expected.run_program()
+    rv = RV32I()
+    load_program(rv, program)
+    rv.run_program(fuse=True)
+    assert_same_state(rv, expected)
+    assert rv.fuser.counts["addi_branch"] == max(start + 3, 0) + 1
+
+
+def li(rd: R, value: int) -> list[int]:
+    lo = ((value & 0xFFF) ^ 0x800) - 0x800
+    return [asm("lui", rd, imm=((value - lo) >> 12) & 0xFFFFF), asm("addi", rd, rd, imm=lo)]
+
+
+def bulk_loop_program(copy_src: int, copy_dst: int, words: int, branch: str) -> list[int]:
+    return [
+        *li(R.X10, copy_src),
+        *li(R.X11, copy_dst),
+        asm("addi", R.X12, R.X11, imm=4 * words),
+        # copy:
+        asm("lw", R.X13, R.X10, imm=0),
+        asm("sw", rs1=R.X11, rs2=R.X13, imm=0),
+        asm("addi", R.X10, R.X10, imm=4),
+        asm("addi", R.X11, R.X11, imm=4),
+        asm(branch, rs1=R.X11, rs2=R.X12, imm=-16),
+        asm("addi", R.X14, R.X0, imm=-1),
+        asm("addi", R.X12, R.X11, imm=4 * words),
+        # fill:
+        asm("sw", rs1=R.X11, rs2=R.X14, imm=0),
+        asm("addi", R.X11, R.X11, imm=4),
+        asm(branch, rs1=R.X11, rs2=R.X12, imm=-8),
+        EBREAK,
+    ]
+
+
+@pytest.mark.parametrize(("memory_type", "copy_src", "copy_dst", "words", "branch"), [
+    (mem.RVMemory, 0x80001000, 0x90000000, 300, "blt"),  # ROM to RAM
+    (mem.RVMemory, 0x90000000, 0x90000008, 50, "bne"),  # Overlapping, not copied in bulk
+    (mem.RVMemory, 0x90000000, 0x90000100, 1, "bne"),
+    (mem.RiscofMemory, 0x80001000, 0x80004ff0, 500, "bltu"),  # Across pages
+])
+@pytest.mark.parametrize("max_instructions", [None, 23, 1000])
+def test_bulk_loops_match_interpreter(memory_type, copy_src: int, copy_dst: int, words: int, branch: str,
+                                      max_instructions: int | None):
+    program = bulk_loop_program(copy_src, copy_dst, words, branch)
+    states = []
+    for fuse in (False, True):
+        rv = RV32I(memory_type())
+        load_program(rv, program)
+        rv.memory.load_data(copy_src, bytes(range(256)) * 8)
+        rv.run_program(max_instructions, fuse=fuse)
+        states.append((rv.pc_addr, rv.instret, list(rv.xregs), rv.memory.snapshot()))
+    assert states[1] == states[0]
+    assert rv.fuser.counts["copy_loop"] < max(words, 2)
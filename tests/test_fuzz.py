@@ -0,0 +1,94 @@
+import pytest
+
+from pyriscv import fuzz as fuzz_module
+from pyriscv.assem import asm
+from pyriscv.fuzz import DATA_START, EBREAK, MODES, NOP, FuzzCase, GoldenModel, Harness, fuzz, generate_case
+from pyriscv.rv32i import Regs as R, RV32I
+
+import alu_tests
+
+
+@pytest.mark.parametrize(
+    "instr,rd,rs1,rs2,correctval,val1,val2",
+    alu_tests.ADD_TESTS + alu_tests.SUB_TESTS + alu_tests.SLL_TESTS + alu_tests.SRA_TESTS + alu_tests.SLTU_TESTS,
+)
+def test_golden_model_rr_op(instr, rd, rs1, rs2, correctval, val1, val2):
+    regs = [0] * 32
+    regs[rs1] = val1 & 0xFFFFFFFF
+    regs[rs2] = val2 & 0xFFFFFFFF
+    state = GoldenModel(FuzzCase([asm(instr, rd, rs1, rs2) & 0xFFFFFFFF, EBREAK], regs, b"")).run()
+    assert state.regs[rd] == (correctval & 0xFFFFFFFF if rd else 0)
+
+
+@pytest.mark.parametrize(
+    "instr,rd,rs1,correctval,val1,imm",
+    alu_tests.ADDI_TESTS + alu_tests.SLTI_TESTS + alu_tests.SLTIU_TESTS + alu_tests.SRAI_TESTS,
+)
+def test_golden_model_imm_op(instr, rd, rs1, correctval, val1, imm):
+    regs = [0] * 32
+    regs[rs1] = val1 & 0xFFFFFFFF
+    state = GoldenModel(FuzzCase([asm(instr, rd, rs1, imm=imm) & 0xFFFFFFFF, EBREAK], regs, b"")).run()
+    assert state.regs[rd] == (correctval & 0xFFFFFFFF if rd else 0)
+
+
+def test_cases_are_reproducible():
+    assert generate_case(1, 5) == generate_case(1, 5)
+    assert generate_case(1, 5) != generate_case(1, 6)
+    case = generate_case(1, 5, length=50)
+    assert len(case.program) == 51 and case.program[-1] == EBREAK
+    assert DATA_START in case.regs
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_emulator_matches_golden_model(mode: str):
+    report = fuzz(200, seed=3, length=40, mode=mode, batch_size=50)
+    assert (report.cases, report.failures) == (200, [])
+    assert report.instructions > 0
+
+
+def test_invalid_generated_case_is_reported(monkeypatch):
+    generate = fuzz_module.generate_case
+
+    def generate_invalid(seed: int, index: int, length: int = 32) -> FuzzCase:
+        case = generate(seed, index, length)
+        if index == 1:  # Load from address 0, outside the data window
+            return FuzzCase([asm("lw", R.X5, R.X0, imm=0) & 0xFFFFFFFF, EBREAK], case.regs, case.data)
+        return case
+
+    monkeypatch.setattr(fuzz_module, "generate_case", generate_invalid)
+    report = fuzz(3, seed=3)
+    assert report.cases == 3
+    assert [(failure.index, failure.message) for failure in report.failures] == [
+        (1, "Invalid generated case: Load outside the data window: 0x00000000")
+    ]
+
+
+class NoBgeu(RV32I):
+    """Never takes BGEU branches"""
+
+    def execute_branch(self, instr):
+        if instr.funct3 == 0x7:
+            self.inc_pc()
+        else:
+            super().execute_branch(instr)
+
+
+def test_failures_are_found_and_minimized():
+    harness = Harness(rv=NoBgeu())
+    case = next(case for case in (generate_case(0, index) for index in range(1000)) if harness.check(case))
+    minimized = harness.minimize(case)
+    assert harness.check(minimized)
+    remaining = [word for word in minimized.program[:-1] if word != NOP]
+    assert len(remaining) < len(case.program) // 4
+    assert any(word & 0x707F == 0x7063 for word in remaining)  # BGEU
+    assert not any(minimized.data)
+
+
+def test_loops_reach_fusion():
+    cases = [generate_case(2, index) for index in range(100)]
+    backward_branches = [word for case in cases for word in case.program if word & 0x7F == 0x63 and word >> 31]
+    assert backward_branches, "Loops should close with backward branches"
+
+    harness = Harness("fuse")
+    assert not any(harness.check(case) for case in cases)
+    assert harness.rv.fuser.counts["copy_loop"] and harness.rv.fuser.counts["fill_loop"]
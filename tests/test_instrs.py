@@ -266,3 +266,52 @@ def test_auipc(instr: str, rd: R, correctval: int, imm: int, pc: int):
     rv.execute(rv.decode(instr_bin))
     expected = u.to_int32(correctval)
     assert rv.regs[rd] == expected, f"Found 0x{rv.regs[rd]:x}, expected 0x{expected:x}"
+
+
+@pytest.mark.parametrize(
+    "instr_bin",
+    [
+        0x02208033 | (R.X1 << 7),  # MUL, funct7 0x01 is not in RV32I
+        0x40209093,  # SLLI with funct7 0x20
+        0x00002063,  # Branch with funct3 0x2
+        0x00203083,  # LD, funct3 0x3 is not in RV32I
+    ],
+)
+def test_unknown_funct_is_noop(instr_bin: int):
+    rv = RV32I()
+    rv.set_pc(INITIAL_PC)
+    rv.set_reg(R.X1, 5)
+    rv.execute(rv.decode(instr_bin))
+    assert rv.xregs[R.X1] == 5
+    assert rv.pc_addr == INITIAL_PC + 4
+
+
+def test_subclass_handlers_are_dispatched():
+    class CountingRV32I(RV32I):
+        imm_count = 0
+
+        def execute_imm(self, instr):
+            self.imm_count += 1
+            super().execute_imm(instr)
+
+    rv = CountingRV32I()
+    rv.execute(rv.decode(asm("addi", R.X1, R.X0, imm=7)))
+    assert (rv.imm_count, rv.xregs[R.X1]) == (1, 7)
+    assert RV32I.handlers[0b0010011] is RV32I.execute_imm
+
+
+def test_decodes_are_shared_plain_ints():
+    word = asm("addi", R.X1, R.X2, imm=-3) & 0xFFFFFFFF
+    decoded = RV32I.decode(word)
+    assert decoded is RV32I.decode(word)
+    assert decoded is RV32I.decode(word - (1 << 32))  # Signed form of the same word
+    assert all(type(value) is int for value in (decoded.opcode, decoded.rd, decoded.rs1, decoded.imm))
+    assert not hasattr(decoded, "__dict__")
+
+
+def test_register_values_are_plain_ints():
+    rv = RV32I()
+    rv.set_reg(R.X5, np.int32(-1))
+    rv.regs[R.X6] = np.uint32(7)
+    assert rv.xregs[5:7] == [0xFFFFFFFF, 7] and all(type(value) is int for value in rv.xregs)
+    assert rv.regs[5:7] == [-1, 7]
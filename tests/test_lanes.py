@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from pyriscv import mem
+from pyriscv.assem import asm, asm_program, assemble
+from pyriscv.lanes import LaneGroup
+from pyriscv.rv32i import Regs as R, RV32I
+
+from programs import EBREAK, load_program
+
+
+# Counts Collatz steps for the input in x10, so lanes diverge and reconverge
+COLLATZ_PROGRAM = [
+    asm("lui", R.X20, imm=0x90000),  # RAM base
+    asm("addi", R.X5, R.X0, imm=0),
+    # loop:
+    asm("addi", R.X6, R.X0, imm=1),
+    asm("beq", rs1=R.X10, rs2=R.X6, imm=52),  # Branch to done
+    asm("andi", R.X7, R.X10, imm=1),
+    asm("beq", rs1=R.X7, rs2=R.X0, imm=20),  # Branch to even
+    asm("slli", R.X8, R.X10, imm=1),
+    asm("add", R.X10, R.X10, R.X8),
+    asm("addi", R.X10, R.X10, imm=1),
+    asm("jal", R.X0, imm=8),  # Jump to next
+    # even:
+    asm("srli", R.X10, R.X10, imm=1),
+    # next:
+    asm("addi", R.X5, R.X5, imm=1),
+    asm("andi", R.X9, R.X5, imm=0xFC),
+    asm("add", R.X9, R.X9, R.X20),
+    asm("sw", rs1=R.X9, rs2=R.X10, imm=0),
+    asm("jal", R.X0, imm=-52),  # Jump to loop
+    # done:
+    asm("sh", rs1=R.X20, rs2=R.X5, imm=0x102),
+    asm("lh", R.X12, R.X20, imm=0x100),
+    asm("lb", R.X11, R.X20, imm=0),
+    EBREAK,
+]
+
+INPUTS = [1, 2, 3, 6, 7, 9, 27, 97, 871, 0xFF]
+
+
+def run_single(value: int, max_instructions: int | None) -> RV32I:
+    rv = RV32I()
+    load_program(rv, COLLATZ_PROGRAM)
+    rv.set_reg(R.X10, value)
+    rv.run_program(max_instructions)
+    return rv
+
+
+@pytest.mark.parametrize("max_instructions", [None, 0, 5, 100, 400])
+def test_lanes_match_interpreter(max_instructions: int | None):
+    lanes = LaneGroup(len(INPUTS))
+    lanes.load_program(asm_program(COLLATZ_PROGRAM))
+    lanes.regs[:, R.X10] = INPUTS
+    lanes.run_program(max_instructions)
+
+    for lane, value in enumerate(INPUTS):
+        expected = run_single(value, max_instructions)
+        assert lanes.pc[lane] == expected.pc_addr, f"Lane {lane} PC differs"
+        assert list(lanes.regs[lane]) == expected.xregs, f"Lane {lane} registers differ"
+        np.testing.assert_array_equal(lanes.ram[lane], expected.memory.ram.bytes)
+
+
+def test_lanes_lockstep():
+    lanes = LaneGroup(100)
+    lanes.load_program(asm_program(COLLATZ_PROGRAM))
+    lanes.regs[:, R.X10] = 27
+    steps = lanes.run_program()
+    assert not lanes.running.any()
+    assert steps == lanes.instret[0]
+    assert (lanes.instret == lanes.instret[0]).all()
+    assert (lanes.regs[:, R.X5] == 111).all()
+
+
+def test_lanes_out_of_bounds():
+    lanes = LaneGroup(4)
+    lanes.load_program(asm_program([asm("lw", R.X5, R.X10, imm=0), EBREAK]))
+    lanes.regs[:, R.X10] = [0x90000000, 0x90000004, 0x10, 0x90000008]
+    with pytest.raises(RuntimeError):
+        lanes.run_program()
+
+
+def test_lanes_counter_csrs():
+    # Lanes leave the loop after different numbers of iterations, then read their counters
+    program = assemble("""
+    loop:
+        addi a0, a0, -1
+        bnez a0, loop
+        rdinstret a1
+        rdcycle a2
+        ebreak
+    """).data
+    lanes = LaneGroup(len(INPUTS))
+    lanes.load_program(program)
+    lanes.regs[:, R.X10] = INPUTS
+    lanes.run_program()
+
+    for lane, value in enumerate(INPUTS):
+        rv = RV32I()
+        rv.set_pc(rv.memory.load_program(program))
+        rv.set_reg(R.X10, value)
+        rv.run_program()
+        assert rv.xregs[R.X11] == 2 * value
+        assert list(lanes.regs[lane, R.X11:R.X13]) == rv.xregs[R.X11:R.X13]
+
+
+def test_lanes_need_rvmemory():
+    with pytest.raises(TypeError):
+        LaneGroup(2, mem.RiscofMemory())
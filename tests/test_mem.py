@@ -0,0 +1,114 @@
+import pytest
+
+from pyriscv import mem
+
+
+@pytest.mark.parametrize(
+    "size,value,expected_bytes",
+    [
+        (mem.DataSize.BYTE, 0x40302010, [0x10, 0x00, 0x00, 0x00]),
+        (mem.DataSize.HALF, 0x40302010, [0x10, 0x20, 0x00, 0x00]),
+        (mem.DataSize.WORD, 0x40302010, [0x10, 0x20, 0x30, 0x40]),
+        (mem.DataSize.WORD, 0xAAAAAAAA, [0xAA, 0xAA, 0xAA, 0xAA]),
+    ],
+)
+def test_region_write_read(size: mem.DataSize, value: int, expected_bytes: list[int]):
+    region = mem.MemoryRegion(0x100, 0x1000)
+    region.write(0x1010, size, value)
+    assert list(region.bytes[0x10:0x14]) == expected_bytes
+    assert list(region.buf[0x10:0x14]) == expected_bytes
+    expected = value & ((1 << (8 * size)) - 1)
+    result = region.read(0x1010, size)
+    assert result == expected, f"Got 0x{result:x}, expected 0x{expected:x}"
+
+
+def test_region_bounds():
+    region = mem.MemoryRegion(0x100, 0x1000)
+    assert region.addr_in_region(0x1000)
+    assert region.addr_in_region(0x10FF)
+    assert not region.addr_in_region(0x1100)
+    assert not region.addr_in_region(0xFFF)
+
+
+def test_load_program_offset():
+    memory = mem.RVMemory()
+    start_addr = memory.load_program(bytes([0x13, 0x00, 0x00, 0x00]), offset=0x10)
+    assert start_addr == memory.rom.start_offset + 0x10
+    assert memory.read(start_addr, mem.DataSize.WORD) == 0x13
+
+
+def test_load_program_too_large():
+    memory = mem.RVMemory()
+    with pytest.raises(AssertionError):
+        memory.load_program(bytes(memory.rom.size), offset=4)
+
+
+def test_paged_memory_lazy_allocation():
+    memory = mem.PagedMemory(program_start=0)
+    memory.map_region(0x0, 1 << 32, mem.Perm.RWX)  # Full 32-bit address map
+    assert memory.read(0xFFFFFFFC, mem.DataSize.WORD) == 0
+    assert not memory.pages
+
+    memory.write(0xFFFFFFFC, mem.DataSize.WORD, 0x40302010)
+    assert list(memory.pages) == [0xFFFFF]
+    assert memory.read(0xFFFFFFFC, mem.DataSize.WORD) == 0x40302010
+
+
+def test_paged_memory_cross_page_access():
+    memory = mem.PagedMemory(program_start=0)
+    memory.map_region(0x1000, 0x2000, mem.Perm.RW)
+    memory.write(0x1FFE, mem.DataSize.WORD, 0x40302010)
+    assert memory.read(0x1FFE, mem.DataSize.WORD) == 0x40302010
+    assert memory.read(0x2000, mem.DataSize.HALF) == 0x4030
+
+
+@pytest.mark.parametrize(
+    "perms,access",
+    [
+        (mem.Perm.RX, lambda m: m.write(0x1000, mem.DataSize.WORD, 0)),
+        (mem.Perm.W, lambda m: m.read(0x1000, mem.DataSize.WORD)),
+        (mem.Perm.RW, lambda m: m.fetch(0x1000)),
+        (mem.Perm.RWX, lambda m: m.read(0x3000, mem.DataSize.WORD)),  # Unmapped
+    ],
+)
+def test_paged_memory_permissions(perms: mem.Perm, access):
+    memory = mem.PagedMemory(program_start=0x1000)
+    memory.map_region(0x1000, 0x1000, perms)
+    memory.load_program(bytes(8))
+    with pytest.raises(RuntimeError):
+        access(memory)
+
+
+def test_paged_memory_bulk_copy_and_fill():
+    memory = mem.PagedMemory(program_start=0x1000)
+    memory.map_region(0x1000, 0x3000, mem.Perm.RW)
+    memory.map_region(0x4000, 0x1000, mem.Perm.R)
+    memory.load_data(0x1FF0, bytes(range(32)))
+
+    assert memory.copy(0x2FF8, 0x1FF0, 0x20)
+    assert memory.read(0x2FF8, mem.DataSize.WORD) == 0x03020100
+    assert memory.read(0x3014, mem.DataSize.WORD) == 0x1F1E1D1C
+    assert memory.copy(0x1000, 0x2400, 0x10)  # Unallocated pages read as zero
+    assert memory.read(0x1000, mem.DataSize.WORD) == 0
+
+    assert memory.fill(0x1100, 0xAABBCCDD, 0x1000)
+    assert memory.read(0x20FC, mem.DataSize.WORD) == 0xAABBCCDD
+    assert memory.read(0x2100, mem.DataSize.WORD) == 0x00000000
+
+    assert not memory.copy(0x1008, 0x1000, 0x10)  # Overlapping
+    assert not memory.copy(0x4000, 0x1000, 0x10)  # Read-only
+    assert not memory.fill(0x3FF0, 0, 0x20)  # Runs past the mapped regions
+    assert memory.read(0x3FF0, mem.DataSize.WORD) == 0
+
+
+def test_rv_memory_bulk_copy_invalidates_code():
+    memory = mem.RVMemory()
+    memory.load_data(0x90000100, bytes(range(16)))
+    memory.instr_cache[0x90000008] = object()
+    assert memory.copy(0x90000000, 0x90000100, 16)
+    assert memory.read(0x9000000C, mem.DataSize.WORD) == 0x0F0E0D0C
+    assert 0x90000008 not in memory.instr_cache
+
+    assert memory.fill(0x90000FF0, 0x11223344, 16)
+    assert not memory.fill(0x90000FF0, 0, 32)  # Past the end of RAM
+    assert not memory.copy(0x80000000, 0x90000000, 16)  # ROM is read-only
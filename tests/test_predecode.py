@@ -0,0 +1,62 @@
+import random
+
+import numpy as np
+import pytest
+
+from pyriscv.assem import asm
+from pyriscv.mem import RVMemory
+from pyriscv.predecode import decode_image
+from pyriscv.rv32i import Opcodes, Regs as R, RV32I
+
+
+def random_image(count: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    opcodes = list(Opcodes) + [0x7F, 0x0B]  # Some words that are not RV32I instructions
+    words = [(rng.getrandbits(25) << 7) | rng.choice(opcodes) for _ in range(count)]
+    return np.array(words, dtype="<u4").tobytes()
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_arrays_match_scalar_decode(seed: int):
+    image = decode_image(random_image(2000, seed), 0x80000000)
+    assert len(image) == 2000
+    for index in range(len(image)):
+        word = int(image.words[index])
+        if not image.valid[index]:
+            with pytest.raises(RuntimeError):
+                RV32I.decode(word)
+            assert image.instr(index) is None
+            continue
+        decoded = RV32I.decode(word)
+        assert image.instr(index) is decoded
+        fields = (image.opcode, image.rd, image.rs1, image.rs2, image.funct3, image.funct7)
+        assert [int(field[index]) for field in fields] == [decoded.opcode, decoded.rd, decoded.rs1, decoded.rs2,
+                                                           decoded.funct3, decoded.funct7]
+        assert int(image.imm[index]) == (decoded.imm or 0)
+
+
+def test_fill_cache_shares_decodes():
+    program = [asm("addi", R.X1, R.X1, imm=1)] * 3 + [asm("jal", R.X0, imm=-12), 0xFFFFFFFF]
+    data = np.array(program, dtype=np.int64).astype("<u4").tobytes()
+    rv = RV32I()
+    start = rv.memory.load_program(data)
+
+    image = decode_image(data, start)
+    assert image.fill_cache(rv.memory) == 4
+    cache = rv.memory.instr_cache
+    assert sorted(cache) == [start, start + 4, start + 8, start + 12]
+    assert cache[start] is cache[start + 8]
+
+    rv.set_pc(start)
+    rv.run_program(8)
+    assert rv.xregs[R.X1] == 6
+    assert cache[start + 12] == RV32I.decode(program[3])
+
+
+def test_fill_cache_entries_are_invalidated():
+    memory = RVMemory()
+    data = np.array([asm("addi", R.X1, R.X0, imm=1)] * 2, dtype="<u4").tobytes()
+    start = memory.load_program(data)
+    decode_image(data, start).fill_cache(memory)
+    memory.load_data(start + 4, bytes(4))
+    assert list(memory.instr_cache) == [start]
@@ -0,0 +1,57 @@
+import os
+
+from pyriscv.assem import asm
+from pyriscv.profiler import Profiler
+from pyriscv.rv32i import Regs as R, RV32I
+
+from programs import EBREAK, load_program
+
+
+BASIC_ASM_ELF = os.path.join(os.path.dirname(__file__), "data", "basic_asm.elf")
+
+
+def test_profile_elf():
+    rv = RV32I()
+    profiler = Profiler(rv.load_elf(BASIC_ASM_ELF))
+    rv.run_program(profiler=profiler)
+    assert rv.regs[R.X11] == 2000
+
+    self_counts, inclusive_counts = profiler.function_counts()
+    main = 0x80000064
+    assert self_counts[main] == 3
+    assert inclusive_counts[0x80000000] == sum(profiler.pc_counts.values())
+    assert profiler.block_counts[main] == 1
+    assert "_start;main 3\n" in profiler.collapsed_stacks()
+    assert "main" in profiler.flat_profile()
+
+
+def test_profile_nested_calls():
+    rv = RV32I()
+    program = [
+        asm("addi", R.X10, R.X0, imm=3),
+        # loop:
+        asm("jal", R.X1, imm=20),  # Call outer
+        asm("addi", R.X10, R.X10, imm=-1),
+        asm("bne", rs1=R.X10, rs2=R.X0, imm=-8),
+        EBREAK,
+        asm("addi", R.X0, R.X0, imm=0),
+        # outer:
+        asm("addi", R.X2, R.X1, imm=0),  # Save return address
+        asm("jal", R.X1, imm=12),  # Call inner
+        asm("jalr", R.X0, R.X2, imm=0),  # Return, not through a link register
+        asm("addi", R.X0, R.X0, imm=0),
+        # inner:
+        asm("addi", R.X11, R.X11, imm=1),
+        asm("jalr", R.X0, R.X1, imm=0),  # Return
+    ]
+    start = load_program(rv, program)
+    profiler = Profiler()
+    rv.run_program(profiler=profiler)
+
+    assert rv.xregs[R.X11] == 3
+    outer, inner = start + 24, start + 40
+    assert profiler.stack_counts[(start, outer, inner)] == 6
+    # outer returns through x2 rather than ra, which should still pop its frame
+    assert profiler.stack_counts[(start, outer)] == 9
+    assert profiler.call_stack == [(start, 0)]
+    assert f"0x{start:08x};0x{outer:08x};0x{inner:08x} 6" in profiler.collapsed_stacks()
@@ -0,0 +1,117 @@
+import pytest
+
+import numpy as np
+
+from pyriscv import mem
+from pyriscv.assem import asm
+from pyriscv.rv32i import Csrs, Regs as R, RV32I
+from pyriscv.stats import Stats
+
+from programs import EBREAK, load_program
+
+
+@pytest.mark.parametrize("translate", [False, True])
+def test_self_modifying_code(translate: bool):
+    rv = RV32I(mem.RiscofMemory())
+    load_program(rv, [
+        asm("addi", R.X5, R.X0, imm=0),
+        asm("addi", R.X6, R.X6, imm=1),  # Overwritten after first pass
+        asm("addi", R.X5, R.X5, imm=1),
+        asm("lui", R.X1, imm=0x80000),
+        asm("sw", rs1=R.X1, rs2=R.X7, imm=4),
+        asm("addi", R.X8, R.X0, imm=2),
+        asm("blt", rs1=R.X5, rs2=R.X8, imm=-20),
+        EBREAK,
+    ])
+    rv.set_reg(R.X7, asm("addi", R.X6, R.X6, imm=100))
+    rv.run_program(translate=translate)
+    assert rv.regs[R.X6] == 101, f"Found {rv.regs[R.X6]}, expected 101"
+
+
+LOOP_PROGRAM = [
+    asm("lui", R.X10, imm=0x90000),  # RAM base
+    asm("addi", R.X5, R.X0, imm=0),
+    asm("addi", R.X6, R.X0, imm=50),
+    asm("addi", R.X7, R.X0, imm=-3),
+    # loop:
+    asm("addi", R.X5, R.X5, imm=1),
+    asm("add", R.X7, R.X7, R.X5),
+    asm("sub", R.X8, R.X7, R.X6),
+    asm("xori", R.X9, R.X8, imm=-0x55),
+    asm("sll", R.X11, R.X9, R.X5),
+    asm("sra", R.X12, R.X11, R.X5),
+    asm("srli", R.X13, R.X11, imm=3),
+    asm("slt", R.X14, R.X8, R.X0),
+    asm("sltiu", R.X15, R.X9, imm=-1),
+    asm("sw", rs1=R.X10, rs2=R.X11, imm=0),
+    asm("sb", rs1=R.X10, rs2=R.X9, imm=5),
+    asm("lb", R.X16, R.X10, imm=5),
+    asm("lhu", R.X17, R.X10, imm=0),
+    asm("jal", R.X1, imm=12),  # Call function
+    asm("blt", rs1=R.X5, rs2=R.X6, imm=-56),
+    EBREAK,
+    # function:
+    asm("auipc", R.X18, imm=1),
+    asm("or", R.X19, R.X18, R.X17),
+    asm("jalr", R.X0, R.X1, imm=0),
+]
+
+
+def run_loop_program(translate: bool, max_instructions: int | None = None) -> RV32I:
+    rv = RV32I()
+    load_program(rv, LOOP_PROGRAM)
+    rv.run_program(max_instructions, translate=translate)
+    return rv
+
+
+def assert_same_state(rv: RV32I, expected: RV32I) -> None:
+    assert rv.pc == expected.pc, f"Found PC 0x{rv.pc:x}, expected 0x{expected.pc:x}"
+    np.testing.assert_array_equal(rv.regs, expected.regs)
+    np.testing.assert_array_equal(rv.memory.ram.bytes, expected.memory.ram.bytes)
+
+
+@pytest.mark.parametrize("max_instructions", [None, 0, 1, 7, 100, 555])
+def test_translate_matches_interpreter(max_instructions: int | None):
+    expected = run_loop_program(False, max_instructions)
+    rv = run_loop_program(True, max_instructions)
+    assert_same_state(rv, expected)
+
+
+def csrr(rd: int, csr: int) -> int:
+    """CSRRS rd, csr, x0, as used by the rdcycle/rdinstret pseudo-instructions"""
+    return (csr << 20) | (0x2 << 12) | (rd << 7) | 0x73
+
+
+@pytest.mark.parametrize("translate", [False, True])
+def test_instret_csr(translate: bool):
+    rv = RV32I()
+    load_program(rv, [
+        asm("addi", R.X5, R.X0, imm=1),
+        asm("addi", R.X5, R.X5, imm=1),
+        csrr(R.X6, Csrs.INSTRET),
+        csrr(R.X7, Csrs.CYCLE),
+        csrr(R.X8, Csrs.INSTRETH),
+        asm("addi", R.X5, R.X5, imm=1),
+        csrr(R.X9, Csrs.INSTRET),
+        EBREAK,
+    ])
+    rv.run_program(translate=translate)
+    assert [rv.xregs[reg] for reg in (R.X6, R.X7, R.X8, R.X9)] == [2, 3, 0, 6]
+    assert rv.instret == 7, "EBREAK should not be counted as retired"
+
+
+@pytest.mark.parametrize("max_instructions", [None, 7, 555])
+def test_instret_matches_stats(max_instructions: int | None):
+    expected = run_loop_program(False, max_instructions)
+    rv = run_loop_program(True, max_instructions)
+    assert rv.instret == expected.instret
+
+    stats = Stats()
+    rv = RV32I()
+    load_program(rv, LOOP_PROGRAM)
+    rv.run_program(max_instructions, stats=stats)
+    assert_same_state(rv, expected)
+    # The histogram includes the final EBREAK, which is not retired
+    ebreaks = 1 if max_instructions is None else 0
+    assert stats.instructions == rv.instret == sum(stats.counts.values()) - ebreaks
+    assert stats.opcode_counts()["BRANCH"] == stats.funct3_counts("BRANCH")[0x4]
@@ -0,0 +1,70 @@
+import io
+import json
+import os
+
+import pytest
+
+from pyriscv import mem
+from pyriscv.assem import asm
+from pyriscv.rv32i import Regs as R, RV32I
+from pyriscv.server import JobServer
+
+from programs import EBREAK, load_program
+
+
+# Adds the word at the start of RAM to x10 and stores the sum after it
+PROGRAM = [
+    asm("lui", R.X5, imm=0x90000),
+    asm("lw", R.X6, R.X5, imm=0),
+    asm("add", R.X6, R.X6, R.X10),
+    asm("sw", rs1=R.X5, rs2=R.X6, imm=4),
+    EBREAK,
+]
+
+MODES = [pytest.param(True, marks=pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires os.fork")), False]
+
+
+def make_server(fork: bool, translate: bool = False) -> JobServer:
+    rv = RV32I(mem.RVMemory())
+    load_program(rv, PROGRAM)
+    rv.run_until(rv.pc_addr + 4)  # Boot past the first instruction
+    return JobServer(rv, fork=fork, translate=translate)
+
+
+@pytest.mark.parametrize("fork", MODES)
+def test_jobs_start_from_booted_state(fork: bool):
+    server = make_server(fork)
+    jobs = [
+        {"id": 1, "regs": {"10": 5}, "memory": {"0x90000000": "03000000"}, "signature": ["0x90000000", "0x90000008"]},
+        {"id": 2, "regs": {"10": -1}, "signature": [0x90000004, 0x90000008]},
+    ]
+    infile = io.StringIO("".join(json.dumps(job) + "\n" for job in jobs))
+    outfile = io.StringIO()
+    server.serve(infile, outfile)
+
+    results = [json.loads(line) for line in outfile.getvalue().splitlines()]
+    assert results[0]["id"] == 1
+    assert results[0]["signature"] == [3, 8]
+    # Memory patched by the first job is not seen by the second
+    assert results[1]["signature"] == [0xFFFFFFFF]
+    assert results[1]["regs"][R.X10] == 0xFFFFFFFF
+    assert results[1]["pc"] == server.rv.memory.rom.start_offset + 16
+
+
+def test_translations_survive_jobs():
+    server = make_server(fork=False, translate=True)
+    first = server.run_job({"id": 1, "regs": {"10": 2}, "signature": [0x90000004, 0x90000008]})
+    blocks = dict(server.rv.translator.blocks)
+    assert blocks
+
+    second = server.run_job({"id": 2, "regs": {"10": 3}, "signature": [0x90000004, 0x90000008]})
+    assert (first["signature"], second["signature"]) == ([2], [3])
+    assert server.rv.translator.blocks == blocks, "Restoring the booted state should keep translated blocks"
+
+
+@pytest.mark.parametrize("fork", MODES)
+def test_job_errors(fork: bool):
+    server = make_server(fork)
+    assert "error" in json.loads(server.handle_line("not json"))
+    result = server.run_job({"id": 3, "memory": {"0x10": "00"}})
+    assert result["id"] == 3 and result["error"].startswith("RuntimeError")
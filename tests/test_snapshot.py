@@ -0,0 +1,78 @@
+import pytest
+
+from pyriscv import mem
+from pyriscv.assem import asm
+from pyriscv.rv32i import Regs as R, RV32I
+from pyriscv.snapshot import Snapshot
+
+from programs import EBREAK, load_program
+
+
+PROGRAM = [
+    asm("lui", R.X10, imm=0x80001),  # Data address, inside RiscofMemory
+    asm("addi", R.X5, R.X0, imm=0),
+    asm("addi", R.X6, R.X0, imm=10),
+    # loop:
+    asm("lw", R.X7, R.X10, imm=0),
+    asm("add", R.X7, R.X7, R.X5),
+    asm("sw", rs1=R.X10, rs2=R.X7, imm=0),
+    asm("addi", R.X5, R.X5, imm=1),
+    asm("blt", rs1=R.X5, rs2=R.X6, imm=-16),
+    EBREAK,
+]
+
+
+def test_paged_snapshot_copy_on_write():
+    memory = mem.RiscofMemory()
+    memory.write(0x80001000, mem.DataSize.WORD, 0x11111111)
+    contents = memory.snapshot()
+    assert contents[0x80001000] is memory.pages[0x80001], "Pages should be shared, not copied"
+
+    memory.write(0x80001000, mem.DataSize.WORD, 0x22222222)
+    memory.write(0x80005000, mem.DataSize.WORD, 0x33333333)
+    assert contents[0x80001000][:4] == bytes([0x11] * 4)
+
+    memory.restore(contents)
+    assert memory.read(0x80001000, mem.DataSize.WORD) == 0x11111111
+    assert memory.read(0x80005000, mem.DataSize.WORD) == 0
+    assert 0x80005 not in memory.pages
+
+
+@pytest.mark.parametrize("memory_type", [mem.RVMemory, mem.RiscofMemory])
+@pytest.mark.parametrize("translate", [False, True])
+def test_restore_reruns_identically(memory_type: type[mem.Memory], translate: bool, tmp_path):
+    rv = RV32I(memory_type())
+    program = PROGRAM if memory_type is mem.RiscofMemory else [asm("lui", R.X10, imm=0x90000)] + PROGRAM[1:]
+    load_program(rv, program)
+    assert rv.run_until(rv.pc_addr + 12)
+    snapshot = rv.snapshot()
+    snapshot.save(tmp_path / "state.snap")
+
+    rv.run_program(translate=translate)
+    expected_regs, expected_pc = list(rv.xregs), rv.pc_addr
+    result_addr = rv.xregs[R.X10]
+    assert rv.memory.read(result_addr, mem.DataSize.WORD) == 45
+
+    for restored in (snapshot, Snapshot.from_file(tmp_path / "state.snap")):
+        rv.restore(restored)
+        assert rv.memory.read(result_addr, mem.DataSize.WORD) == 0
+        rv.run_program(translate=translate)
+        assert rv.xregs == expected_regs
+        assert rv.pc_addr == expected_pc
+        assert rv.memory.read(result_addr, mem.DataSize.WORD) == 45
+
+
+@pytest.mark.parametrize("translate", [False, True])
+def test_restore_drops_code_written_after_snapshot(translate: bool):
+    rv = RV32I(mem.RiscofMemory())
+    start = load_program(rv, [asm("addi", R.X5, R.X5, imm=1), EBREAK])
+    snapshot = rv.snapshot()
+
+    # Replace the ADDI before it has ever been decoded, so nothing cached is invalidated by the write
+    rv.memory.write(start, mem.DataSize.WORD, asm("addi", R.X5, R.X5, imm=7))
+    rv.run_program(translate=translate)
+    assert rv.xregs[R.X5] == 7
+
+    rv.restore(snapshot)
+    rv.run_program(translate=translate)
+    assert rv.xregs[R.X5] == 1
@@ -0,0 +1,62 @@
+import pytest
+
+from pyriscv import trace
+from pyriscv.assem import asm
+from pyriscv.rv32i import Regs as R, RV32I
+
+from programs import EBREAK, load_program
+
+
+PROGRAM = [
+    asm("lui", R.X10, imm=0x90000),
+    asm("addi", R.X5, R.X0, imm=-2),
+    # loop:
+    asm("sh", rs1=R.X10, rs2=R.X5, imm=2),
+    asm("lb", R.X6, R.X10, imm=2),
+    asm("addi", R.X5, R.X5, imm=1),
+    asm("bne", rs1=R.X5, rs2=R.X0, imm=-12),
+    EBREAK,
+]
+
+
+def run(trace_writer: trace.TraceWriter | None = None) -> RV32I:
+    rv = RV32I()
+    load_program(rv, PROGRAM)
+    rv.run_program(trace=trace_writer)
+    return rv
+
+
+@pytest.mark.parametrize("buffer_size", [trace.BUFFER_SIZE, 7])
+def test_trace_round_trip(buffer_size: int, tmp_path, monkeypatch):
+    # A tiny buffer forces flushes and records split across read chunks
+    monkeypatch.setattr(trace, "BUFFER_SIZE", buffer_size)
+    path = tmp_path / "run.trace"
+    with trace.TraceWriter.open(path) as trace_writer:
+        rv = run(trace_writer)
+
+    expected = run()
+    assert rv.xregs == expected.xregs and rv.pc_addr == expected.pc_addr
+
+    records = list(trace.read_trace(path))
+    assert len(records) == rv.instret == trace_writer.records == 10
+    assert [record.pc - records[0].pc for record in records[:6]] == [0, 4, 8, 12, 16, 20]
+    assert records[0].instr == PROGRAM[0] & 0xFFFFFFFF
+
+    store, load, branch = records[2], records[3], records[5]
+    assert (store.rd, store.mem_addr, store.mem_value, store.mem_size, store.mem_write) == (
+        0, 0x90000002, 0xFFFE, 2, True
+    )
+    assert (load.rd, load.rd_value, load.mem_addr, load.mem_value, load.mem_write) == (
+        R.X6, 0xFFFFFFFE, 0x90000002, 0xFE, False
+    )
+    assert branch.rd == 0 and branch.mem_addr is None
+    assert str(store) == f"0x{store.pc:08x} (0x{store.instr:08x}) mem16 0x90000002 0xfffe"
+
+
+def test_truncated_trace(tmp_path):
+    path = tmp_path / "run.trace"
+    with trace.TraceWriter.open(path) as trace_writer:
+        run(trace_writer)
+    path.write_bytes(path.read_bytes()[:-3])
+    with pytest.raises(RuntimeError):
+        list(trace.read_trace(path))
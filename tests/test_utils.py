@@ -65,3 +65,12 @@ def test_bits_to_uint(val: str, expected: int):
 def test_bits_to_int(val: str, expected: int):
     result = u.bits_to_int(val)
     assert result == expected, f"Got {result}, expected {expected}"
+
+
+@pytest.mark.parametrize(
+    "val,width,expected",
+    [(0x001, 12, 1), (0x7FF, 12, 0x7FF), (0x800, 12, -0x800), (0xFFF, 12, -1), (0x1FFF, 12, -1)],
+)
+def test_sign_extend(val: int, width: int, expected: int):
+    result = u.sign_extend(val, width)
+    assert result == expected, f"Got {result}, expected {expected}"